@@ -0,0 +1,115 @@
+"""
+Memory / CPU benchmark of the row formats in utils/row_formats.py.
+
+Fetches message-shaped rows (the 15 columns /api/messages returns, generated
+server-side with generate_series - no tables needed) from a LOCAL Postgres
+once per row format, and reports per 100k rows:
+
+    held MB     memory retained by the fetched result list (tracemalloc)
+    peak MB     peak allocation while fetching it
+    fetch ms    execute_query() wall time, network included
+    json ms     CPU time serializing it with the /api/messages JSON writer
+    csv ms      CPU time serializing it with the /api/export CSV writer
+
+Usage:
+    python benchmark_row_formats.py                    # 100k rows, localhost:5432, user/db postgres
+    python benchmark_row_formats.py --rows 500000 --repeat 5
+"""
+
+import argparse
+import gc
+import logging
+import os
+import time
+import tracemalloc
+
+from dotenv import load_dotenv
+load_dotenv()
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s: %(message)s')
+
+os.environ['DB_MIGRATE_ON_STARTUP'] = 'false'
+
+from flask import Flask
+
+from utils.db_manager import DatabaseManager
+from utils.row_formats import ROW_FORMATS, iter_csv, iter_json_array
+
+QUERY = """
+    SELECT 'wamid.HBgM' || md5(g::text) AS id,
+           (254700000000 + g %% 2000)::text AS wa_id,
+           'Guest ' || g %% 2000 AS name,
+           'text' AS type,
+           'Hello, is the venue still the same for Saturday? #' || g AS body,
+           NOW() - g * INTERVAL '1 minute' AS timestamp,
+           CASE WHEN g %% 2 = 0 THEN 'outbound' ELSE 'inbound' END AS direction,
+           'delivered' AS status,
+           g %% 47 <> 0 AS read,
+           NULL::text AS image_url,
+           NULL::varchar AS image_id,
+           NULL::text AS error_details,
+           CASE WHEN g %% 2 = 0 THEN g %% 100 END AS event_id,
+           NULL::varchar AS template_name,
+           NOW() - g * INTERVAL '1 minute' AS updated_at
+    FROM generate_series(1, %s) AS g
+"""
+
+COLUMNS = ['id', 'wa_id', 'name', 'type', 'body', 'timestamp', 'direction', 'status', 'read', 'image_url',
+           'image_id', 'error_details', 'event_id', 'template_name', 'updated_at']
+
+
+def measure(db, row_format, rows, dumps):
+    """One fetch + serialize run for `row_format`; returns raw (unscaled) figures."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    result = db.execute_query(QUERY, (rows,), fetch=True, row_format=row_format)
+    fetch = time.perf_counter() - started
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.process_time()
+    for _ in iter_json_array([result], dumps):
+        pass
+    json_cpu = time.process_time() - started
+
+    started = time.process_time()
+    for _ in iter_csv([result], COLUMNS):
+        pass
+    csv_cpu = time.process_time() - started
+
+    del result
+    return {'held': held - before, 'peak': peak - before, 'fetch': fetch, 'json': json_cpu, 'csv': csv_cpu}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=os.getenv('BENCH_DB_HOST', 'localhost'))
+    parser.add_argument("--port", default=os.getenv('BENCH_DB_PORT', '5432'))
+    parser.add_argument("--dbname", default=os.getenv('BENCH_DB_NAME', 'postgres'))
+    parser.add_argument("--user", default=os.getenv('BENCH_DB_USER', 'postgres'))
+    parser.add_argument("--password", default=os.getenv('BENCH_DB_PASSWORD', 'postgres'))
+    parser.add_argument("--rows", type=int, default=100000, help="rows fetched per run")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per format (best is reported)")
+    args = parser.parse_args()
+
+    db = DatabaseManager(args.host, args.port, args.dbname, args.user, args.password,
+                         sslmode='disable', channel_binding='disable')
+    dumps = Flask(__name__).json.dumps
+    scale = 100000 / args.rows
+
+    print(f"{args.rows} rows per run, best of {args.repeat}, figures per 100k rows\n")
+    print(f"{'format':<8} {'held MB':>9} {'peak MB':>9} {'fetch ms':>9} {'json ms':>9} {'csv ms':>9}")
+    baseline = None
+    for row_format in ROW_FORMATS:
+        runs = [measure(db, row_format, args.rows, dumps) for _ in range(args.repeat)]
+        best = {key: min(run[key] for run in runs) * scale for key in runs[0]}
+        baseline = baseline or best
+        print(f"{row_format:<8} {best['held'] / 2**20:>9.1f} {best['peak'] / 2**20:>9.1f} "
+              f"{best['fetch'] * 1000:>9.0f} {best['json'] * 1000:>9.0f} {best['csv'] * 1000:>9.0f}"
+              f"   (held {best['held'] / baseline['held']:.0%} of dict)")
+
+
+if __name__ == "__main__":
+    main()
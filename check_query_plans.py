@@ -0,0 +1,186 @@
+"""
+Query-plan regression check for the hot message-table queries.
+
+Builds a scratch schema on a LOCAL Postgres, applies every migration to it,
+seeds enough rows for the planner to prefer indexes, then runs EXPLAIN on
+each hot query and fails if any of them falls back to a sequential scan of
+a message table, conversation_summaries or stream_events. Run it after touching a hot
+query or the indexes in utils/migrations.py. Never point it at production.
+
+Usage:
+    python check_query_plans.py                          # localhost:5432, user/db postgres
+    python check_query_plans.py --host db --rows 200000
+    python check_query_plans.py --keep                   # leave the scratch schema for poking at
+"""
+
+import argparse
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+load_dotenv()
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s: %(message)s')
+
+# Only the scratch schema below gets migrated.
+os.environ['DB_MIGRATE_ON_STARTUP'] = 'false'
+
+from utils.conversation_summaries import build_rebuild_summaries, build_refresh_summaries, chat_list_query
+from utils.db_manager import DatabaseManager
+from utils.migrations import run_migrations
+from utils.threads import thread_page_query, thread_updates_query
+
+SCHEMA = 'plan_check'
+TABLE = f'{SCHEMA}.eventio_messages'
+WA_ID = '254700000007'
+EVENT_ID = 7
+
+# (label, query, params) - keep in sync with the queries in views.py,
+# utils/db_manager.py and utils/whatsapp_utils.py they're named after.
+HOT_QUERIES = [
+    ("/api/chats/<wa_id> newest page",
+     *thread_page_query(TABLE, WA_ID, 50)),
+    ("/api/chats/<wa_id> older page",
+     *thread_page_query(TABLE, WA_ID, 50, before=(datetime.now(timezone.utc) - timedelta(days=7), 'wamid.1'))),
+    ("/api/chats/<wa_id> poll",
+     *thread_page_query(TABLE, WA_ID, 50, after=(datetime.now(timezone.utc) - timedelta(hours=1), 'wamid.1'))),
+    ("/api/chats/<wa_id> poll status updates",
+     *thread_updates_query(TABLE, WA_ID, (datetime.now(timezone.utc), 'wamid.1'),
+                           datetime.now(timezone.utc) - timedelta(minutes=1), 50)),
+    ("get_conversation_context / AI history",
+     f"SELECT direction, body, timestamp FROM {TABLE} WHERE wa_id = %s ORDER BY timestamp DESC LIMIT %s",
+     (WA_ID, 20)),
+    ("get_last_outbound_event_id",
+     f"""SELECT event_id FROM {TABLE}
+         WHERE wa_id = %s AND direction = 'outbound' AND event_id IS NOT NULL
+         ORDER BY timestamp DESC LIMIT 1""", (WA_ID,)),
+    ("conversation summary rebuild unread counts",
+     f"""SELECT wa_id, COUNT(*) AS unread_count FROM {TABLE}
+         WHERE direction = 'inbound' AND read = FALSE GROUP BY wa_id""", None),
+    ("/api/mark-read",
+     f"""UPDATE {TABLE} SET read = TRUE
+         WHERE wa_id = %s AND direction = 'inbound' AND read = FALSE""", (WA_ID,)),
+    ("/api/events/<id>/conversations/<wa_id> thread",
+     f"""SELECT * FROM {TABLE} WHERE event_id = %s AND wa_id = %s ORDER BY timestamp ASC""",
+     (EVENT_ID, WA_ID)),
+    ("/api/events/<id>/messages",
+     f"SELECT * FROM {TABLE} WHERE event_id = %s ORDER BY timestamp DESC LIMIT %s", (EVENT_ID, 200)),
+    ("/api/events/<id>/stats",
+     f"""SELECT COUNT(*) FILTER (WHERE direction = 'outbound') AS sent,
+                COUNT(DISTINCT wa_id) FILTER (WHERE direction = 'inbound') AS replied
+         FROM {TABLE} WHERE event_id = %s""", (EVENT_ID,)),
+    ("conversation summary refresh (every message write)",
+     *build_refresh_summaries({TABLE: [WA_ID]})[1]),
+    ("/api/chats next page",
+     *chat_list_query(TABLE, 50, after=(datetime.now(timezone.utc) - timedelta(days=7), WA_ID))),
+    ("/api/chats name search",
+     *chat_list_query(TABLE, 50, q='Guest 1234')),
+    ("/api/chats phone search",
+     *chat_list_query(TABLE, 50, q='+254 700 001 234')),
+    ("/messages/<phone_id> stream since",
+     f"SELECT * FROM {TABLE} WHERE timestamp >= %s ORDER BY timestamp DESC",
+     (datetime.now(timezone.utc) - timedelta(days=1),)),
+    ("/api/export date range",
+     f"""SELECT id, wa_id, name, type, body, timestamp, direction, status, read, image_url, event_id
+         FROM {TABLE} WHERE timestamp >= %s AND timestamp < (%s::date + INTERVAL '1 day')
+         ORDER BY timestamp ASC""",
+     ((datetime.now(timezone.utc) - timedelta(days=1)).date(), datetime.now(timezone.utc).date())),
+    ("/api/stream poll",
+     f"""SELECT id, tenant, type, wa_id, payload, created_at FROM {SCHEMA}.stream_events
+         WHERE tenant = ANY(%s) AND created_at > %s - INTERVAL '5 seconds'
+         ORDER BY created_at, id LIMIT %s""",
+     (['eventio'], datetime.now(timezone.utc) - timedelta(seconds=1), 1000)),
+    ("/api/stream resume",
+     f"""SELECT id, type, wa_id, payload FROM {SCHEMA}.stream_events
+         WHERE tenant = %s AND id <> %s AND created_at > %s - INTERVAL '5 seconds'
+         ORDER BY created_at, id LIMIT %s""",
+     ('eventio', 1, datetime.now(timezone.utc) - timedelta(minutes=1), 1001)),
+    ("/api/messages since",
+     f"SELECT * FROM {TABLE} WHERE updated_at > NOW() - INTERVAL '5 minutes' ORDER BY updated_at ASC LIMIT %s",
+     (2000,)),
+]
+
+
+def seed(db, rows, contacts):
+    """Roughly production-shaped rows: both directions per contact, ~2% unread, 100 events."""
+    db.execute_query(f"""
+        INSERT INTO {TABLE}
+            (id, wa_id, name, type, body, timestamp, direction, status, read, event_id, updated_at)
+        SELECT
+            'wamid.' || g,
+            (254700000000 + g %% %(contacts)s)::text,
+            'Guest ' || g %% %(contacts)s,
+            'text',
+            'message ' || g,
+            NOW() - g * INTERVAL '1 minute',
+            CASE WHEN (g / %(contacts)s) %% 2 = 0 THEN 'outbound' ELSE 'inbound' END,
+            'delivered',
+            (g / %(contacts)s) %% 2 = 0 OR g %% 47 <> 0,
+            CASE WHEN (g / %(contacts)s) %% 2 = 0 THEN g %% 100 END,
+            NOW() - g * INTERVAL '1 minute'
+        FROM generate_series(1, %(rows)s) AS g
+    """, {'contacts': contacts, 'rows': rows})
+    db.execute_query(f"ANALYZE {TABLE}")
+    db.execute_query(f"""
+        INSERT INTO {SCHEMA}.stream_events (tenant, type, wa_id, payload, created_at)
+        SELECT 'eventio', 'message.created', (254700000000 + g %% %(contacts)s)::text,
+               jsonb_build_object('id', 'wamid.' || g), NOW() - g * INTERVAL '1 second'
+        FROM generate_series(1, %(rows)s) AS g
+    """, {'contacts': contacts, 'rows': rows})
+    db.execute_query(f"ANALYZE {SCHEMA}.stream_events")
+
+
+def seq_scanned_tables(plan):
+    """Names of message / summary / event tables read by a Seq Scan anywhere in an EXPLAIN JSON plan."""
+    found = []
+    relation = plan.get('Relation Name', '')
+    if plan.get('Node Type') == 'Seq Scan' and (
+            relation.endswith('_messages') or relation in ('conversation_summaries', 'stream_events')):
+        found.append(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        found.extend(seq_scanned_tables(child))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=os.getenv('PLAN_CHECK_DB_HOST', 'localhost'))
+    parser.add_argument("--port", default=os.getenv('PLAN_CHECK_DB_PORT', '5432'))
+    parser.add_argument("--dbname", default=os.getenv('PLAN_CHECK_DB_NAME', 'postgres'))
+    parser.add_argument("--user", default=os.getenv('PLAN_CHECK_DB_USER', 'postgres'))
+    parser.add_argument("--password", default=os.getenv('PLAN_CHECK_DB_PASSWORD', 'postgres'))
+    parser.add_argument("--rows", type=int, default=100000, help="rows to seed")
+    parser.add_argument("--contacts", type=int, default=2000, help="distinct wa_ids to spread them over")
+    parser.add_argument("--keep", action="store_true", help="don't drop the scratch schema afterwards")
+    args = parser.parse_args()
+
+    db = DatabaseManager(args.host, args.port, args.dbname, args.user, args.password,
+                         sslmode='disable', channel_binding='disable')
+    db.execute_query(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    db.execute_query(f"CREATE SCHEMA {SCHEMA}")
+    failures = 0
+    try:
+        run_migrations(db, schema=SCHEMA)
+        seed(db, args.rows, args.contacts)
+
+        for label, query, params in HOT_QUERIES:
+            rows = db.execute_query(f"EXPLAIN (FORMAT JSON) {query}", params, fetch=True)
+            plan = rows[0]['QUERY PLAN'][0]['Plan']
+            scanned = seq_scanned_tables(plan)
+            if scanned:
+                failures += 1
+                print(f"❌ {label}: Seq Scan on {', '.join(scanned)}")
+            else:
+                print(f"✅ {label}: {plan['Node Type']} (cost {plan['Total Cost']})")
+    finally:
+        if not args.keep:
+            db.execute_query(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+
+    print(f"\n{len(HOT_QUERIES) - failures}/{len(HOT_QUERIES)} hot queries use an index")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -45,4 +45,29 @@ SMTP_SECURE = os.getenv("SMTP_SECURE", "tls")  # "ssl" (implicit TLS, e.g. port
 EMAIL_FROM = os.getenv("EMAIL_FROM", SMTP_USERNAME)
 EMAIL_FROM_NAME = os.getenv("EMAIL_FROM_NAME", "Eventio")
 DIGEST_HOUR_UTC = os.getenv("DIGEST_HOUR_UTC", "6")
-DIGEST_SECRET = os.getenv("DIGEST_SECRET")
\ No newline at end of file
+DIGEST_SECRET = os.getenv("DIGEST_SECRET")
+OPS_SECRET = os.getenv("OPS_SECRET")  # required (X-Ops-Secret or Authorization: Bearer) by the operational endpoints
+
+# Webhook ingest configuration
+WEBHOOK_INGEST_MODE = os.getenv("WEBHOOK_INGEST_MODE", "sync")  # "sync" (process inline) or "queue" (ack, then process in background)
+WEBHOOK_QUEUE_PATH = os.getenv("WEBHOOK_QUEUE_PATH", "data/webhook_queue.sqlite3")
+WEBHOOK_QUEUE_WORKERS = os.getenv("WEBHOOK_QUEUE_WORKERS", "2")
+WEBHOOK_QUEUE_LEASE_SECONDS = os.getenv("WEBHOOK_QUEUE_LEASE_SECONDS", "300")
+WEBHOOK_QUEUE_MAX_ATTEMPTS = os.getenv("WEBHOOK_QUEUE_MAX_ATTEMPTS", "8")
+
+WEBHOOK_SPOOL_ENABLED = os.getenv("WEBHOOK_SPOOL_ENABLED", "false")  # spool batches locally when Postgres is unreachable
+WEBHOOK_SPOOL_PATH = os.getenv("WEBHOOK_SPOOL_PATH", "data/webhook_spool.sqlite3")
+STATUS_COALESCE_WINDOW_MS = os.getenv("STATUS_COALESCE_WINDOW_MS", "0")  # >0 buffers status callbacks and applies them in one UPDATE per table
+WEBHOOK_DEDUP_CAPACITY = os.getenv("WEBHOOK_DEDUP_CAPACITY", "10000")  # recently processed message/status ids kept in memory (0 disables)
+WEBHOOK_DEDUP_TTL_SECONDS = os.getenv("WEBHOOK_DEDUP_TTL_SECONDS", "3600")
+
+# Dashboard push channel (/api/stream). Off by default: each open dashboard
+# holds a worker thread for up to STREAM_MAX_SECONDS, which starves gunicorn's
+# default sync workers. Only enable it with threaded workers sized for the
+# open tabs (e.g. gunicorn --worker-class gthread --threads 32). While it's
+# off, the dashboards poll every 5 seconds and writes record no stream events.
+STREAM_ENABLED = os.getenv("STREAM_ENABLED", "false")
+STREAM_POLL_MS = os.getenv("STREAM_POLL_MS", "1000")  # how often each worker checks for new events while streams are open
+STREAM_HEARTBEAT_SECONDS = os.getenv("STREAM_HEARTBEAT_SECONDS", "15")  # keepalive comment interval, so proxies don't drop idle streams
+STREAM_MAX_SECONDS = os.getenv("STREAM_MAX_SECONDS", "300")  # a stream then ends and the browser reconnects with Last-Event-ID
+STREAM_EVENT_RETENTION_SECONDS = os.getenv("STREAM_EVENT_RETENTION_SECONDS", "3600")  # events kept for resume before pruning
@@ -6,6 +6,8 @@ import logging
 import hashlib
 import hmac
 
+from config import OPS_SECRET
+
 
 def validate_signature(payload, signature):
     """
@@ -40,4 +42,25 @@ def signature_required(f):
             return jsonify({"status": "error", "message": "Invalid signature"}), 403
         return f(*args, **kwargs)
 
-    return decorated_function
\ No newline at end of file
+    return decorated_function
+
+
+def ops_secret_required(f):
+    """
+    Decorator for the operational endpoints (query text, plans and internal
+    counters): the request must carry OPS_SECRET, either as an X-Ops-Secret
+    header or as "Authorization: Bearer <secret>" (what a Prometheus scrape
+    config sends). With OPS_SECRET unset they are closed.
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        provided = request.headers.get("X-Ops-Secret", "")
+        authorization = request.headers.get("Authorization", "")
+        if not provided and authorization.startswith("Bearer "):
+            provided = authorization[7:]
+        if not OPS_SECRET or not hmac.compare_digest(OPS_SECRET.encode(), provided.encode()):
+            return jsonify({"status": "error", "message": "Unauthorized"}), 401
+        return f(*args, **kwargs)
+
+    return decorated_function
@@ -0,0 +1,59 @@
+"""
+Bulk-load message history from a CSV or NDJSON archive into one business's
+message table with COPY (see utils/bulk_import.py).
+
+Usage:
+    python import_messages.py --table eventio_messages eventio_2024.csv
+    python import_messages.py --table mwsmile_messages polls.ndjson --rejects rejects.ndjson
+    python import_messages.py --table ignitiohub_messages dump.txt --format ndjson --batch-size 100000
+
+Existing ids are skipped exactly like insert_message(), so re-running an
+interrupted import is safe.
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+os.environ['DB_MIGRATE_ON_STARTUP'] = 'false'
+
+from utils.bulk_import import import_messages
+from utils.db_manager import db_manager
+from utils.migrations import MESSAGE_TABLES, run_migrations
+
+
+def print_progress(report):
+    sys.stdout.write(
+        f"\r  {report['read']} rows read, {report['inserted']} inserted, {report['existing']} already present, "
+        f"{report['rejected']} rejected - {report['rows_per_second']:.0f} rows/s"
+    )
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="CSV (with a header row) or NDJSON file")
+    parser.add_argument("--table", required=True, choices=MESSAGE_TABLES, help="business table to load into")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="default: from the file extension")
+    parser.add_argument("--batch-size", type=int, default=50000, help="rows per COPY + merge transaction")
+    parser.add_argument("--rejects", help="write rejected rows (with line and reason) to this NDJSON file")
+    args = parser.parse_args()
+
+    run_migrations(db_manager)
+    report = import_messages(
+        db_manager, f"public.{args.table}", args.path,
+        fmt=args.format, batch_size=args.batch_size, rejects_path=args.rejects, progress=print_progress,
+    )
+    print(f"\n  done in {report['seconds']}s: {report}")
+    if report['rejected'] and args.rejects:
+        print(f"  rejected rows written to {args.rejects}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Apply pending schema migrations (see utils/migrations.py) — run once per
+deploy, or let the app do it at startup (DB_MIGRATE_ON_STARTUP, on by default).
+Migrations that build indexes on the live message tables (CREATE INDEX
+CONCURRENTLY) are only applied here, never at startup.
+
+Usage:
+    python migrate.py            # apply anything pending
+    python migrate.py --status   # list applied and pending migrations
+"""
+
+import argparse
+import logging
+import os
+
+from dotenv import load_dotenv
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+# Migrate explicitly below rather than as a side effect of the import.
+os.environ['DB_MIGRATE_ON_STARTUP'] = 'false'
+
+from utils.db_manager import db_manager
+from utils.migrations import MIGRATIONS, applied_migrations, run_migrations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--status", action="store_true", help="show applied/pending migrations and exit")
+    args = parser.parse_args()
+
+    if args.status:
+        applied = {row['version']: row for row in applied_migrations(db_manager)}
+        for version, name, _ in MIGRATIONS:
+            row = applied.get(version)
+            state = f"applied {row['applied_at']:%Y-%m-%d %H:%M}" if row else "pending"
+            print(f"{version:>4}  {name:<28} {state}")
+        return
+
+    applied = run_migrations(db_manager)
+    print(f"Applied {len(applied)} migration(s): {applied}" if applied else "Schema already up to date")
+
+
+if __name__ == "__main__":
+    main()
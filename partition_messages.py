@@ -0,0 +1,82 @@
+"""
+Move the per-business message tables into the partitioned `messages` table
+online (see utils/partitioning.py), and maintain its monthly partitions.
+
+Usage:
+    python partition_messages.py status
+    python partition_messages.py prepare                       # mirror new writes (all businesses)
+    python partition_messages.py backfill --batch-size 5000    # copy existing rows
+    python partition_messages.py cutover --table eventio_messages
+    python partition_messages.py ensure-partitions --months-ahead 3
+    python partition_messages.py detach --before 2025-01       # detach months before Jan 2025
+
+prepare -> backfill -> cutover, per business or for all at once. Each step
+is safe to re-run. Running workers notice a cutover within 60s; a webhook
+that races it fails its insert and is spooled / redelivered by Meta.
+"""
+
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime
+
+from dotenv import load_dotenv
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+os.environ['DB_MIGRATE_ON_STARTUP'] = 'false'
+
+from utils.db_manager import db_manager
+from utils.migrations import MESSAGE_TABLES, run_migrations
+from utils import partitioning
+
+
+def print_progress(scanned, copied, total):
+    percent = 100.0 * scanned / total if total else 100.0
+    sys.stdout.write(f"\r  {scanned}/{total} rows scanned ({percent:.1f}%), {copied} copied")
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["status", "prepare", "backfill", "cutover", "ensure-partitions", "detach"])
+    parser.add_argument("--table", choices=MESSAGE_TABLES, help="one business table (default: all)")
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows per backfill transaction")
+    parser.add_argument("--months-ahead", type=int, default=2, help="monthly partitions to keep ready")
+    parser.add_argument("--before", help="detach monthly partitions before this month (YYYY-MM)")
+    args = parser.parse_args()
+
+    run_migrations(db_manager)
+    tables = [args.table] if args.table else MESSAGE_TABLES
+
+    if args.command == "status":
+        for row in partitioning.status(db_manager):
+            print(f"{row['table']:<30} {row['storage']:<6} mirrored={row['mirrored']!s:<5} "
+                  f"partitioned_rows={row['partitioned_rows']}")
+    elif args.command == "prepare":
+        for table in tables:
+            installed = partitioning.install_mirror(db_manager, table)
+            print(f"{table}: {'mirroring' if installed else 'already cut over'}")
+    elif args.command == "backfill":
+        for table in tables:
+            print(f"{table}:")
+            result = partitioning.backfill(db_manager, table, args.batch_size, progress=print_progress)
+            print(f"\n  done: {result}")
+    elif args.command == "cutover":
+        for table in tables:
+            result = partitioning.cutover(db_manager, table)
+            print(f"{table}: {result if result else 'already cut over'}")
+    elif args.command == "ensure-partitions":
+        partitioning.ensure_month_partitions(db_manager, months_ahead=args.months_ahead)
+    elif args.command == "detach":
+        if not args.before:
+            parser.error("detach needs --before YYYY-MM")
+        before = datetime.strptime(args.before, "%Y-%m").date()
+        detached = partitioning.detach_months(db_manager, before)
+        print(f"Detached {len(detached)} partition(s): {', '.join(detached) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Recompute the chat-list summaries (see utils/conversation_summaries.py) from
+the message tables. The app keeps them current on every write; run this
+after changing messages outside the app (manual SQL, a restore) or if a
+summary ever looks wrong.
+
+Usage:
+    python rebuild_conversation_summaries.py                        # every business
+    python rebuild_conversation_summaries.py --table eventio_messages
+"""
+
+import argparse
+import logging
+import os
+
+from dotenv import load_dotenv
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+os.environ['DB_MIGRATE_ON_STARTUP'] = 'false'
+
+from utils.conversation_summaries import rebuild_conversation_summaries
+from utils.db_manager import db_manager
+from utils.migrations import MESSAGE_TABLES, run_migrations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--table", choices=MESSAGE_TABLES, help="only this business (default: all)")
+    args = parser.parse_args()
+
+    run_migrations(db_manager)
+    for table in [args.table] if args.table else MESSAGE_TABLES:
+        count = rebuild_conversation_summaries(db_manager, f"public.{table}")
+        print(f"  {table}: {count} conversations")
+
+
+if __name__ == "__main__":
+    main()
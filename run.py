@@ -1,5 +1,6 @@
 import logging
 import os
+import psycopg2
 from flask import Flask
 from dotenv import load_dotenv
 
@@ -9,7 +10,12 @@ load_dotenv()
 # Import your blueprint from the views module
 from views import bp
 from apscheduler.schedulers.background import BackgroundScheduler
+from config import STREAM_EVENT_RETENTION_SECONDS
 from utils.digest import run_daily_digest
+from utils.db_manager import db_manager
+from utils.migrations import require_schema
+from utils.partitioning import ensure_month_partitions
+from utils.stream_events import prune_stream_events
 
 # Configure logging for the application
 logging.basicConfig(
@@ -77,6 +83,15 @@ validate_env()
 # Create the application instance
 app = create_app()
 
+# Every message write refreshes conversation_summaries in the same
+# transaction, so serving on an older schema would fail every webhook.
+# Refuse to start instead. A database that's unreachable at boot is let
+# through, so webhooks can still be spooled.
+try:
+    require_schema(db_manager)
+except psycopg2.Error as e:
+    logging.error(f"❌ Could not check the schema version at startup: {e}")
+
 # Start the daily digest scheduler, once per process. When Flask's debug
 # reloader is active it spawns a child with WERKZEUG_RUN_MAIN=true; only
 # start there so the watcher parent process doesn't also fire it. The
@@ -85,6 +100,12 @@ app = create_app()
 if not app.config['DEBUG'] or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
     scheduler = BackgroundScheduler(timezone='UTC')
     scheduler.add_job(run_daily_digest, 'cron', hour=int(os.getenv('DIGEST_HOUR_UTC', 6)))
+    # Keep next months' message partitions created ahead of time (idempotent).
+    scheduler.add_job(ensure_month_partitions, 'cron', hour=0, minute=15, args=[db_manager])
+    # Drop dashboard push events past their resume window (idempotent).
+    if db_manager.stream_events:
+        scheduler.add_job(prune_stream_events, 'interval', minutes=10, args=[db_manager],
+                          kwargs={'retention_seconds': int(STREAM_EVENT_RETENTION_SECONDS)})
     scheduler.start()
     logging.info(f"Daily digest scheduler started (hour={os.getenv('DIGEST_HOUR_UTC', 6)} UTC)")
 
@@ -3,6 +3,23 @@ let currentContactName = null;
 let currentPhoneId = '608867502309431';
 let lastMessageCounts = {};
 let unreadCounts = {};
+let chatsByWaId = new Map();
+let chatsCursor = null;
+let chatsEtag = null;
+let chatsNext = null;
+let chatsQuery = '';
+let loadingMoreChats = false;
+let threadWaId = null; // the chat the thread cursors below belong to
+let threadBefore = null;
+let threadAfter = null;
+let threadUpdatedAt = null;
+let loadingOlder = false;
+let searchTimeout;
+let eventStream = null;
+let pollTimer = null;
+let syncTimer = null;
+let syncThread = false;
+const CHAT_PAGE_SIZE = 50;
 let isTyping = false;
 let typingTimeout;
 
@@ -54,21 +71,23 @@ messageInput.addEventListener('input', function() {
     this.style.height = Math.min(this.scrollHeight, 100) + 'px';
 });
 
-// Search functionality
+// Search functionality: the server searches every chat by name or number,
+// not just the pages loaded so far
 searchInput.addEventListener('input', function() {
-    const searchTerm = this.value.toLowerCase();
-    const contacts = contactsList.querySelectorAll('.contact-item');
-    
-    contacts.forEach(contact => {
-        const name = contact.querySelector('.contact-name')?.textContent.toLowerCase() || '';
-        const lastMessage = contact.querySelector('.last-message')?.textContent.toLowerCase() || '';
-        
-        if (name.includes(searchTerm) || lastMessage.includes(searchTerm)) {
-            contact.style.display = 'flex';
-        } else {
-            contact.style.display = 'none';
-        }
-    });
+    clearTimeout(searchTimeout);
+    searchTimeout = setTimeout(() => {
+        resetChatSync();
+        chatsQuery = this.value.trim();
+        contactsList.scrollTop = 0;
+        loadContacts();
+    }, 300);
+});
+
+// Infinite scroll: fetch the next page of chats near the bottom of the list
+contactsList.addEventListener('scroll', () => {
+    if (contactsList.scrollTop + contactsList.clientHeight >= contactsList.scrollHeight - 200) {
+        loadMoreContacts();
+    }
 });
 
 function renderTicks(status) {
@@ -84,18 +103,11 @@ function renderTicks(status) {
     return '';
 }
 
-function appendMessageToChat(msg) {
-    const isNewMessage = !messagesDiv.querySelector(`[data-message-id="${msg.id || msg.timestamp}"]`);
-    
-    if (messagesDiv.querySelector('.h-full')) {
-        messagesDiv.innerHTML = '';
-    }
-
+function createMessageElement(msg) {
     const msgDiv = document.createElement('div');
     msgDiv.className = `flex ${msg.direction === 'inbound' ? 'justify-start' : 'justify-end'} mb-1`;
     msgDiv.setAttribute('data-message-id', msg.id || msg.timestamp);
-    
-    const avatar = msg.direction === 'inbound' ? (currentContactName ? currentContactName.charAt(0).toUpperCase() : '?') : '';
+    msgDiv.setAttribute('data-timestamp', msg.timestamp);
     
     msgDiv.innerHTML = `
         <div class="message-bubble ${msg.direction === 'inbound' ? 'inbound' : 'outbound'}">
@@ -106,8 +118,19 @@ function appendMessageToChat(msg) {
             </div>
         </div>
     `;
+    return msgDiv;
+}
+
+function appendMessageToChat(msg) {
+    const isNewMessage = !messagesDiv.querySelector(`[data-message-id="${msg.id || msg.timestamp}"]`);
     
-    messagesDiv.appendChild(msgDiv);
+    if (messagesDiv.querySelector('.h-full')) {
+        messagesDiv.innerHTML = '';
+    }
+
+    const avatar = msg.direction === 'inbound' ? (currentContactName ? currentContactName.charAt(0).toUpperCase() : '?') : '';
+    
+    messagesDiv.appendChild(createMessageElement(msg));
     messagesDiv.scrollTop = messagesDiv.scrollHeight;
 
     // Play notification sound for new inbound messages
@@ -123,9 +146,12 @@ function appendMessageToChat(msg) {
     }
 }
 
+// Opening a chat loads its newest page; pollMessages() then fetches only
+// what's new, and older pages load as the thread is scrolled up.
 async function loadMessages(waId, name, phoneId) {
     if (!phoneId) return;
     
+    threadWaId = null;
     currentWaId = waId;
     currentContactName = name;
     currentPhoneId = phoneId;
@@ -151,7 +177,13 @@ async function loadMessages(waId, name, phoneId) {
         if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
         
         const data = await response.json();
+        // Another chat was opened meanwhile
+        if (waId !== currentWaId) return;
         const messages = data.messages || [];
+        threadWaId = waId;
+        threadBefore = data.before;
+        threadAfter = data.after;
+        threadUpdatedAt = data.updated_at;
         
         messagesDiv.innerHTML = '';
         if (messages.length === 0) {
@@ -190,6 +222,92 @@ async function loadMessages(waId, name, phoneId) {
     }
 }
 
+// Fetch only the messages after the newest one shown, plus status changes
+// of recent ones.
+async function pollMessages() {
+    if (!currentWaId || threadWaId !== currentWaId) return;
+    const waId = currentWaId;
+    
+    let url = `/api/chats/${waId}?phone_id=${currentPhoneId}`;
+    if (threadAfter) {
+        url += `&after=${encodeURIComponent(threadAfter)}`;
+        if (threadUpdatedAt) url += `&updated_since=${encodeURIComponent(threadUpdatedAt)}`;
+    }
+    
+    try {
+        const response = await fetch(url);
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        
+        const data = await response.json();
+        if (waId !== currentWaId || threadWaId !== waId) return;
+        // A message written late (e.g. a replayed webhook) can be older than
+        // the after= cursor and arrive only in updates, so both lists merge
+        // the same way: known ids get their ticks refreshed, new ones are
+        // placed by timestamp.
+        (data.messages || []).concat(data.updates || []).forEach(msg => {
+            if (messagesDiv.querySelector(`[data-message-id="${msg.id || msg.timestamp}"]`)) {
+                updateMessageTicks(msg);
+            } else {
+                insertMessageInOrder(msg);
+            }
+        });
+        threadAfter = data.after || threadAfter;
+        threadUpdatedAt = data.updated_at || threadUpdatedAt;
+    } catch (error) {
+        console.error('Error polling messages:', error);
+    }
+}
+
+// Insert a message the thread doesn't show yet before the first later one.
+// One older than everything shown is left for loadOlderMessages() if there
+// is older history still to load.
+function insertMessageInOrder(msg) {
+    const at = new Date(msg.timestamp).getTime();
+    const shown = Array.from(messagesDiv.querySelectorAll('[data-timestamp]'));
+    const next = shown.find(el => new Date(el.getAttribute('data-timestamp')).getTime() > at);
+    if (!next) {
+        appendMessageToChat(msg);
+    } else if (next !== shown[0] || !threadBefore) {
+        messagesDiv.insertBefore(createMessageElement(msg), next);
+    }
+}
+
+function updateMessageTicks(msg) {
+    const time = messagesDiv.querySelector(`[data-message-id="${msg.id}"] .message-time`);
+    if (!time || msg.direction !== 'outbound') return;
+    time.querySelector('.tick-status')?.remove();
+    time.insertAdjacentHTML('beforeend', renderTicks(msg.status));
+}
+
+// Prepend the page before the oldest message shown, keeping the view in place.
+async function loadOlderMessages() {
+    if (!currentWaId || threadWaId !== currentWaId || !threadBefore || loadingOlder) return;
+    const waId = currentWaId;
+    const before = threadBefore;
+    loadingOlder = true;
+    
+    try {
+        const response = await fetch(`/api/chats/${waId}?phone_id=${currentPhoneId}&before=${encodeURIComponent(before)}`);
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        
+        const data = await response.json();
+        if (waId !== currentWaId || before !== threadBefore) return;
+        const fromBottom = messagesDiv.scrollHeight - messagesDiv.scrollTop;
+        const first = messagesDiv.firstChild;
+        (data.messages || []).forEach(msg => messagesDiv.insertBefore(createMessageElement(msg), first));
+        threadBefore = data.before;
+        messagesDiv.scrollTop = messagesDiv.scrollHeight - fromBottom;
+    } catch (error) {
+        console.error('Error loading older messages:', error);
+    } finally {
+        loadingOlder = false;
+    }
+}
+
+messagesDiv.addEventListener('scroll', () => {
+    if (messagesDiv.scrollTop < 100) loadOlderMessages();
+});
+
 function updateUnreadBadges() {
     const contacts = contactsList.querySelectorAll('.contact-item');
     contacts.forEach(contact => {
@@ -285,94 +403,162 @@ async function sendMessage() {
     }
 }
 
+// Changed chats replace known ones unless older (deltas overlap a little).
+function mergeChats(data) {
+    if (data.full) chatsByWaId.clear();
+    data.chats.forEach(chat => {
+        const known = chatsByWaId.get(chat.wa_id);
+        if (!known || new Date(chat.updated_at) >= new Date(known.updated_at)) {
+            chatsByWaId.set(chat.wa_id, chat);
+        }
+    });
+    return [...chatsByWaId.values()]
+        .sort((a, b) => new Date(b.last_message_timestamp) - new Date(a.last_message_timestamp));
+}
+
+function resetChatSync() {
+    chatsByWaId = new Map();
+    chatsCursor = null;
+    chatsEtag = null;
+    chatsNext = null;
+    chatsQuery = '';
+}
+
+function chatsUrl(phoneId, extra) {
+    const q = chatsQuery ? `&q=${encodeURIComponent(chatsQuery)}` : '';
+    return `/api/chats?phone_id=${phoneId}&limit=${CHAT_PAGE_SIZE}${q}${extra}`;
+}
+
+// The first call loads the first page; later polls fetch only the chats
+// changed since the last cursor, and skip re-rendering on a 304.
 async function loadContacts() {
     if (!currentPhoneId) return;
+    const phoneId = currentPhoneId;
+    const query = chatsQuery;
     
     try {
-        const response = await fetch(`/api/chats?phone_id=${currentPhoneId}`);
+        const since = chatsCursor ? `&since=${encodeURIComponent(chatsCursor)}` : '';
+        const response = await fetch(chatsUrl(phoneId, since), {
+            cache: 'no-store',
+            headers: chatsEtag ? { 'If-None-Match': chatsEtag } : {},
+        });
+        if (response.status === 304) return;
         if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
         
         const data = await response.json();
-        contactsList.innerHTML = '';
+        // The phone selector or the search changed while this request was in flight
+        if (phoneId !== currentPhoneId || query !== chatsQuery) return;
+        chatsEtag = response.headers.get('ETag');
+        chatsCursor = data.cursor;
+        if (data.full) chatsNext = data.next;
+        renderContacts(mergeChats(data));
+    } catch (error) {
+        console.error('Error loading contacts:', error);
+        contactsList.innerHTML = `
+            <div class="flex items-center justify-center h-32 text-red-500">
+                <div class="text-center">
+                    <i class="fas fa-exclamation-triangle text-2xl mb-2"></i>
+                    <p>Failed to load contacts</p>
+                </div>
+            </div>
+        `;
+    }
+}
+
+// Fetch the next (older) page of chats and merge it in.
+async function loadMoreContacts() {
+    if (!currentPhoneId || !chatsNext || loadingMoreChats) return;
+    const phoneId = currentPhoneId;
+    const query = chatsQuery;
+    loadingMoreChats = true;
+    
+    try {
+        const response = await fetch(chatsUrl(phoneId, `&after=${encodeURIComponent(chatsNext)}`), { cache: 'no-store' });
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
         
-        if (data.chats && data.chats.length > 0) {
-            data.chats.forEach(contact => {
-                const previousCount = lastMessageCounts[contact.wa_id] || 0;
-                const newMessages = (contact.message_count || 0) - previousCount;
-                
-                if (newMessages > 0 && currentWaId !== contact.wa_id) {
-                    unreadCounts[contact.wa_id] = (unreadCounts[contact.wa_id] || 0) + newMessages;
-                }
-                
-                lastMessageCounts[contact.wa_id] = contact.message_count || 0;
-                
-                const isOnline = Math.random() > 0.7; // Simulate online status
-                
-                const contactItem = document.createElement('div');
-                contactItem.className = `contact-item p-4 cursor-pointer flex items-center gap-3 ${currentWaId === contact.wa_id ? 'active' : ''}`;
-                contactItem.setAttribute('data-wa-id', contact.wa_id);
-                
-                const avatar = contact.name ? contact.name.charAt(0).toUpperCase() : '?';
-                const timeAgo = contact.last_message_timestamp ? 
-                    new Date(contact.last_message_timestamp).toLocaleTimeString([], { 
-                        hour: '2-digit', 
-                        minute: '2-digit' 
-                    }) : '';
-                
-                contactItem.innerHTML = `
-                    <div class="relative">
-                        <div class="profile-picture">
-                            <span>${avatar}</span>
-                            ${isOnline ? '<div class="status-indicator status-online"></div>' : ''}
-                        </div>
+        const data = await response.json();
+        if (phoneId !== currentPhoneId || query !== chatsQuery) return;
+        chatsNext = data.next;
+        renderContacts(mergeChats(data));
+    } catch (error) {
+        console.error('Error loading more contacts:', error);
+    } finally {
+        loadingMoreChats = false;
+    }
+}
+
+function renderContacts(chats) {
+    const scrollTop = contactsList.scrollTop;
+    contactsList.innerHTML = '';
+    
+    if (chats.length > 0) {
+        chats.forEach(contact => {
+            const previousCount = lastMessageCounts[contact.wa_id] || 0;
+            const newMessages = (contact.message_count || 0) - previousCount;
+            
+            if (newMessages > 0 && currentWaId !== contact.wa_id) {
+                unreadCounts[contact.wa_id] = (unreadCounts[contact.wa_id] || 0) + newMessages;
+            }
+            
+            lastMessageCounts[contact.wa_id] = contact.message_count || 0;
+            
+            const isOnline = Math.random() > 0.7; // Simulate online status
+            
+            const contactItem = document.createElement('div');
+            contactItem.className = `contact-item p-4 cursor-pointer flex items-center gap-3 ${currentWaId === contact.wa_id ? 'active' : ''}`;
+            contactItem.setAttribute('data-wa-id', contact.wa_id);
+            
+            const avatar = contact.name ? contact.name.charAt(0).toUpperCase() : '?';
+            const timeAgo = contact.last_message_timestamp ? 
+                new Date(contact.last_message_timestamp).toLocaleTimeString([], { 
+                    hour: '2-digit', 
+                    minute: '2-digit' 
+                }) : '';
+            
+            contactItem.innerHTML = `
+                <div class="relative">
+                    <div class="profile-picture">
+                        <span>${avatar}</span>
+                        ${isOnline ? '<div class="status-indicator status-online"></div>' : ''}
                     </div>
-                    <div class="flex-1 min-w-0">
-                        <div class="flex items-center justify-between mb-1">
-                            <h3 class="contact-name font-medium text-gray-900 truncate">${contact.name || 'Unknown Contact'}</h3>
-                            <div class="flex items-center gap-2">
-                                <span class="last-message-time text-xs text-gray-500">${timeAgo}</span>
-                                ${unreadCounts[contact.wa_id] > 0 ? `<div class="unread-badge">${unreadCounts[contact.wa_id]}</div>` : ''}
-                            </div>
+                </div>
+                <div class="flex-1 min-w-0">
+                    <div class="flex items-center justify-between mb-1">
+                        <h3 class="contact-name font-medium text-gray-900 truncate">${contact.name || 'Unknown Contact'}</h3>
+                        <div class="flex items-center gap-2">
+                            <span class="last-message-time text-xs text-gray-500">${timeAgo}</span>
+                            ${unreadCounts[contact.wa_id] > 0 ? `<div class="unread-badge">${unreadCounts[contact.wa_id]}</div>` : ''}
                         </div>
-                        <p class="last-message text-sm text-gray-600 truncate">${contact.last_message || 'No messages yet'}</p>
                     </div>
-                `;
+                    <p class="last-message text-sm text-gray-600 truncate">${contact.last_message || 'No messages yet'}</p>
+                </div>
+            `;
+            
+            contactItem.addEventListener('click', () => {
+                // Remove active class from all contacts
+                document.querySelectorAll('.contact-item').forEach(item => 
+                    item.classList.remove('active'));
                 
-                contactItem.addEventListener('click', () => {
-                    // Remove active class from all contacts
-                    document.querySelectorAll('.contact-item').forEach(item => 
-                        item.classList.remove('active'));
-                    
-                    // Add active class to clicked contact
-                    contactItem.classList.add('active');
-                    
-                    // Load messages
-                    loadMessages(contact.wa_id, contact.name || 'Unknown Contact', currentPhoneId);
-                });
+                // Add active class to clicked contact
+                contactItem.classList.add('active');
                 
-                contactsList.appendChild(contactItem);
+                // Load messages
+                loadMessages(contact.wa_id, contact.name || 'Unknown Contact', currentPhoneId);
             });
-        } else {
-            contactsList.innerHTML = `
-                <div class="flex items-center justify-center h-32 text-gray-500">
-                    <div class="text-center">
-                        <i class="fab fa-whatsapp text-4xl text-green-100 mb-2"></i>
-                        <p>No conversations yet</p>
-                    </div>
-                </div>
-            `;
-        }
-    } catch (error) {
-        console.error('Error loading contacts:', error);
+            
+            contactsList.appendChild(contactItem);
+        });
+    } else {
         contactsList.innerHTML = `
-            <div class="flex items-center justify-center h-32 text-red-500">
+            <div class="flex items-center justify-center h-32 text-gray-500">
                 <div class="text-center">
-                    <i class="fas fa-exclamation-triangle text-2xl mb-2"></i>
-                    <p>Failed to load contacts</p>
+                    <i class="fab fa-whatsapp text-4xl text-green-100 mb-2"></i>
+                    <p>${chatsQuery ? 'No matching chats' : 'No conversations yet'}</p>
                 </div>
             </div>
         `;
     }
+    contactsList.scrollTop = scrollTop;
 }
 
 // Event Listeners
@@ -381,6 +567,7 @@ phoneSelector.addEventListener('change', () => {
     currentWaId = null;
     currentContactName = null;
     unreadCounts = {};
+    resetChatSync();
     
     // Reset UI
     conversationTitle.textContent = 'Select a chat';
@@ -402,6 +589,7 @@ phoneSelector.addEventListener('change', () => {
     searchInput.value = '';
     
     loadContacts();
+    connectEventStream();
 });
 
 sendButton.addEventListener('click', sendMessage);
@@ -414,36 +602,68 @@ messageInput.addEventListener('keypress', (e) => {
     }
 });
 
-// Initialize
-document.addEventListener('DOMContentLoaded', () => {
-    loadContacts();
+// Changes are pushed over /api/stream (Server-Sent Events) and each one
+// triggers the same incremental reads a poll makes. Polling every 8s runs
+// while the stream is down or EventSource is unsupported, and for good if
+// the stream is disabled (STREAM_ENABLED): its 404 fires onerror, and
+// EventSource doesn't retry a non-200 response.
+function connectEventStream() {
+    if (eventStream) eventStream.close();
+    eventStream = null;
+    if (!currentPhoneId) return;
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+    eventStream = new EventSource(`/api/stream?phone_id=${encodeURIComponent(currentPhoneId)}`);
+    // (Re)connected: catch up on anything missed while disconnected
+    eventStream.onopen = () => {
+        stopPolling();
+        scheduleSync(true);
+    };
+    // EventSource reconnects on its own (resuming from Last-Event-ID); poll meanwhile
+    eventStream.onerror = startPolling;
+    ['message.created', 'message.status', 'conversation.read'].forEach(type => {
+        eventStream.addEventListener(type, (e) => {
+            scheduleSync(JSON.parse(e.data).wa_id === currentWaId);
+        });
+    });
+    // Events were dropped: resync the contact list and the open thread
+    eventStream.addEventListener('sync', () => scheduleSync(true));
+}
 
-    // Auto-refresh every 8 seconds
-    setInterval(() => {
+// A burst of events (a webhook batch) triggers one sync.
+function scheduleSync(thread) {
+    syncThread = syncThread || thread;
+    if (syncTimer) return;
+    syncTimer = setTimeout(() => {
+        const thread = syncThread;
+        syncTimer = null;
+        syncThread = false;
+        loadContacts();
+        if (thread) pollMessages();
+    }, 200);
+}
+
+function startPolling() {
+    if (pollTimer) return;
+    pollTimer = setInterval(() => {
         if (currentPhoneId) {
             loadContacts();
-            if (currentWaId) {
-                // Check for new messages without full reload
-                fetch(`/api/chats/${currentWaId}?phone_id=${currentPhoneId}`)
-                    .then(response => response.json())
-                    .then(data => {
-                        const messages = data.messages || [];
-                        const currentMessages = messagesDiv.querySelectorAll('[data-message-id]');
-                        
-                        // Only add new messages
-                        messages.forEach(msg => {
-                            const exists = Array.from(currentMessages).some(el => 
-                                el.getAttribute('data-message-id') === (msg.id || msg.timestamp));
-                            
-                            if (!exists) {
-                                appendMessageToChat(msg);
-                            }
-                        });
-                    })
-                    .catch(console.error);
-            }
+            pollMessages();
         }
     }, 8000);
+}
+
+function stopPolling() {
+    clearInterval(pollTimer);
+    pollTimer = null;
+}
+
+// Initialize
+document.addEventListener('DOMContentLoaded', () => {
+    loadContacts();
+    connectEventStream();
 
     // Simulate random online status changes
     setInterval(() => {
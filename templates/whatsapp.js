@@ -1,6 +1,8 @@
 // WhatsApp.js - Comprehensive WhatsApp-like Chat Interface
 // This file handles all chat functionality for Eventio, IgnitioHub, and Package with Sense
 
+const CHAT_PAGE_SIZE = 50;
+
 class WhatsAppChat {
     constructor(phoneId, brandColor = '#25D366') {
         this.phoneId = phoneId;
@@ -8,9 +10,25 @@ class WhatsAppChat {
         this.currentWaId = null;
         this.currentContactName = null;
         this.lastChatData = null;
+        this.chatsByWaId = new Map();
+        this.chatsCursor = null;
+        this.chatsEtag = null;
+        this.chatsNext = null;
+        this.chatsQuery = '';
+        this.loadingMoreChats = false;
+        this.searchTimer = null;
         this.lastMessageData = null;
+        this.threadWaId = null; // the chat the thread cursors below belong to
+        this.threadBefore = null;
+        this.threadAfter = null;
+        this.threadUpdatedAt = null;
+        this.loadingOlder = false;
         this.isTyping = false;
         this.typingTimeout = null;
+        this.stream = null;
+        this.pollTimer = null;
+        this.syncTimer = null;
+        this.syncThread = false;
         
         this.init();
     }
@@ -18,7 +36,7 @@ class WhatsAppChat {
     init() {
         this.setupEventListeners();
         this.fetchChats();
-        this.startPolling();
+        this.startLiveUpdates();
         this.handleResponsiveLayout();
     }
 
@@ -108,18 +126,32 @@ class WhatsAppChat {
 
     // ==================== API CALLS ====================
 
+    chatsUrl(extra) {
+        const q = this.chatsQuery ? `&q=${encodeURIComponent(this.chatsQuery)}` : '';
+        return `/api/chats?phone_id=${this.phoneId}&limit=${CHAT_PAGE_SIZE}${q}${extra}`;
+    }
+
+    // The first call loads the first page; later polls fetch only chats
+    // changed since the last cursor and merge them in. An unchanged list
+    // comes back as a bodiless 304.
     async fetchChats() {
+        const query = this.chatsQuery;
         try {
-            const response = await fetch(`/api/chats?phone_id=${this.phoneId}`);
+            const since = this.chatsCursor ? `&since=${encodeURIComponent(this.chatsCursor)}` : '';
+            const response = await fetch(this.chatsUrl(since), {
+                cache: 'no-store',
+                headers: this.chatsEtag ? { 'If-None-Match': this.chatsEtag } : {},
+            });
+            if (response.status === 304) return;
             const data = await response.json();
+            // The search changed while this request was in flight
+            if (query !== this.chatsQuery) return;
             
             if (response.ok) {
-                data.chats.sort((a, b) => new Date(b.last_message_timestamp) - new Date(a.last_message_timestamp));
-                
-                if (JSON.stringify(data.chats) !== JSON.stringify(this.lastChatData)) {
-                    this.displayChats(data.chats);
-                    this.lastChatData = data.chats;
-                }
+                this.chatsEtag = response.headers.get('ETag');
+                this.chatsCursor = data.cursor;
+                if (data.full) this.chatsNext = data.next;
+                this.showChats(this.mergeChats(data));
             } else {
                 console.error('Error fetching chats:', data.message);
             }
@@ -128,6 +160,52 @@ class WhatsAppChat {
         }
     }
 
+    // The next (older) page of chats, fetched as the list is scrolled.
+    async loadMoreChats() {
+        if (!this.chatsNext || this.loadingMoreChats) return;
+        this.loadingMoreChats = true;
+        const query = this.chatsQuery;
+        try {
+            const response = await fetch(this.chatsUrl(`&after=${encodeURIComponent(this.chatsNext)}`), { cache: 'no-store' });
+            const data = await response.json();
+            if (query !== this.chatsQuery) return;
+
+            if (response.ok) {
+                this.chatsNext = data.next;
+                this.showChats(this.mergeChats(data));
+            } else {
+                console.error('Error fetching more chats:', data.message);
+            }
+        } catch (error) {
+            console.error('Error fetching more chats:', error);
+        } finally {
+            this.loadingMoreChats = false;
+        }
+    }
+
+    showChats(chats) {
+        if (JSON.stringify(chats) !== JSON.stringify(this.lastChatData)) {
+            this.displayChats(chats);
+            this.lastChatData = chats;
+        }
+    }
+
+    // Changed chats replace known ones unless older (deltas overlap a little).
+    mergeChats(data) {
+        if (data.full) this.chatsByWaId.clear();
+        data.chats.forEach(chat => {
+            const known = this.chatsByWaId.get(chat.wa_id);
+            if (!known || new Date(chat.updated_at) >= new Date(known.updated_at)) {
+                this.chatsByWaId.set(chat.wa_id, chat);
+            }
+        });
+        return [...this.chatsByWaId.values()]
+            .sort((a, b) => new Date(b.last_message_timestamp) - new Date(a.last_message_timestamp));
+    }
+
+    // Opening a chat loads its newest page. Polls fetch only the messages
+    // after the newest one shown, plus status changes of recent ones; older
+    // pages load as the thread is scrolled up.
     async loadMessages(waId, contactName, isPolling = false) {
         const messagesContainer = document.getElementById('messages-container');
         const wasScrolledToBottom = this.isScrolledToBottom(messagesContainer);
@@ -156,9 +234,19 @@ class WhatsAppChat {
         // Show chat area on mobile
         this.showChatArea();
 
+        if (!isPolling) this.threadWaId = null;
+        const poll = isPolling && this.threadWaId === waId && this.threadAfter;
+
         try {
-            const response = await fetch(`/api/chats/${waId}?phone_id=${this.phoneId}`);
+            let url = `/api/chats/${waId}?phone_id=${this.phoneId}`;
+            if (poll) {
+                url += `&after=${encodeURIComponent(this.threadAfter)}`;
+                if (this.threadUpdatedAt) url += `&updated_since=${encodeURIComponent(this.threadUpdatedAt)}`;
+            }
+            const response = await fetch(url);
             const data = await response.json();
+            // Another chat was opened (or this one reloaded) meanwhile
+            if (waId !== this.currentWaId || (poll && this.threadWaId !== waId)) return;
             
             if (response.ok) {
                 // Update status
@@ -168,13 +256,28 @@ class WhatsAppChat {
                 document.getElementById('chat-contact-status').innerHTML = this.formatContactStatus(lastTimestamp, isOnline);
 
                 // Update messages
-                if (JSON.stringify(data.messages) !== JSON.stringify(this.lastMessageData) || !isPolling) {
-                    this.displayMessages(data.messages);
-                    this.lastMessageData = data.messages;
-                    
-                    if (wasScrolledToBottom || !isPolling) {
-                        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+                if (poll) {
+                    if (this.mergeMessages(data.messages.concat(data.updates || []))) {
+                        this.displayMessages(this.lastMessageData);
+                        if (wasScrolledToBottom) {
+                            messagesContainer.scrollTop = messagesContainer.scrollHeight;
+                        }
                     }
+                    this.threadAfter = data.after || this.threadAfter;
+                    this.threadUpdatedAt = data.updated_at || this.threadUpdatedAt;
+                } else {
+                    if (JSON.stringify(data.messages) !== JSON.stringify(this.lastMessageData) || !isPolling) {
+                        this.displayMessages(data.messages);
+                        this.lastMessageData = data.messages;
+                        
+                        if (wasScrolledToBottom || !isPolling) {
+                            messagesContainer.scrollTop = messagesContainer.scrollHeight;
+                        }
+                    }
+                    this.threadWaId = waId;
+                    this.threadBefore = data.before;
+                    this.threadAfter = data.after;
+                    this.threadUpdatedAt = data.updated_at;
                 }
 
                 if (!isPolling) {
@@ -189,6 +292,51 @@ class WhatsAppChat {
         }
     }
 
+    // New messages are appended and known ones (status changes) replaced by
+    // id; true if anything changed.
+    mergeMessages(rows) {
+        let changed = false;
+        rows.forEach(msg => {
+            const i = this.lastMessageData.findIndex(m => m.id === msg.id);
+            if (i === -1) {
+                this.lastMessageData.push(msg);
+                changed = true;
+            } else if (JSON.stringify(this.lastMessageData[i]) !== JSON.stringify(msg)) {
+                this.lastMessageData[i] = msg;
+                changed = true;
+            }
+        });
+        return changed;
+    }
+
+    // The page before the oldest message shown, keeping the view in place.
+    async loadOlderMessages() {
+        if (!this.currentWaId || this.threadWaId !== this.currentWaId || !this.threadBefore || this.loadingOlder) return;
+        this.loadingOlder = true;
+        const waId = this.currentWaId;
+        const before = this.threadBefore;
+        const messagesContainer = document.getElementById('messages-container');
+        try {
+            const response = await fetch(`/api/chats/${waId}?phone_id=${this.phoneId}&before=${encodeURIComponent(before)}`);
+            const data = await response.json();
+            if (waId !== this.currentWaId || before !== this.threadBefore) return;
+
+            if (response.ok) {
+                const fromBottom = messagesContainer.scrollHeight - messagesContainer.scrollTop;
+                this.lastMessageData = data.messages.concat(this.lastMessageData);
+                this.threadBefore = data.before;
+                this.displayMessages(this.lastMessageData);
+                messagesContainer.scrollTop = messagesContainer.scrollHeight - fromBottom;
+            } else {
+                console.error('Error fetching older messages:', data.message);
+            }
+        } catch (error) {
+            console.error('Error fetching older messages:', error);
+        } finally {
+            this.loadingOlder = false;
+        }
+    }
+
     async markMessagesAsRead(waId) {
         try {
             const response = await fetch('/api/mark-read', {
@@ -302,6 +450,7 @@ class WhatsAppChat {
 
     displayChats(chats) {
         const chatsContainer = document.getElementById('chats-container');
+        const scrollTop = chatsContainer.scrollTop;
         chatsContainer.innerHTML = '';
         
         if (chats.length === 0) {
@@ -310,8 +459,8 @@ class WhatsAppChat {
                     <svg class="w-24 h-24 mb-4 text-gray-300" fill="none" stroke="currentColor" viewBox="0 0 24 24">
                         <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M8 12h.01M12 12h.01M16 12h.01M21 12c0 4.418-4.03 8-9 8a9.863 9.863 0 01-4.255-.949L3 20l1.395-3.72C3.512 15.042 3 13.574 3 12c0-4.418 4.03-8 9-8s9 3.582 9 8z" />
                     </svg>
-                    <p class="text-lg font-medium">No conversations yet</p>
-                    <p class="text-sm mt-2">Your chats will appear here</p>
+                    <p class="text-lg font-medium">${this.chatsQuery ? 'No matching chats' : 'No conversations yet'}</p>
+                    <p class="text-sm mt-2">${this.chatsQuery ? 'Try another name or number' : 'Your chats will appear here'}</p>
                 </div>
             `;
             return;
@@ -321,6 +470,7 @@ class WhatsAppChat {
             const chatElement = this.createChatElement(chat);
             chatsContainer.appendChild(chatElement);
         });
+        chatsContainer.scrollTop = scrollTop;
     }
 
     createChatElement(chat) {
@@ -501,13 +651,29 @@ class WhatsAppChat {
             this.currentWaId = null;
             this.currentContactName = null;
             this.lastMessageData = null;
+            this.threadWaId = null;
             this.fetchChats();
         });
 
         // Search functionality
         const searchInput = document.getElementById('search-input');
         searchInput.addEventListener('input', (e) => {
-            this.searchChats(e.target.value);
+            clearTimeout(this.searchTimer);
+            this.searchTimer = setTimeout(() => this.searchChats(e.target.value), 300);
+        });
+
+        // Infinite scroll for the chat list
+        const chatsContainer = document.getElementById('chats-container');
+        chatsContainer.addEventListener('scroll', () => {
+            if (chatsContainer.scrollTop + chatsContainer.clientHeight >= chatsContainer.scrollHeight - 200) {
+                this.loadMoreChats();
+            }
+        });
+
+        // Older messages load as the thread is scrolled up
+        const messagesContainer = document.getElementById('messages-container');
+        messagesContainer.addEventListener('scroll', () => {
+            if (messagesContainer.scrollTop < 100) this.loadOlderMessages();
         });
 
         // Handle window resize
@@ -516,18 +682,15 @@ class WhatsAppChat {
         });
     }
 
+    // The server searches every chat by name or number, not just the pages
+    // loaded so far; the results replace the list and are synced like it.
     searchChats(searchTerm) {
-        const term = searchTerm.toLowerCase();
-        const chatElements = document.querySelectorAll('.chat-item');
-        
-        chatElements.forEach(chat => {
-            const name = chat.querySelector('h3').textContent.toLowerCase();
-            const waId = chat.querySelector('.chat-wa-id').textContent.toLowerCase();
-            const preview = chat.querySelector('p.truncate')?.textContent.toLowerCase() || '';
-            
-            const matches = name.includes(term) || waId.includes(term) || preview.includes(term);
-            chat.style.display = matches ? 'block' : 'none';
-        });
+        this.chatsQuery = searchTerm.trim();
+        this.chatsCursor = null;
+        this.chatsEtag = null;
+        this.chatsNext = null;
+        document.getElementById('chats-container').scrollTop = 0;
+        this.fetchChats();
     }
 
     // ==================== RESPONSIVE LAYOUT ====================
@@ -575,16 +738,62 @@ class WhatsAppChat {
         }
     }
 
-    // ==================== POLLING ====================
+    // ==================== LIVE UPDATES ====================
+
+    // Changes are pushed over /api/stream (Server-Sent Events) and each one
+    // triggers the same incremental reads a poll makes. Polling every 5s
+    // only runs while the stream is down or EventSource is unsupported.
+    startLiveUpdates() {
+        if (!window.EventSource) {
+            this.startPolling();
+            return;
+        }
+        this.stream = new EventSource(`/api/stream?phone_id=${encodeURIComponent(this.phoneId)}`);
+        // (Re)connected: catch up on anything missed while disconnected
+        this.stream.onopen = () => {
+            this.stopPolling();
+            this.scheduleSync(true);
+        };
+        // EventSource reconnects on its own (resuming from Last-Event-ID); poll meanwhile
+        this.stream.onerror = () => this.startPolling();
+        ['message.created', 'message.status', 'conversation.read'].forEach(type => {
+            this.stream.addEventListener(type, (e) => {
+                const event = JSON.parse(e.data);
+                this.scheduleSync(event.wa_id === this.currentWaId);
+            });
+        });
+        // Events were dropped: resync the chat list and the open thread
+        this.stream.addEventListener('sync', () => this.scheduleSync(true));
+    }
+
+    // A burst of events (a webhook batch) triggers one sync.
+    scheduleSync(thread) {
+        this.syncThread = this.syncThread || thread;
+        if (this.syncTimer) return;
+        this.syncTimer = setTimeout(() => {
+            const syncThread = this.syncThread;
+            this.syncTimer = null;
+            this.syncThread = false;
+            this.sync(syncThread);
+        }, 200);
+    }
+
+    async sync(thread = true) {
+        await this.fetchChats();
+
+        if (thread && this.currentWaId && this.currentContactName) {
+            await this.loadMessages(this.currentWaId, this.currentContactName, true);
+        }
+    }
 
     startPolling() {
-        setInterval(async () => {
-            await this.fetchChats();
-            
-            if (this.currentWaId && this.currentContactName) {
-                await this.loadMessages(this.currentWaId, this.currentContactName, true);
-            }
-        }, 5000); // Poll every 5 seconds
+        if (this.pollTimer) return;
+        this.pollTimer = setInterval(() => this.sync(), 5000); // Poll every 5 seconds
+    }
+
+    stopPolling() {
+        clearInterval(this.pollTimer);
+        this.pollTimer = null;
     }
 
     // ==================== HELPER FUNCTIONS ====================
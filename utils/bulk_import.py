@@ -0,0 +1,263 @@
+"""
+bulk_import.py — COPY-based bulk load of message history into a business table.
+
+Reloading an archive through insert_message() costs a round trip and a
+commit per row. import_messages() instead streams the file in batches: each
+batch is validated in Python, sent with one COPY FROM STDIN into a
+transaction-scoped temp table, and merged into the target with one
+INSERT ... SELECT built by DatabaseManager.build_merge_messages(). That merge
+has exactly insert_message()'s semantics: ids that already exist are left
+untouched, updated_at is NOW(), and for a business cut over to the
+partitioned messages table the id is claimed in message_ids first. The
+chat-list summaries of the batch's conversations are refreshed in the same
+transaction.
+
+Accepted input:
+
+    CSV     a header row naming message columns - e.g. an /api/export download
+    NDJSON  one message object per line, shaped like /api/messages rows (or a
+            whole saved /api/messages response per line)
+
+Rows that can't be loaded (missing id / wa_id, bad timestamp, over-long
+value, ...) are counted as rejects and, if a rejects path is given, written
+there as NDJSON with their line number and reason - they never abort the
+batch. Each batch is its own transaction, so an interrupted import can
+simply be re-run: rows already loaded are skipped by the merge.
+
+Driven by import_messages.py.
+"""
+
+import csv
+import io
+import json
+import logging
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+from utils.db_manager import MESSAGE_COLUMN_TYPES, MESSAGE_INSERT_COLUMNS
+from utils.partitioning import ensure_month_partitions
+
+logger = logging.getLogger(__name__)
+
+STAGING_TABLE = 'message_import'
+
+# Column widths of the message tables (see migration 1); longer values are
+# rejected up front instead of failing a whole COPY.
+COLUMN_LIMITS = {
+    'id': 255, 'wa_id': 255, 'name': 255, 'type': 50, 'direction': 50, 'status': 50,
+    'image_id': 255, 'template_name': 255,
+}
+OPTIONAL_COLUMNS = ('name', 'status', 'image_url', 'image_id', 'error_details', 'template_name')
+TRUE_VALUES = ('true', 't', '1', 'yes')
+FALSE_VALUES = ('false', 'f', '0', 'no', '')
+
+
+def detect_format(path):
+    """'csv' or 'ndjson' from the file extension."""
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+def read_rows(path, fmt):
+    """Yield (line_number, raw_row) for every message in `path`."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                yield line_number, ValueError(f"invalid JSON: {e}")
+                continue
+            if isinstance(data, dict) and isinstance(data.get('messages'), list):
+                for message in data['messages']:
+                    yield line_number, message
+            else:
+                yield line_number, data
+
+
+def _parse_timestamp(value):
+    if isinstance(value, datetime):
+        return value
+    if not value:
+        raise ValueError("timestamp is required")
+    text = str(value).strip()
+    try:
+        return datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        pass
+    try:
+        # Flask's jsonify() renders datetimes as HTTP dates.
+        return parsedate_to_datetime(text)
+    except (TypeError, ValueError):
+        raise ValueError(f"unrecognised timestamp {text!r}")
+
+
+def _parse_bool(value):
+    if isinstance(value, bool) or value is None:
+        return bool(value)
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f"unrecognised boolean {value!r}")
+
+
+def normalize(raw):
+    """
+    One input row as a tuple in MESSAGE_INSERT_COLUMNS order.
+
+    Raises:
+        ValueError: With the reason, if the row can't be loaded.
+    """
+    if isinstance(raw, Exception):
+        raise raw
+    if not isinstance(raw, dict):
+        raise ValueError("row is not an object")
+    row = {}
+    for column in MESSAGE_INSERT_COLUMNS:
+        value = raw.get(column)
+        if isinstance(value, str) and column in OPTIONAL_COLUMNS and value == '':
+            value = None
+        row[column] = value
+
+    for column in ('id', 'wa_id'):
+        if not row[column]:
+            raise ValueError(f"{column} is required")
+        row[column] = str(row[column])
+    if row['direction'] not in ('inbound', 'outbound'):
+        raise ValueError(f"direction must be inbound or outbound, got {row['direction']!r}")
+    row['timestamp'] = _parse_timestamp(row['timestamp'])
+    row['type'] = row['type'] or 'text'
+    row['body'] = '' if row['body'] is None else str(row['body'])
+    row['read'] = _parse_bool(row['read'])
+    if row['event_id'] in (None, ''):
+        row['event_id'] = None
+    else:
+        try:
+            row['event_id'] = int(row['event_id'])
+        except (TypeError, ValueError):
+            raise ValueError(f"event_id must be an integer, got {row['event_id']!r}")
+    for column, limit in COLUMN_LIMITS.items():
+        if row[column] is not None and len(str(row[column])) > limit:
+            raise ValueError(f"{column} is longer than {limit} characters")
+    return tuple(row[c] for c in MESSAGE_INSERT_COLUMNS)
+
+
+def _copy_value(value):
+    """One field in COPY's text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _load_batch(db_manager, table_name, rows):
+    """COPY one batch into the staging table and merge it; returns rows inserted."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(v) for v in row) + '\n')
+    columns = ", ".join(MESSAGE_INSERT_COLUMNS)
+    column_defs = ", ".join(f"{c} {t}" for c, t in zip(MESSAGE_INSERT_COLUMNS, MESSAGE_COLUMN_TYPES))
+    merge_query, merge_params = db_manager.build_merge_messages(table_name, STAGING_TABLE)
+    wa_ids = {row[MESSAGE_INSERT_COLUMNS.index('wa_id')] for row in rows}
+
+    def work(session):
+        buffer.seek(0)  # a retried attempt re-sends the whole batch
+        session.execute(f"CREATE TEMP TABLE {STAGING_TABLE} ({column_defs}) ON COMMIT DROP")
+        session.cursor.copy_expert(f"COPY {STAGING_TABLE} ({columns}) FROM STDIN", buffer)
+        session.execute(merge_query, merge_params)
+        inserted = session.cursor.rowcount
+        if inserted:
+            db_manager.refresh_conversation_summaries({table_name: wa_ids}, session=session)
+        return inserted
+
+    return db_manager.run_in_session(work, label='bulk_import')
+
+
+def import_messages(db_manager, table_name, path, fmt=None, batch_size=50000, rejects_path=None, progress=None):
+    """
+    Load every message in `path` into `table_name`.
+
+    Args:
+        db_manager: DatabaseManager to load through.
+        table_name (str): Full table name, e.g. 'public.eventio_messages'.
+        path (str): CSV or NDJSON file.
+        fmt (str): 'csv' or 'ndjson' (default: from the file extension).
+        batch_size (int): Rows per COPY + merge transaction.
+        rejects_path (str): Optional NDJSON file to write rejected rows to.
+        progress (callable): Optional progress(report) after every batch,
+            with the running totals described below.
+
+    Returns:
+        dict: {read, loaded, inserted, existing, rejected, seconds, rows_per_second}
+            - `loaded` rows were sent to the database, of which `inserted`
+            were new and `existing` were already there.
+    """
+    fmt = fmt or detect_format(path)
+    partitioned = db_manager.partitioned_tenant(table_name) is not None
+    partitions_from = None
+    started = time.monotonic()
+    report = {'read': 0, 'loaded': 0, 'inserted': 0, 'existing': 0, 'rejected': 0}
+    rejects = open(rejects_path, 'w', encoding='utf-8') if rejects_path else None
+
+    def flush(batch):
+        nonlocal partitions_from
+        oldest = min(row[MESSAGE_INSERT_COLUMNS.index('timestamp')].date() for row in batch)
+        if partitioned and (partitions_from is None or oldest < partitions_from):
+            # History can predate the monthly partitions kept by the scheduler.
+            ensure_month_partitions(db_manager, since=oldest, schema=table_name.rpartition('.')[0] or 'public')
+            partitions_from = oldest
+        inserted = _load_batch(db_manager, table_name, batch)
+        report['loaded'] += len(batch)
+        report['inserted'] += inserted
+        report['existing'] += len(batch) - inserted
+        _finish_report(report, started)
+        if progress is not None:
+            progress(report)
+
+    try:
+        batch = []
+        for line_number, raw in read_rows(path, fmt):
+            report['read'] += 1
+            try:
+                batch.append(normalize(raw))
+            except ValueError as e:
+                report['rejected'] += 1
+                if rejects is not None:
+                    rejects.write(json.dumps(
+                        {'line': line_number, 'error': str(e), 'row': None if isinstance(raw, Exception) else raw},
+                        default=str,
+                    ) + '\n')
+                continue
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    finally:
+        if rejects is not None:
+            rejects.close()
+
+    _finish_report(report, started)
+    logger.info(
+        f"✅ Imported {path} into {table_name}: {report['inserted']} new, {report['existing']} already present, "
+        f"{report['rejected']} rejected ({report['rows_per_second']:.0f} rows/s)"
+    )
+    return report
+
+
+def _finish_report(report, started):
+    report['seconds'] = round(time.monotonic() - started, 2)
+    report['rows_per_second'] = report['read'] / report['seconds'] if report['seconds'] else 0.0
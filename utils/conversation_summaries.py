@@ -0,0 +1,277 @@
+"""
+conversation_summaries.py — One row per conversation for the chat list.
+
+/api/chats used to run DISTINCT ON (wa_id) over a business's whole message
+table and join an unread GROUP BY to it, on every dashboard poll of every
+open tab. conversation_summaries (migration 9) keeps that answer instead,
+keyed by (tenant, wa_id): the contact name, the last message (id, body,
+timestamp, direction, status) and the unread inbound count. The chat list
+is then an index scan of the top N rows by last_message_timestamp.
+
+Every write path that can change a conversation's summary - message
+inserts (insert_message, write_webhook_batch, group commit, bulk import),
+status updates (they can change the last message's status) and the
+mark-read paths - ends its transaction with build_refresh_summaries() for
+the conversations it touched. A refresh recomputes each conversation from
+its messages with two index lookups ((wa_id, timestamp) and the partial
+unread index), so redeliveries, out-of-order callbacks and replays can't
+skew it the way incremental +1/-1 counters would.
+
+Two transactions refreshing the same conversation are serialized by a
+transaction-scoped advisory lock per conversation, taken in one statement
+in a fixed order; the recompute runs in the next statement, so it sees
+whatever the other transaction committed. rebuild_conversation_summaries()
+(and rebuild_conversation_summaries.py) recomputes a whole business from
+scratch, e.g. after messages were changed outside the app.
+
+Pollers sync incrementally: updated_at is stamped with clock_timestamp()
+by the refresh - its last statement before commit, so it tracks commit
+order closely - and chat_changes_query() returns the summaries changed
+after a client's cursor. A refresh that changes nothing (a status
+callback for an older message, a redelivery, a mark-read with nothing
+unread) leaves the row and its updated_at alone, so idle chats stay out of
+the changes feed. A transaction that stamps its rows and then
+commits after a later one could otherwise be skipped, so a changes query
+looks CHANGE_OVERLAP_SECONDS further back; clients merge by wa_id, keeping
+the newer updated_at, so the overlap only ever re-sends rows.
+
+The list itself is paged by keyset rather than OFFSET (see utils/keyset.py):
+chats are ordered by (last_message_timestamp, wa_id) descending and each
+page ends with an opaque cursor (encode_page_cursor) holding the last
+row's key. A chat only moves up the list (its last message gets newer),
+so one that moves while a client is paging is skipped by the later pages
+but arrives through the changes query instead. Both queries take an optional search term, matched
+against the contact name and phone number with trigram indexes
+(migration 11).
+"""
+
+import logging
+import re
+import zlib
+from datetime import datetime
+
+from utils.keyset import decode_cursor, encode_cursor
+from utils.migrations import TENANTS
+
+logger = logging.getLogger(__name__)
+
+# First key of the pg_advisory_xact_lock(int, int) pair taken per conversation.
+SUMMARY_LOCK_KEY = zlib.crc32(b"conversation_summaries") & 0x7fffffff
+
+# Columns the chat list reads, in order.
+SUMMARY_COLUMNS = (
+    'wa_id', 'name', 'last_message_timestamp', 'last_body', 'unread_count',
+    'last_direction', 'last_status', 'last_message_id', 'updated_at',
+)
+
+# How far before a client's cursor chat_changes_query() looks again.
+CHANGE_OVERLAP_SECONDS = 5
+
+# Chat-list order: most recent first, then wa_id, with conversations that
+# have no timestamp last. Matches idx_conversation_summaries_keyset.
+RECENCY_KEY = "COALESCE(last_message_timestamp, '-infinity'::timestamptz)"
+
+_UPSERT_COLUMNS = (
+    "tenant, wa_id, name, last_message_id, last_body, last_message_timestamp, "
+    "last_direction, last_status, unread_count, updated_at"
+)
+
+# Summary columns a refresh can change; updated_at only moves when one does.
+_SUMMARY_FIELDS = (
+    'name', 'last_message_id', 'last_body', 'last_message_timestamp',
+    'last_direction', 'last_status', 'unread_count',
+)
+
+_ON_CONFLICT = f"""
+    ON CONFLICT (tenant, wa_id) DO UPDATE SET
+        {", ".join(f"{column} = EXCLUDED.{column}" for column in _SUMMARY_FIELDS)},
+        updated_at = clock_timestamp()
+    WHERE ({", ".join(f"cs.{column}" for column in _SUMMARY_FIELDS)})
+          IS DISTINCT FROM ({", ".join(f"EXCLUDED.{column}" for column in _SUMMARY_FIELDS)})
+"""
+
+
+def summary_target(table_name):
+    """(summaries table, tenant) for a message table such as 'public.eventio_messages'."""
+    schema, _, name = table_name.rpartition('.')
+    return f"{schema or 'public'}.conversation_summaries", TENANTS[name]
+
+
+def build_refresh_summaries(wa_ids_by_table):
+    """
+    Statements recomputing the summaries of the given conversations, to run
+    at the END of the transaction that changed their messages (after every
+    message write, so the advisory locks are always taken last).
+
+    Args:
+        wa_ids_by_table (dict): {table_name: iterable of wa_ids}
+
+    Returns:
+        list: (query, params) pairs - empty if there is nothing to refresh.
+    """
+    targets = {
+        table: sorted({str(wa_id) for wa_id in wa_ids if wa_id})
+        for table, wa_ids in sorted(wa_ids_by_table.items())
+    }
+    targets = {table: wa_ids for table, wa_ids in targets.items() if wa_ids}
+    if not targets:
+        return []
+
+    lock_names = [f"{summary_target(table)[1]}:{wa_id}" for table, wa_ids in targets.items() for wa_id in wa_ids]
+    statements = [(
+        """
+        SELECT pg_advisory_xact_lock(%s, k)
+        FROM (SELECT DISTINCT hashtext(n) AS k FROM unnest(%s::text[]) AS n ORDER BY k) keys
+        """,
+        (SUMMARY_LOCK_KEY, lock_names),
+    )]
+    for table, wa_ids in targets.items():
+        summaries, tenant = summary_target(table)
+        statements.append((f"""
+            INSERT INTO {summaries} AS cs ({_UPSERT_COLUMNS})
+            SELECT %s, w.wa_id, last.name, last.id, last.body, last.timestamp, last.direction, last.status,
+                   (SELECT COUNT(*) FROM {table} u
+                    WHERE u.wa_id = w.wa_id AND u.direction = 'inbound' AND u.read = FALSE),
+                   clock_timestamp()
+            FROM unnest(%s::varchar[]) AS w(wa_id)
+            CROSS JOIN LATERAL (
+                SELECT id, name, body, timestamp, direction, status
+                FROM {table} m
+                WHERE m.wa_id = w.wa_id
+                ORDER BY m.timestamp DESC
+                LIMIT 1
+            ) last
+            {_ON_CONFLICT}
+        """, (tenant, wa_ids)))
+    return statements
+
+
+def build_rebuild_summaries(table_name):
+    """
+    Statements replacing every summary of `table_name`'s business with one
+    recomputed from its messages. The table lock holds concurrent
+    refreshes back until the rebuild commits; they then recompute on top.
+    """
+    summaries, tenant = summary_target(table_name)
+    return [
+        (f"LOCK TABLE {summaries} IN SHARE ROW EXCLUSIVE MODE", None),
+        (f"DELETE FROM {summaries} WHERE tenant = %s", (tenant,)),
+        (f"""
+            INSERT INTO {summaries} ({_UPSERT_COLUMNS})
+            SELECT %s, l.wa_id, l.name, l.id, l.body, l.timestamp, l.direction, l.status,
+                   COALESCE(u.unread_count, 0), clock_timestamp()
+            FROM (
+                SELECT DISTINCT ON (wa_id) wa_id, name, id, body, timestamp, direction, status
+                FROM {table_name}
+                WHERE wa_id IS NOT NULL
+                ORDER BY wa_id, timestamp DESC
+            ) l
+            LEFT JOIN (
+                SELECT wa_id, COUNT(*) AS unread_count
+                FROM {table_name}
+                WHERE direction = 'inbound' AND read = FALSE
+                GROUP BY wa_id
+            ) u ON u.wa_id = l.wa_id
+        """, (tenant,)),
+    ]
+
+
+def rebuild_conversation_summaries(db_manager, table_name):
+    """
+    Recompute every conversation summary of one business in one
+    transaction. Returns the number of conversations written.
+    """
+    statements = build_rebuild_summaries(table_name)
+
+    def work(session):
+        for query, params in statements:
+            session.execute(query, params)
+        return session.cursor.rowcount
+
+    count = db_manager.run_in_session(work, label='summary_rebuild')
+    logger.info(f"✅ Rebuilt {count} conversation summaries for {table_name}")
+    return count
+
+
+def encode_page_cursor(chat):
+    """Opaque cursor for the page after `chat`, the last row of a chat-list page."""
+    return encode_cursor(chat['last_message_timestamp'], chat['wa_id'])
+
+
+def decode_page_cursor(token):
+    """
+    (last_message_timestamp, wa_id) from an encode_page_cursor() token.
+
+    Raises:
+        ValueError: if the token is malformed.
+    """
+    return decode_cursor(token, datetime, str)
+
+
+def _contains_pattern(text):
+    """LIKE pattern matching `text` anywhere, with its wildcards escaped."""
+    return "%" + re.sub(r'([\\%_])', r'\\\1', text) + "%"
+
+
+def _search_filter(q):
+    """
+    (sql, params) matching `q` against the contact name, and its digits (if
+    any) against the phone number - so '+44 7700' finds 447700...
+    """
+    if not q:
+        return "", ()
+    digits = re.sub(r'\D', '', q)
+    if digits:
+        return " AND (name ILIKE %s OR wa_id LIKE %s)", (_contains_pattern(q), _contains_pattern(digits))
+    return " AND name ILIKE %s", (_contains_pattern(q),)
+
+
+def chat_list_query(table_name, limit, after=None, q=None):
+    """
+    (query, params) for a page of a business's conversations, most recently
+    active first.
+
+    Args:
+        table_name (str): The business's message table.
+        limit (int): Page size.
+        after (tuple): Optional (last_message_timestamp, wa_id) of the
+            previous page's last row - see decode_page_cursor().
+        q (str): Optional search term for the name / phone number.
+    """
+    summaries, tenant = summary_target(table_name)
+    search, search_params = _search_filter(q)
+    keyset, keyset_params = "", ()
+    if after is not None:
+        keyset = f" AND ({RECENCY_KEY}, wa_id) < (COALESCE(%s::timestamptz, '-infinity'::timestamptz), %s)"
+        keyset_params = tuple(after)
+    return f"""
+        SELECT {", ".join(SUMMARY_COLUMNS)}
+        FROM {summaries}
+        WHERE tenant = %s{keyset}{search}
+        ORDER BY {RECENCY_KEY} DESC, wa_id DESC
+        LIMIT %s
+    """, (tenant, *keyset_params, *search_params, limit)
+
+
+def chat_changes_query(table_name, since, limit, q=None):
+    """
+    (query, params) for up to `limit` conversations of a business whose
+    summary changed after the `since` cursor (a datetime), oldest change
+    first, looking CHANGE_OVERLAP_SECONDS further back. `q` narrows it to
+    the conversations a search shows.
+    """
+    summaries, tenant = summary_target(table_name)
+    search, search_params = _search_filter(q)
+    return f"""
+        SELECT {", ".join(SUMMARY_COLUMNS)}
+        FROM {summaries}
+        WHERE tenant = %s AND updated_at > %s - INTERVAL '{CHANGE_OVERLAP_SECONDS} seconds'{search}
+        ORDER BY updated_at ASC
+        LIMIT %s
+    """, (tenant, since, *search_params, limit)
+
+
+def chat_cursor_query(table_name):
+    """(query, params) for the latest change of a business - the cursor after a full list."""
+    summaries, tenant = summary_target(table_name)
+    return f"SELECT MAX(updated_at) AS cursor FROM {summaries} WHERE tenant = %s", (tenant,)
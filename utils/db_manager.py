@@ -1,9 +1,29 @@
 import psycopg2
 import logging
-from psycopg2.extras import RealDictCursor
 import os
 from dotenv import load_dotenv
 import time
+import uuid
+from contextlib import contextmanager
+
+from utils.db_pool import IdleClosingPool
+from utils.db_replicas import ReplicaSet
+from utils.db_resilience import CircuitBreaker, RetryPolicy, is_connection_failure, is_transient
+from utils.conversation_summaries import build_refresh_summaries
+from utils.stream_events import build_insert_stream_events, created_event, status_event
+from utils.event_cache import LastOutboundEventCache
+from utils.metrics import (
+    DB_CALL_SECONDS,
+    DB_CONNECT_SECONDS,
+    DB_RETRIES,
+    DB_STATEMENT_ROWS,
+    DB_STATEMENT_SECONDS,
+)
+from utils.group_commit import GroupCommitWriter
+from utils.migrations import TENANTS, run_migrations
+from utils.row_formats import cursor_factory, wrap_rows
+from utils.slow_queries import SlowQueryLog
+from config import STREAM_ENABLED
 
 # Load environment variables
 load_dotenv()
@@ -16,10 +36,139 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Column order used by every message INSERT (updated_at is always NOW()).
+MESSAGE_INSERT_COLUMNS = (
+    'id', 'wa_id', 'name', 'type', 'body', 'timestamp', 'direction', 'status', 'read',
+    'image_url', 'image_id', 'error_details', 'event_id', 'template_name',
+)
+
+# SQL types of MESSAGE_INSERT_COLUMNS, for VALUES lists that feed an
+# INSERT ... SELECT (where untyped NULLs would otherwise default to text).
+MESSAGE_COLUMN_TYPES = (
+    'varchar', 'varchar', 'varchar', 'varchar', 'text', 'timestamptz', 'varchar', 'varchar', 'boolean',
+    'text', 'varchar', 'text', 'integer', 'varchar',
+)
+
+# SQLSTATE for a write attempted on a read-only (replica) connection.
+READ_ONLY_SQL_TRANSACTION = '25006'
+
+# Returned by DatabaseManager._run_on_replica() when the primary must serve the call.
+_NO_REPLICA = object()
+
+# Metrics label for statements whose caller didn't name them.
+UNLABELLED = 'unlabelled'
+
+# Rows fetched per round trip by iter_query()'s server-side cursors.
+ITER_QUERY_ITERSIZE = 2000
+
+# How often to re-check which per-business tables have been cut over to
+# views of the partitioned messages table (see utils/partitioning.py).
+PARTITIONED_VIEWS_TTL = 60  # seconds
+
+# What a legacy-table write gets from a table that has since become such a
+# view: ON CONFLICT (id) matches no unique index on the partitioned table
+# (42P10), or the view can't take the write at all (55000).
+STALE_ROUTING_SQLSTATES = {'42P10', '55000'}
+
+# Delivery statuses only ever move forward: sent < delivered < read, and
+# failed is terminal. Meta's callbacks can arrive out of order, so status
+# writes are guarded to apply only transitions to a higher rank.
+STATUS_RANK = {'sent': 1, 'delivered': 2, 'read': 3, 'failed': 4}
+
+
+def status_rank_sql(column):
+    """SQL CASE expression giving the STATUS_RANK of `column` (0 if unknown)."""
+    cases = " ".join(f"WHEN '{status}' THEN {rank}" for status, rank in STATUS_RANK.items())
+    return f"(CASE {column} {cases} ELSE 0 END)"
+
+
+def merge_status_update(existing, update):
+    """Of two updates for the same message, keep the furthest-along one."""
+    if existing is None or STATUS_RANK.get(update['status'], 0) > STATUS_RANK.get(existing['status'], 0):
+        return update
+    return existing
+
+
+class DatabaseSession:
+    """
+    One connection and one transaction shared by several statements.
+
+    Obtained from DatabaseManager.session() / run_in_session(); every
+    statement run through it commits or rolls back together. Results are
+    returned from execute() and also collected, in order, on `results`, in
+    the session's row_format (see utils/row_formats.py).
+
+    Each statement's execute and fetch time and row count are recorded
+    under a stable label (see utils/metrics.py): the one passed to
+    execute(), else the session's own. Statements over the slow-query
+    threshold also go to `slow_log` (see utils/slow_queries.py).
+    """
+
+    def __init__(self, cursor, row_format='dict', label=None, slow_log=None):
+        self.cursor = cursor
+        self.row_format = row_format
+        self.label = label or UNLABELLED
+        self.slow_log = slow_log
+        self.results = []
+        self._after_commit = []
+
+    def execute(self, query, params=None, label=None):
+        """
+        Run one statement in this session's transaction.
+
+        Args:
+            query (str): SQL statement.
+            params (tuple): Parameters for the statement (optional).
+            label (str): Metrics name for the statement (default: the
+                session's label).
+
+        Returns:
+            list or None: The fetched rows if the statement returns any
+            (SELECT / RETURNING), None otherwise.
+        """
+        label = label or self.label
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Executing {label}: {query[:100]}..." if len(query) > 100 else f"Executing {label}: {query}")
+        started = time.perf_counter()
+        self.cursor.execute(query, params)
+        executed = time.perf_counter()
+        DB_STATEMENT_SECONDS.observe(executed - started, statement=label, phase='execute')
+        rows = None
+        if self.cursor.description is not None:
+            rows = wrap_rows(self.cursor.fetchall(), self.row_format, self.cursor.description)
+            DB_STATEMENT_SECONDS.observe(time.perf_counter() - executed, statement=label, phase='fetch')
+            DB_STATEMENT_ROWS.inc(len(rows), statement=label)
+        if self.slow_log is not None:
+            self.slow_log.observe(query, params, time.perf_counter() - started, label,
+                                  None if rows is None else len(rows))
+        self.results.append(rows)
+        return rows
+
+    def after_commit(self, callback):
+        """Run `callback()` once this session's transaction has committed."""
+        self._after_commit.append(callback)
+
+    def _run_after_commit(self):
+        for callback in self._after_commit:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"After-commit callback failed: {e}")
+        self._after_commit = []
+
+
 class DatabaseManager:
     """A class to manage PostgreSQL database connections and queries."""
     
-    def __init__(self, host, port, dbname, user, password, sslmode='require', channel_binding='require'):
+    def __init__(self, host, port, dbname, user, password, sslmode='require', channel_binding='require',
+                 event_cache_capacity=5000, event_cache_ttl=300,
+                 pool_enabled=False, pool_min=1, pool_max=10, pool_idle_timeout=60,
+                 connect_timeout=5, retry_max_attempts=4, retry_deadline=10,
+                 breaker_failure_threshold=5, breaker_reset_timeout=30,
+                 group_commit_ms=0, group_commit_max_rows=500,
+                 replica_dsns=None, replica_max_lag=10, replica_lag_check_interval=5,
+                 slow_query_ms=500, slow_query_explain_sample=0.1, slow_query_buffer=200,
+                 slow_query_explain_timeout_ms=10000, stream_events=False):
         """
         Initialize the DatabaseManager with connection parameters.
         
@@ -31,48 +180,432 @@ class DatabaseManager:
             password (str): Database password.
             sslmode (str): SSL mode (default: 'require').
             channel_binding (str): Channel binding mode (default: 'require').
+            event_cache_capacity (int): Contacts kept in the last-outbound
+                event_id cache (0 disables it).
+            event_cache_ttl (int): Seconds before a cached event_id is re-read.
+            pool_enabled (bool): Reuse connections via IdleClosingPool instead
+                of opening one per query (default: False).
+            pool_min (int): Spare connections kept warm while traffic flows.
+            pool_max (int): Max open connections per process.
+            pool_idle_timeout (int): Seconds without traffic after which every
+                pooled connection is closed so Neon can scale to zero.
+            connect_timeout (int): libpq connect timeout per attempt (seconds).
+            retry_max_attempts (int): Tries per call for transient errors.
+            retry_deadline (float): Max seconds one call spends, retries included.
+            breaker_failure_threshold (int): Consecutive connection failures
+                that open the circuit breaker (0 disables it).
+            breaker_reset_timeout (float): Seconds the breaker stays open
+                before letting a trial call through.
+            group_commit_ms (int): If > 0, insert_message() and
+                update_message_status() calls outside a session are gathered
+                for this many ms and committed together (see
+                utils/group_commit.py). 0 disables group commit.
+            group_commit_max_rows (int): Commit a group early at this size.
+            replica_dsns (list): Optional libpq connection strings (or URIs)
+                of read replicas. Calls made with use_replica=True run there (see
+                utils/db_replicas.py); everything else uses the primary.
+            replica_max_lag (float): Seconds of replay lag beyond which a
+                replica is skipped in favour of the primary.
+            replica_lag_check_interval (float): Seconds between lag checks.
+            slow_query_ms (float): Statements slower than this are logged and
+                kept for /api/slow-queries (see utils/slow_queries.py).
+                0 disables the slow-query log.
+            slow_query_explain_sample (float): Fraction of slow statements
+                re-planned in the background with EXPLAIN (ANALYZE, BUFFERS).
+            slow_query_buffer (int): Slow statements kept in memory.
+            slow_query_explain_timeout_ms (int): statement_timeout for each
+                background EXPLAIN.
+            stream_events (bool): Record stream_events for the dashboards'
+                /api/stream (see utils/stream_events.py). Off, writes skip
+                them entirely.
         """
         self.connection_string = (
             f"host={host} port={port} dbname={dbname} user={user} password={password} "
-            f"sslmode={sslmode} channel_binding={channel_binding}"
+            f"sslmode={sslmode} channel_binding={channel_binding} connect_timeout={connect_timeout}"
         )
-        self.max_retries = 3
-        self.retry_delay = 1  # seconds
-        # Verify connectivity once at startup, then let the connection close so
-        # Neon can scale its compute to zero while the app is idle.
-        self.create_tables_if_not_exists()
+        self.retry_policy = RetryPolicy(max_attempts=retry_max_attempts, deadline=retry_deadline)
+        self.breaker = CircuitBreaker(breaker_failure_threshold, breaker_reset_timeout)
+        self.outbound_event_cache = LastOutboundEventCache(event_cache_capacity, event_cache_ttl)
+        self._partitioned_views = None
+        self._partitioned_checked_at = 0.0
+        self.stream_events = stream_events
+        self.pool = None
+        if pool_enabled:
+            self.pool = IdleClosingPool(
+                self._new_connection,
+                minconn=pool_min,
+                maxconn=pool_max,
+                idle_timeout=pool_idle_timeout,
+            )
+        self.replicas = None
+        if replica_dsns:
+            self.replicas = ReplicaSet(
+                replica_dsns,
+                connect_timeout=connect_timeout,
+                max_lag=replica_max_lag,
+                lag_check_interval=replica_lag_check_interval,
+            )
+        self.group_commit = None
+        if group_commit_ms > 0:
+            self.group_commit = GroupCommitWriter(self, flush_ms=group_commit_ms, max_rows=group_commit_max_rows)
+        self.slow_queries = None
+        if slow_query_ms > 0:
+            self.slow_queries = SlowQueryLog(
+                # Its own connection, outside the pool and the retry policy.
+                self._new_connection,
+                threshold_ms=slow_query_ms,
+                explain_sample=slow_query_explain_sample,
+                capacity=slow_query_buffer,
+                explain_timeout_ms=slow_query_explain_timeout_ms,
+                available=lambda: self.breaker.state == CircuitBreaker.CLOSED,
+            )
 
     def _new_connection(self):
         """
-        Open a fresh short-lived connection with retry logic and return it.
+        Open a fresh short-lived connection and return it.
 
         Connections are intentionally NOT kept open between queries: holding a
         persistent connection keeps Neon's compute awake 24/7. Opening per query
         lets the compute scale to zero during idle periods (the app's normal
         state between bursts of WhatsApp traffic).
+
+        There is deliberately no retry loop here: connect failures are retried
+        by the caller's retry policy (see _run_with_retry), under one deadline.
         """
-        retry_count = 0
+        return psycopg2.connect(self.connection_string)
+
+    def _acquire(self):
+        """A connection for one unit of work: pooled if enabled, else fresh."""
+        with DB_CONNECT_SECONDS.time(target='primary'):
+            if self.pool is not None:
+                return self.pool.getconn()
+            return self._new_connection()
+
+    def _release(self, conn, broken=False):
+        """Hand a connection back to the pool, or close it in per-query mode."""
+        if self.pool is not None:
+            self.pool.putconn(conn, discard=broken)
+        else:
+            conn.close()
+
+    def close(self):
+        """Close any pooled idle connections.
+
+        In the default per-query mode connections are short-lived and closed
+        after each query, so there is nothing to tear down.
+        """
+        if self.pool is not None:
+            self.pool.close_idle()
+
+    def _run_with_retry(self, work, row_format='dict', use_replica=False, label=UNLABELLED):
+        """
+        Take a connection, run `work(cursor)`, commit, and return its
+        result - retrying transient failures (see utils/db_resilience.py)
+        the same way for single statements and multi-statement transactions
+        alike, with jittered backoff and one deadline for the whole call.
+
+        Everything `work` executes shares one connection and one transaction,
+        so it either all commits or all rolls back. While the circuit
+        breaker is open this raises DatabaseUnavailable without connecting.
+        The cursor returns rows in `row_format`.
+
+        With use_replica=True `work` runs on a read replica if one is
+        usable, and on the primary otherwise or if the replica fails.
+        The whole call is timed under `label`.
+        """
+        with DB_CALL_SECONDS.time(statement=label):
+            return self._run_with_retry_untimed(work, cursor_factory(row_format), use_replica, label)
+
+    def _run_with_retry_untimed(self, work, factory, use_replica, label):
+        if use_replica and self.replicas is not None:
+            result = self._run_on_replica(work, factory)
+            if result is not _NO_REPLICA:
+                return result
+        deadline = time.monotonic() + self.retry_policy.deadline
+        attempt = 0
         while True:
+            self.breaker.before_call()
+            attempt += 1
+            conn = None
+            broken = False
             try:
-                return psycopg2.connect(self.connection_string)
+                conn = self._acquire()
+                cursor = conn.cursor(cursor_factory=factory)
+                result = work(cursor)
+                conn.commit()
+                self.breaker.record_success()
+                return result
+
             except psycopg2.Error as e:
-                retry_count += 1
-                logger.error(f"Failed to connect to database (attempt {retry_count}/{self.max_retries}): {e}")
-                if retry_count < self.max_retries:
-                    time.sleep(self.retry_delay)
-                else:
-                    logger.error(f"Failed to connect to database after {self.max_retries} attempts")
-                    raise
+                broken = is_transient(e) or isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+                self._backoff_or_raise(e, attempt, deadline, label)
 
-    def close(self):
-        """No-op kept for backwards compatibility.
+            except Exception as e:
+                broken = True
+                self._settle_breaker(conn)
+                logger.error(f"Unexpected error executing query: {e}")
+                raise
+
+            finally:
+                if conn is not None:
+                    self._release(conn, broken)
+
+    def _run_on_replica(self, work, factory):
+        """One try of `work` on a replica; _NO_REPLICA means "use the primary instead"."""
+        conn, replica = self.replicas.acquire()
+        if conn is None:
+            return _NO_REPLICA
+        try:
+            result = work(conn.cursor(cursor_factory=factory))
+            conn.commit()
+            return result
+        except psycopg2.Error as e:
+            if not self._replica_fallback(replica, e):
+                raise
+            return _NO_REPLICA
+        finally:
+            self.replicas.release(conn)
+
+    def _replica_fallback(self, replica, error):
+        """True if `error` on a replica should send the call to the primary."""
+        if error.pgcode == READ_ONLY_SQL_TRANSACTION:
+            logger.error(f"Write routed to a read replica, retrying on the primary: {error}")
+            return True
+        if is_transient(error):
+            self.replicas.mark_failed(replica, error)
+            return True
+        return False
+
+    def _backoff_or_raise(self, error, attempt, deadline, label=UNLABELLED):
+        """
+        Record `error` with the circuit breaker, then either sleep before the
+        next attempt (transient, within budget) or re-raise it. Must be
+        called from inside the `except` block handling `error`.
+        """
+        policy = self.retry_policy
+        if not is_transient(error):
+            # The server answered, so it's up - just not for this query.
+            self.breaker.record_success()
+            logger.error(f"Database error (SQLSTATE {error.pgcode}): {error}")
+            raise
+        if is_connection_failure(error):
+            self.breaker.record_failure()
+        else:
+            # A deadlock or serialization failure: retry it, but the
+            # server answered.
+            self.breaker.record_success()
+        delay = policy.backoff(attempt)
+        if attempt >= policy.max_attempts or time.monotonic() + delay > deadline:
+            logger.error(f"Database unavailable after {attempt} attempt(s) (SQLSTATE {error.pgcode}): {error}")
+            raise
+        logger.warning(
+            f"Transient database error in {label} (attempt {attempt}/{policy.max_attempts}, "
+            f"SQLSTATE {error.pgcode}), retrying in {delay:.2f}s: {error}"
+        )
+        DB_RETRIES.inc(statement=label)
+        time.sleep(delay)
+
+    def _settle_breaker(self, conn):
+        """After a non-database exception, settle a half-open trial either way so the breaker can't wedge."""
+        if conn is not None:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def iter_query(self, query, params=None, itersize=ITER_QUERY_ITERSIZE, row_format='dict',
+                   use_replica=False, label=UNLABELLED):
+        """
+        Stream the results of a SELECT in chunks through a named server-side
+        cursor, so memory stays flat however many rows match.
+
+        The connection is taken when iteration starts and released when the
+        generator finishes, raises, or is closed early (e.g. the client of a
+        streamed response disconnects). Transient failures are retried only
+        until the first chunk has been produced; after that an error ends
+        the stream.
+
+        Args:
+            query (str): SQL SELECT to run.
+            params (tuple): Parameters for the query (optional).
+            itersize (int): Rows fetched per round trip and per chunk.
+            row_format (str): 'dict', 'tuple' or 'record' (see
+                utils/row_formats.py).
+            use_replica (bool): Stream from a read replica if one is usable
+                (falling back to the primary until the first chunk).
+            label (str): Metrics name for the statement.
+
+        Yields:
+            list: Up to `itersize` rows at a time - RealDictRows, a TupleRows
+            carrying the column header, or records.
+        """
+        factory = cursor_factory(row_format)
+
+        def fetch_chunk(cursor):
+            with DB_STATEMENT_SECONDS.time(statement=label, phase='fetch'):
+                chunk = wrap_rows(cursor.fetchmany(itersize), row_format, cursor.description)
+            DB_STATEMENT_ROWS.inc(len(chunk), statement=label)
+            return chunk
+
+        def open_stream(conn):
+            cursor = conn.cursor(name=f"iter_{uuid.uuid4().hex}", cursor_factory=factory)
+            cursor.itersize = itersize
+            started = time.perf_counter()
+            cursor.execute(query, params)
+            elapsed = time.perf_counter() - started
+            DB_STATEMENT_SECONDS.observe(elapsed, statement=label, phase='execute')
+            if self.slow_queries is not None:
+                self.slow_queries.observe(query, params, elapsed, label)
+            return cursor, fetch_chunk(cursor)
+
+        conn = replica = None
+        if use_replica and self.replicas is not None:
+            conn, replica = self.replicas.acquire()
+            if conn is not None:
+                try:
+                    cursor, chunk = open_stream(conn)
+                except psycopg2.Error as e:
+                    self.replicas.release(conn)
+                    if not self._replica_fallback(replica, e):
+                        raise
+                    conn = replica = None
+
+        deadline = time.monotonic() + self.retry_policy.deadline
+        attempt = 0
+        while conn is None:
+            self.breaker.before_call()
+            attempt += 1
+            try:
+                conn = self._acquire()
+                cursor, chunk = open_stream(conn)
+                self.breaker.record_success()
+            except psycopg2.Error as e:
+                if conn is not None:
+                    self._release(conn, broken=True)
+                    conn = None
+                self._backoff_or_raise(e, attempt, deadline, label)
+            except Exception:
+                if conn is not None:
+                    self._release(conn, broken=True)
+                self._settle_breaker(conn)
+                raise
+
+        broken = False
+        rows = 0
+        try:
+            while chunk:
+                rows += len(chunk)
+                yield chunk
+                if len(chunk) < itersize:
+                    break
+                chunk = fetch_chunk(cursor)
+            cursor.close()
+            conn.commit()
+            logger.debug(f"Streamed {rows} rows")
+        except psycopg2.Error as e:
+            broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            logger.error(f"Streaming query failed after {rows} rows: {e}")
+            raise
+        finally:
+            # An unfinished transaction (early close) is rolled back by the
+            # pool on return, or dropped with the connection otherwise.
+            if replica is not None:
+                self.replicas.release(conn)
+            else:
+                self._release(conn, broken)
+
+    def run_in_session(self, work, row_format='dict', use_replica=False, label=None):
+        """
+        Run `work(session)` as one unit of work: one connection, one
+        transaction, committed when it returns. Transient connection
+        failures re-run the whole of `work` on a fresh connection, so it
+        must not have side effects outside the database. The session
+        returns rows in `row_format`; use_replica=True runs a read-only
+        `work` on a read replica when one is usable. `label` names the
+        call and its statements in the metrics.
+
+        Returns:
+            Whatever `work` returns.
+        """
+        sessions = []
+
+        def run(cursor):
+            session = DatabaseSession(cursor, row_format, label, self.slow_queries)
+            sessions.append(session)
+            return work(session)
+
+        result = self._run_with_retry(run, row_format, use_replica, label or UNLABELLED)
+        sessions[-1]._run_after_commit()
+        return result
 
-        Connections are now short-lived and closed after each query, so there
-        is no persistent connection to tear down.
+    @contextmanager
+    def session(self, use_replica=False, label=None):
         """
-        return
+        Context manager yielding a DatabaseSession for several statements
+        on one connection in one transaction:
 
-    def execute_query(self, query, params=None, fetch=False):
+            with db_manager.session() as session:
+                rows = session.execute("SELECT ...", params)
+                session.execute("UPDATE ...", params)
+
+        Commits when the block exits normally and rolls back if it raises.
+        Unlike run_in_session() the block is not retried. With
+        use_replica=True a read-only block runs on a read replica when one
+        is usable, else on the primary. `label` names its statements in the
+        metrics.
+        """
+        conn = replica = None
+        if use_replica and self.replicas is not None:
+            conn, replica = self.replicas.acquire()
+        if conn is None:
+            self.breaker.before_call()
+            try:
+                conn = self._acquire()
+            except psycopg2.Error as e:
+                if is_connection_failure(e):
+                    self.breaker.record_failure()
+                raise
+            except Exception:
+                self.breaker.record_failure()
+                raise
+        broken = False
+        try:
+            session = DatabaseSession(
+                conn.cursor(cursor_factory=cursor_factory('dict')), label=label, slow_log=self.slow_queries
+            )
+            yield session
+            conn.commit()
+            if replica is None:
+                self.breaker.record_success()
+        except BaseException as e:
+            broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            if replica is not None:
+                if isinstance(e, psycopg2.Error) and is_transient(e):
+                    self.replicas.mark_failed(replica, e)
+            elif isinstance(e, psycopg2.Error) and is_connection_failure(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+            raise
+        finally:
+            if replica is not None:
+                self.replicas.release(conn)
+            else:
+                self._release(conn, broken)
+        session._run_after_commit()
+
+    transaction = session
+
+    def _in_session(self, session, work, label=None):
+        """Run `work` in the caller's session if given, else in its own."""
+        if session is not None:
+            return work(session)
+        return self.run_in_session(work, label=label)
+
+    def execute_query(self, query, params=None, fetch=False, row_format='dict', use_replica=False, label=None):
         """
         Execute a SQL query with optional parameters and retry logic.
 
@@ -84,55 +617,76 @@ class DatabaseManager:
             query (str): SQL query to execute.
             params (tuple): Parameters for the query (optional).
             fetch (bool): Whether to fetch results (default: False).
+            row_format (str): 'dict' (default), 'tuple' or 'record' - see
+                utils/row_formats.py. Use 'tuple' for large result sets.
+            use_replica (bool): Run on a read replica if one is usable -
+                only for reads that may be `replica_max_lag` seconds stale.
+            label (str): Stable metrics name for the statement, e.g.
+                'chats_list' (see utils/metrics.py).
 
         Returns:
             list or None: List of results if fetch=True, None otherwise.
         """
-        retry_count = 0
-        while retry_count < self.max_retries:
-            conn = None
-            try:
-                conn = self._new_connection()
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
+        def work(session):
+            rows = session.execute(query, params)
+            if fetch:
+                logger.debug(f"Query executed successfully, fetched {len(rows or [])} rows")
+                return rows
+            logger.debug("Query executed successfully")
+            return None
 
-                # Log the query (be careful with sensitive data)
-                if logger.isEnabledFor(logging.DEBUG):
-                    logger.debug(f"Executing query: {query[:100]}..." if len(query) > 100 else query)
+        return self.run_in_session(work, row_format, use_replica, label)
 
-                cursor.execute(query, params)
-                conn.commit()
+    def execute_transaction(self, statements, label=None):
+        """
+        Execute several statements on ONE connection in ONE transaction.
 
-                if fetch:
-                    results = cursor.fetchall()
-                    logger.debug(f"Query executed successfully, fetched {len(results)} rows")
-                    return results
-                else:
-                    logger.debug("Query executed successfully")
-                    return None
+        Args:
+            statements (list): (query, params) pairs, run in order.
+            label (str): Metrics name for the transaction and its statements.
 
-            except psycopg2.Error as e:
-                retry_count += 1
-                logger.error(f"Database error (attempt {retry_count}/{self.max_retries}): {e}")
-
-                if retry_count < self.max_retries:
-                    # Retry only transient connection issues; fail fast otherwise.
-                    if any(err_code in str(e) for err_code in ['connection', 'server closed', 'terminated']):
-                        logger.info("Connection error detected, retrying...")
-                        time.sleep(self.retry_delay)
-                    else:
-                        logger.error(f"Non-retryable error: {e}")
-                        raise
-                else:
-                    logger.error(f"Failed to execute query after {self.max_retries} attempts")
-                    raise
+        Returns:
+            list: One entry per statement - its fetched rows if it returned
+            any (SELECT / RETURNING), None otherwise. Either every statement
+            commits or none of them do.
+        """
+        statements = [s for s in statements if s]
+        if not statements:
+            return []
 
-            except Exception as e:
-                logger.error(f"Unexpected error executing query: {e}")
-                raise
+        def work(session):
+            for query, params in statements:
+                session.execute(query, params)
+            logger.debug(f"Transaction executed successfully ({len(statements)} statements)")
+            return session.results
 
-            finally:
-                if conn is not None:
-                    conn.close()
+        return self.run_in_session(work, label=label)
+
+    def execute_autocommit(self, query, params=None, label=None):
+        """
+        Run one statement outside any transaction, on its own connection -
+        for the statements Postgres refuses in a transaction block, such as
+        CREATE INDEX CONCURRENTLY.
+
+        There is no retry: a half-done concurrent build must be inspected
+        before it is tried again (see utils/migrations.py).
+
+        Args:
+            query (str): SQL statement.
+            params (tuple): Parameters for the statement (optional).
+            label (str): Metrics name for the statement.
+        """
+        label = label or UNLABELLED
+        self.breaker.before_call()
+        conn = self._new_connection()
+        try:
+            conn.autocommit = True
+            started = time.perf_counter()
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+            DB_STATEMENT_SECONDS.observe(time.perf_counter() - started, statement=label, phase='execute')
+        finally:
+            conn.close()
 
     def test_connection(self):
         """Test the database connection with a short-lived connection."""
@@ -174,130 +728,10 @@ class DatabaseManager:
             logger.error(f"Error checking if table {schema}.{table_name} exists: {e}")
             return False
 
-    def create_tables_if_not_exists(self, schema='public'):
-        """Create required tables if they do not exist in the specified schema."""
-        tables = [
-            {
-                'name': 'eventio_messages',
-                'schema': """
-                    CREATE TABLE {schema}.{name} (
-                        id VARCHAR(255) PRIMARY KEY,
-                        wa_id VARCHAR(255),
-                        name VARCHAR(255),
-                        type VARCHAR(50),
-                        body TEXT,
-                        timestamp TIMESTAMPTZ,
-                        direction VARCHAR(50),
-                        status VARCHAR(50),
-                        read BOOLEAN,
-                        image_url TEXT,
-                        image_id VARCHAR(255),
-                        error_details TEXT,
-                        event_id INTEGER,
-                        template_name VARCHAR(255)
-                    )
-                """
-            },
-            {
-                'name': 'package_with_sense_messages',
-                'schema': """
-                    CREATE TABLE {schema}.{name} (
-                        id VARCHAR(255) PRIMARY KEY,
-                        wa_id VARCHAR(255),
-                        name VARCHAR(255),
-                        type VARCHAR(50),
-                        body TEXT,
-                        timestamp TIMESTAMPTZ,
-                        direction VARCHAR(50),
-                        status VARCHAR(50),
-                        read BOOLEAN,
-                        image_url TEXT,
-                        image_id VARCHAR(255),
-                        error_details TEXT,
-                        event_id INTEGER,
-                        template_name VARCHAR(255)
-                    )
-                """
-            },
-            {
-                'name': 'mwsmile_messages',
-                'schema': """
-                    CREATE TABLE {schema}.{name} (
-                        id VARCHAR(255) PRIMARY KEY,
-                        wa_id VARCHAR(255),
-                        name VARCHAR(255),
-                        type VARCHAR(50),
-                        body TEXT,
-                        timestamp TIMESTAMPTZ,
-                        direction VARCHAR(50),
-                        status VARCHAR(50),
-                        read BOOLEAN,
-                        image_url TEXT,
-                        image_id VARCHAR(255),
-                        error_details TEXT,
-                        event_id INTEGER,
-                        template_name VARCHAR(255)
-                    )
-                """
-            },
-            {
-                'name': 'ignitiohub_messages',
-                'schema': """
-                    CREATE TABLE {schema}.{name} (
-                        id VARCHAR(255) PRIMARY KEY,
-                        wa_id VARCHAR(255),
-                        name VARCHAR(255),
-                        type VARCHAR(50),
-                        body TEXT,
-                        timestamp TIMESTAMPTZ,
-                        direction VARCHAR(50),
-                        status VARCHAR(50),
-                        read BOOLEAN,
-                        image_url TEXT,
-                        image_id VARCHAR(255),
-                        error_details TEXT,
-                        event_id INTEGER,
-                        template_name VARCHAR(255)
-                    )
-                """
-            }
-        ]
-
-        for table in tables:
-            table_name = table['name']
-            if not self.table_exists(table_name, schema):
-                try:
-                    query = table['schema'].format(schema=schema, name=table_name)
-                    self.execute_query(query)
-                    logger.info(f"Created table {schema}.{table_name}")
-                except psycopg2.Error as e:
-                    logger.error(f"Failed to create table {schema}.{table_name}: {e}")
-                    if 'permission denied for schema' in str(e).lower():
-                        logger.error(
-                            f"Permission denied for schema {schema}. "
-                            "Try granting CREATE privileges with: "
-                            f"GRANT CREATE ON SCHEMA {schema} TO {self.connection_string.split('user=')[1].split(' ')[0]};"
-                        )
-                    raise
-            else:
-                logger.info(f"Table {schema}.{table_name} already exists")
-
-    def insert_message(self, table_name, message_data):
-        """
-        Insert a message directly into the specified table.
-
-        Args:
-            table_name (str): Full table name including schema (e.g., 'public.eventio_messages')
-            message_data (dict): Message data with all required fields
-        """
-        query = f"""
-            INSERT INTO {table_name}
-            (id, wa_id, name, type, body, timestamp, direction, status, read,
-             image_url, image_id, error_details, event_id, template_name, updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
-            ON CONFLICT (id) DO NOTHING
-        """
-        params = (
+    @staticmethod
+    def _message_params(message_data):
+        """Positional values for one row of MESSAGE_INSERT_COLUMNS."""
+        return (
             message_data['id'],
             message_data['wa_id'],
             message_data['name'],
@@ -313,10 +747,222 @@ class DatabaseManager:
             message_data.get('event_id'),       # None for inbound/unknown
             message_data.get('template_name'),  # None unless set by PHP
         )
-        self.execute_query(query, params)
+
+    def partitioned_tenant(self, table_name):
+        """
+        The tenant key if `table_name` has been cut over to a view of the
+        partitioned messages table, else None. Which tables are views is
+        cached per process and re-checked every PARTITIONED_VIEWS_TTL
+        seconds until every business has been cut over.
+        """
+        now = time.monotonic()
+        views = self._partitioned_views
+        if views is None or (len(views) < len(TENANTS) and now - self._partitioned_checked_at > PARTITIONED_VIEWS_TTL):
+            rows = self.execute_query("""
+                SELECT n.nspname || '.' || c.relname AS name
+                FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE c.relkind = 'v' AND c.relname = ANY(%s)
+            """, (list(TENANTS),), fetch=True, label='partitioned_views')
+            views = {row['name'] for row in rows}
+            self._partitioned_views = views
+            self._partitioned_checked_at = now
+        schema, _, name = table_name.rpartition('.')
+        if f"{schema or 'public'}.{name}" in views:
+            return TENANTS[name]
+        return None
+
+    def _routing_went_stale(self, table_names, error):
+        """
+        True if `error` came from writing to one of `table_names` as a plain
+        table after it was cut over to a view - another process ran
+        utils/partitioning.py cutover() within this one's
+        PARTITIONED_VIEWS_TTL. The cache is refreshed either way, so the
+        next write (or a redelivered webhook) is routed correctly.
+        """
+        if getattr(error, 'pgcode', None) not in STALE_ROUTING_SQLSTATES:
+            return False
+        stale = [table for table in table_names if self.partitioned_tenant(table) is None]
+        if not stale:
+            return False
+        self._partitioned_views = None
+        return any(self.partitioned_tenant(table) is not None for table in stale)
+
+    def _with_fresh_routing(self, table_names, session, attempt):
+        """
+        Run `attempt()` - a write whose SQL depends on partitioned_tenant() -
+        and run it once more if it failed because the routing went stale.
+        Inside a caller's session the transaction is already aborted, so
+        the error is left to the caller.
+        """
+        try:
+            return attempt()
+        except psycopg2.Error as e:
+            if not self._routing_went_stale(table_names, e) or session is not None:
+                raise
+            logger.warning(f"⚠️ {', '.join(table_names)} cut over to the partitioned table since the last check; retrying")
+            return attempt()
+
+    def build_insert_messages(self, table_name, messages):
+        """
+        Build one multi-row INSERT ... ON CONFLICT (id) DO NOTHING for
+        `messages`. Returns a (query, params) pair, or None if there is
+        nothing to insert.
+
+        For a business already cut over to the partitioned messages table
+        the id is claimed in message_ids first (a partitioned table can't
+        have a unique index on id alone) and only newly claimed rows are
+        inserted - the same "RETURNING id of new rows only" contract.
+        """
+        if not messages:
+            return None
+        tenant = self.partitioned_tenant(table_name)
+        if tenant is not None:
+            return self._build_partitioned_insert(table_name, tenant, messages)
+        row_sql = "(" + ", ".join(["%s"] * len(MESSAGE_INSERT_COLUMNS)) + ", NOW())"
+        params = []
+        for message_data in messages:
+            params.extend(self._message_params(message_data))
+        query = f"""
+            INSERT INTO {table_name}
+            ({", ".join(MESSAGE_INSERT_COLUMNS)}, updated_at)
+            VALUES {", ".join([row_sql] * len(messages))}
+            ON CONFLICT (id) DO NOTHING
+            RETURNING id
+        """
+        return query, tuple(params)
+
+    def _build_partitioned_insert(self, table_name, tenant, messages):
+        row_sql = "(" + ", ".join(f"%s::{t}" for t in MESSAGE_COLUMN_TYPES) + ")"
+        params = []
+        for message_data in messages:
+            params.extend(self._message_params(message_data))
+        query = self._partitioned_insert_sql(
+            table_name, f"VALUES {', '.join([row_sql] * len(messages))}"
+        ) + " RETURNING id"
+        return query, tuple(params) + (tenant, tenant)
+
+    @staticmethod
+    def _partitioned_insert_sql(table_name, source_sql):
+        """INSERT of the rows of `source_sql` into `messages`, claiming ids in message_ids first."""
+        schema = table_name.rpartition('.')[0] or 'public'
+        columns = ", ".join(MESSAGE_INSERT_COLUMNS)
+        return f"""
+            WITH v ({columns}) AS (
+                {source_sql}
+            ), new_ids AS (
+                INSERT INTO {schema}.message_ids (tenant, id)
+                SELECT %s, id FROM v
+                ON CONFLICT DO NOTHING
+                RETURNING id
+            )
+            INSERT INTO {schema}.messages (tenant, {columns}, updated_at)
+            SELECT DISTINCT ON (v.id) %s, {", ".join(f"v.{c}" for c in MESSAGE_INSERT_COLUMNS)}, NOW()
+            FROM v JOIN new_ids n ON n.id = v.id
+        """
+
+    def build_merge_messages(self, table_name, source_table):
+        """
+        Build an INSERT ... SELECT of every row of `source_table` (which has
+        the MESSAGE_INSERT_COLUMNS) into `table_name`, with the same
+        semantics as build_insert_messages(): existing ids are left alone,
+        a duplicated id is inserted once, updated_at is NOW(). Returns a
+        (query, params) pair; the statement's rowcount is the rows inserted.
+        """
+        columns = ", ".join(MESSAGE_INSERT_COLUMNS)
+        tenant = self.partitioned_tenant(table_name)
+        if tenant is not None:
+            source_sql = f"SELECT {columns} FROM {source_table}"
+            return self._partitioned_insert_sql(table_name, source_sql), (tenant, tenant)
+        query = f"""
+            INSERT INTO {table_name} ({columns}, updated_at)
+            SELECT DISTINCT ON (id) {columns}, NOW() FROM {source_table}
+            ORDER BY id
+            ON CONFLICT (id) DO NOTHING
+        """
+        return query, ()
+
+    def build_update_message_statuses(self, table_name, updates):
+        """
+        Build one set-based UPDATE ... FROM (VALUES ...) applying every
+        status update in `updates` (dicts with id, status, read and optional
+        error_details). Returns a (query, params) pair, or None if empty;
+        the statement returns the wa_id, id and new status of every row it
+        changed.
+
+        Updates for the same id are collapsed to the furthest-along status,
+        and a row is only touched when the new status ranks above its
+        current one (see STATUS_RANK) - a late 'delivered' can't downgrade
+        'read', and nothing moves a message out of 'failed'.
+        """
+        if not updates:
+            return None
+        merged = {}
+        for u in updates:
+            merged[u['id']] = merge_status_update(merged.get(u['id']), u)
+        params = []
+        for u in merged.values():
+            params.extend([u['id'], u['status'], u['read'], u.get('error_details')])
+        values_sql = ", ".join(["(%s::varchar, %s::varchar, %s::boolean, %s::text)"] * len(merged))
+        query = f"""
+            UPDATE {table_name} AS m
+            SET status = v.status, read = v.read, error_details = v.error_details, updated_at = NOW()
+            FROM (VALUES {values_sql}) AS v(id, status, read, error_details)
+            WHERE m.id = v.id
+              AND {status_rank_sql('v.status')} > {status_rank_sql('m.status')}
+            RETURNING m.wa_id, m.id, m.status
+        """
+        return query, tuple(params)
+
+    def insert_message(self, table_name, message_data, session=None):
+        """
+        Insert a message directly into the specified table.
+
+        Args:
+            table_name (str): Full table name including schema (e.g., 'public.eventio_messages')
+            message_data (dict): Message data with all required fields
+            session (DatabaseSession): Optional session to run in; by default
+                the insert is its own transaction, or is group-committed with
+                concurrent writes if group commit is enabled.
+
+        A new message refreshes its conversation's chat-list summary and
+        records a message.created stream event in the same transaction (see
+        utils/conversation_summaries.py and utils/stream_events.py).
+        """
+        if session is None and self.group_commit is not None:
+            self.group_commit.insert(table_name, message_data).result()
+            logger.info(f"✅ Message saved to {table_name}: {message_data['id']}")
+            return
+
+        def attempt():
+            query, params = self.build_insert_messages(table_name, [message_data])
+
+            def work(s):
+                if s.execute(query, params, label='insert_message'):
+                    self.refresh_conversation_summaries({table_name: [message_data['wa_id']]}, session=s)
+                    self.record_stream_events({table_name: [created_event(message_data)]}, session=s)
+                    s.after_commit(lambda: self._remember_outbound_events(table_name, [message_data]))
+
+            self._in_session(session, work, label='insert_message')
+
+        self._with_fresh_routing([table_name], session, attempt)
         logger.info(f"✅ Message saved to {table_name}: {message_data['id']}")
 
-    def update_message_status(self, table_name, message_id, status, read, error_details=None):
+    def _remember_outbound_events(self, table_name, messages):
+        """
+        Write-through: a newly inserted outbound row with an event_id is now
+        the latest for its wa_id. Pass only rows the INSERT returned - one
+        that hit ON CONFLICT may be an old redelivery.
+        """
+        for message_data in messages:
+            event_id = message_data.get('event_id')
+            if message_data.get('direction') != 'outbound' or event_id in (None, ''):
+                continue
+            try:
+                self.outbound_event_cache.set(table_name, message_data['wa_id'], int(event_id))
+            except (TypeError, ValueError):
+                pass
+
+    def update_message_status(self, table_name, message_id, status, read, error_details=None, session=None):
         """
         Update message status directly in the specified table.
 
@@ -326,51 +972,130 @@ class DatabaseManager:
             status (str): New status
             read (bool): Read status
             error_details (str): Optional Meta error details when status is 'failed'
+            session (DatabaseSession): Optional session to run in.
+
+        Only forward transitions are written (see STATUS_RANK), and the
+        conversation's chat-list summary is refreshed and a message.status
+        stream event recorded with them. Outside a
+        session this is group-committed if group commit is enabled.
         """
-        query = f"""
-            UPDATE {table_name}
-            SET status = %s, read = %s, error_details = %s, updated_at = NOW()
-            WHERE id = %s
-        """
-        params = (status, read, error_details, message_id)
-        self.execute_query(query, params)
+        update = {'id': message_id, 'status': status, 'read': read, 'error_details': error_details}
+        if session is None and self.group_commit is not None:
+            self.group_commit.update_status(table_name, update).result()
+        else:
+            query, params = self.build_update_message_statuses(table_name, [update])
+
+            def work(s):
+                rows = s.execute(query, params, label='status_update') or []
+                self.refresh_conversation_summaries({table_name: [row['wa_id'] for row in rows]}, session=s)
+                self.record_stream_events({table_name: [status_event(row) for row in rows]}, session=s)
+
+            self._in_session(session, work, label='status_update')
         logger.info(f"✅ Updated message status in {table_name}: {message_id} -> {status}")
 
-    def migrate_add_error_details(self, schema='public'):
+    def write_webhook_batch(self, messages_by_table, statuses_by_table, session=None, label='webhook_batch'):
         """
-        Add error_details column to existing tables if it does not already exist.
-        Called automatically on startup so existing deployments are migrated safely.
+        Persist everything parsed from one webhook delivery in a single
+        transaction: one multi-row INSERT per table for new messages, then
+        one set-based UPDATE per table for status callbacks.
+
+        Args:
+            messages_by_table (dict): {table_name: [message_data, ...]}
+            statuses_by_table (dict): {table_name: [status_update, ...]}
+            session (DatabaseSession): Optional session to run in, so the
+                batch can share a transaction with the caller's reads.
+            label (str): Metrics name for the transaction when it runs in
+                its own session.
+
+        Returns:
+            set: ids of the messages actually inserted by this call. Ids that
+            already existed (a redelivery or a spool replay) are left out, so
+            callers can skip side effects such as the AI auto-reply for them.
         """
-        tables = ['eventio_messages', 'package_with_sense_messages', 'mwsmile_messages', 'ignitiohub_messages']
-        for table in tables:
-            try:
-                query = f"ALTER TABLE {schema}.{table} ADD COLUMN IF NOT EXISTS error_details TEXT"
-                self.execute_query(query)
-                logger.info(f"✅ Migration OK — {schema}.{table}.error_details")
-            except Exception as e:
-                logger.error(f"❌ Migration failed for {schema}.{table}: {e}")
+        def build_statements():
+            statements = [
+                (table, self.build_insert_messages(table, rows), 'insert_messages')
+                for table, rows in messages_by_table.items()
+            ] + [
+                (table, self.build_update_message_statuses(table, updates), 'status_update_batch')
+                for table, updates in statuses_by_table.items()
+            ]
+            return [statement for statement in statements if statement[1]]
 
-    def migrate_add_event_columns(self, schema='public'):
+        def work(s, statements):
+            inserted, touched, events, new_by_table = set(), {}, {}, {}
+            for table, (query, params), statement_label in statements:
+                rows = s.execute(query, params, label=statement_label) or []
+                if statement_label == 'insert_messages':
+                    new_ids = {row['id'] for row in rows}
+                    inserted.update(new_ids)
+                    new_messages = [m for m in messages_by_table[table] if m['id'] in new_ids]
+                    new_by_table[table] = new_messages
+                    touched.setdefault(table, []).extend(m['wa_id'] for m in new_messages)
+                    events.setdefault(table, []).extend(created_event(m) for m in new_messages)
+                else:
+                    touched.setdefault(table, []).extend(row['wa_id'] for row in rows)
+                    events.setdefault(table, []).extend(status_event(row) for row in rows)
+            self.refresh_conversation_summaries(touched, session=s)
+            self.record_stream_events(events, session=s)
+            s.after_commit(lambda: [
+                self._remember_outbound_events(table, rows) for table, rows in new_by_table.items()
+            ])
+            return inserted
+
+        def attempt():
+            statements = build_statements()
+            if not statements:
+                return set()
+            return self._in_session(session, lambda s: work(s, statements), label=label)
+
+        inserted_ids = self._with_fresh_routing(list(messages_by_table), session, attempt)
+        status_count = sum(len(updates) for updates in statuses_by_table.values())
+        logger.info(f"✅ Webhook batch saved: {len(inserted_ids)} new message(s), {status_count} status update(s)")
+        return inserted_ids
+
+    def refresh_conversation_summaries(self, wa_ids_by_table, session=None):
         """
-        Add event_id and template_name columns to existing tables if missing.
-        Called automatically on startup — safe to run repeatedly (IF NOT EXISTS).
+        Recompute the chat-list summaries of the given conversations (see
+        utils/conversation_summaries.py). Pass the session of the write that
+        changed them, and call this after its last message write.
+
+        Args:
+            wa_ids_by_table (dict): {table_name: [wa_id, ...]}
+            session (DatabaseSession): Optional session to run in.
         """
-        tables = ['eventio_messages', 'package_with_sense_messages', 'mwsmile_messages', 'ignitiohub_messages']
-        for table in tables:
-            try:
-                self.execute_query(
-                    f"ALTER TABLE {schema}.{table} ADD COLUMN IF NOT EXISTS event_id INTEGER"
-                )
-                self.execute_query(
-                    f"ALTER TABLE {schema}.{table} ADD COLUMN IF NOT EXISTS template_name VARCHAR(255)"
-                )
-                # Index so per-event queries stay fast even as rows grow
-                self.execute_query(
-                    f"CREATE INDEX IF NOT EXISTS idx_{table}_event_id ON {schema}.{table}(event_id)"
-                )
-                logger.info(f"✅ Migration OK — {schema}.{table}: event_id, template_name, index")
-            except Exception as e:
-                logger.error(f"❌ Migration failed for {schema}.{table}: {e}")
+        statements = build_refresh_summaries(wa_ids_by_table)
+        if not statements:
+            return
+
+        def work(s):
+            for query, params in statements:
+                s.execute(query, params, label='summary_refresh')
+
+        self._in_session(session, work, label='summary_refresh')
+
+    def record_stream_events(self, events_by_table, session=None):
+        """
+        Append events for the dashboards' /api/stream (see
+        utils/stream_events.py). Pass the session of the write they describe,
+        so they become visible when it commits. A no-op unless the stream is
+        enabled.
+
+        Args:
+            events_by_table (dict): {table_name: [(type, wa_id, payload), ...]}
+            session (DatabaseSession): Optional session to run in.
+        """
+        if not self.stream_events:
+            return
+        statements = build_insert_stream_events(events_by_table)
+        if not statements:
+            return
+
+        def work(s):
+            for query, params in statements:
+                s.execute(query, params, label='stream_events_insert')
+
+        self._in_session(session, work, label='stream_events_insert')
 
     def get_recent_inbound_messages(self, table_name, hours=24):
         """
@@ -386,7 +1111,7 @@ class DatabaseManager:
             WHERE direction = 'inbound' AND timestamp >= NOW() - INTERVAL '%s hours'
             ORDER BY timestamp DESC
         """
-        return self.execute_query(query, (hours,), fetch=True)
+        return self.execute_query(query, (hours,), fetch=True, use_replica=True, label='recent_inbound')
 
     def create_digest_log_table_if_not_exists(self, schema='public'):
         """Create the digest_log claim table used to prevent duplicate daily-digest sends."""
@@ -410,7 +1135,8 @@ class DatabaseManager:
         result = self.execute_query(
             f"INSERT INTO {schema}.digest_log (run_date) VALUES (%s) ON CONFLICT DO NOTHING RETURNING run_date",
             (run_date,),
-            fetch=True
+            fetch=True,
+            label='digest_claim',
         )
         return bool(result)
 
@@ -420,9 +1146,9 @@ class DatabaseManager:
         be retried the same day instead of being permanently blocked by its
         own failed attempt.
         """
-        self.execute_query(f"DELETE FROM {schema}.digest_log WHERE run_date = %s", (run_date,))
+        self.execute_query(f"DELETE FROM {schema}.digest_log WHERE run_date = %s", (run_date,), label='digest_release')
 
-    def get_conversation_context(self, table_name, wa_id, limit=10):
+    def get_conversation_context(self, table_name, wa_id, limit=10, session=None):
         """Recent messages (both directions) for one contact, most recent first."""
         query = f"""
             SELECT direction, body, timestamp
@@ -431,7 +1157,10 @@ class DatabaseManager:
             ORDER BY timestamp DESC
             LIMIT %s
         """
-        return self.execute_query(query, (wa_id, limit), fetch=True)
+        return self._in_session(
+            session, lambda s: s.execute(query, (wa_id, limit), label='conversation_context'),
+            label='conversation_context',
+        )
 
     def create_message_rankings_table_if_not_exists(self, schema='public'):
         """
@@ -463,7 +1192,7 @@ class DatabaseManager:
             FROM {schema}.message_rankings
             WHERE message_id = ANY(%s)
         """
-        rows = self.execute_query(query, (list(message_ids),), fetch=True)
+        rows = self.execute_query(query, (list(message_ids),), fetch=True, label='rankings_lookup')
         return {
             row['message_id']: {
                 'category': row['category'],
@@ -497,55 +1226,7 @@ class DatabaseManager:
                 reason = EXCLUDED.reason,
                 ranked_at = NOW()
         """
-        self.execute_query(query, tuple(params))
-
-    def migrate_message_rankings_table(self, schema='public'):
-        """
-        Ensure public.message_rankings exists with all expected columns,
-        adding any that are missing (IF NOT EXISTS). Mirrors the other
-        migrate_add_* methods so the digest job's storage self-heals on
-        startup the same way the message tables do.
-        """
-        try:
-            self.create_message_rankings_table_if_not_exists(schema)
-            for column, ddl in [
-                ('wa_id', 'VARCHAR(255)'),
-                ('category', 'VARCHAR(50)'),
-                ('score', 'INTEGER'),
-                ('reason', 'TEXT'),
-                ('ranked_at', 'TIMESTAMPTZ DEFAULT NOW()'),
-            ]:
-                self.execute_query(
-                    f"ALTER TABLE {schema}.message_rankings ADD COLUMN IF NOT EXISTS {column} {ddl}"
-                )
-            logger.info(f"✅ Migration OK — {schema}.message_rankings columns")
-        except Exception as e:
-            logger.error(f"❌ Migration failed for {schema}.message_rankings: {e}")
-
-    def migrate_add_updated_at(self, schema='public'):
-        """
-        Add updated_at column to existing tables if missing, backfilled from
-        timestamp for existing rows. update_message_status() bumps this on
-        every status change (sent -> delivered -> read), so pollers can pick
-        up status-only changes on already-synced rows by watching updated_at
-        instead of timestamp (which never changes after the row is created).
-        Called automatically on startup - safe to run repeatedly (IF NOT EXISTS).
-        """
-        tables = ['eventio_messages', 'package_with_sense_messages', 'mwsmile_messages', 'ignitiohub_messages']
-        for table in tables:
-            try:
-                self.execute_query(
-                    f"ALTER TABLE {schema}.{table} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ"
-                )
-                self.execute_query(
-                    f"UPDATE {schema}.{table} SET updated_at = timestamp WHERE updated_at IS NULL"
-                )
-                self.execute_query(
-                    f"CREATE INDEX IF NOT EXISTS idx_{table}_updated_at ON {schema}.{table}(updated_at)"
-                )
-                logger.info(f"✅ Migration OK — {schema}.{table}.updated_at")
-            except Exception as e:
-                logger.error(f"❌ Migration failed for {schema}.{table}: {e}")
+        self.execute_query(query, tuple(params), label='rankings_upsert')
 
     def __del__(self):
         """Destructor to ensure database connection is closed."""
@@ -563,19 +1244,43 @@ try:
         user=os.getenv('DB_USER', 'neondb_owner'),
         password=os.getenv('DB_PASSWORD', 'npg_SIgb5lKTF3Dz'),
         sslmode=os.getenv('DB_SSLMODE', 'require'),
-        channel_binding=os.getenv('DB_CHANNEL_BINDING', 'require')
+        channel_binding=os.getenv('DB_CHANNEL_BINDING', 'require'),
+        event_cache_capacity=int(os.getenv('EVENT_CACHE_CAPACITY', '5000')),
+        event_cache_ttl=int(os.getenv('EVENT_CACHE_TTL_SECONDS', '300')),
+        pool_enabled=os.getenv('DB_POOL_ENABLED', 'false').lower() in ('1', 'true', 'yes'),
+        pool_min=int(os.getenv('DB_POOL_MIN', '1')),
+        pool_max=int(os.getenv('DB_POOL_MAX', '10')),
+        pool_idle_timeout=int(os.getenv('DB_POOL_IDLE_SECONDS', '60')),
+        connect_timeout=int(os.getenv('DB_CONNECT_TIMEOUT', '5')),
+        retry_max_attempts=int(os.getenv('DB_RETRY_MAX_ATTEMPTS', '4')),
+        retry_deadline=float(os.getenv('DB_RETRY_DEADLINE_SECONDS', '10')),
+        breaker_failure_threshold=int(os.getenv('DB_BREAKER_FAILURE_THRESHOLD', '5')),
+        breaker_reset_timeout=float(os.getenv('DB_BREAKER_RESET_SECONDS', '30')),
+        group_commit_ms=int(os.getenv('DB_GROUP_COMMIT_MS', '0')),
+        group_commit_max_rows=int(os.getenv('DB_GROUP_COMMIT_MAX_ROWS', '500')),
+        replica_dsns=[dsn.strip() for dsn in os.getenv('DB_REPLICA_DSNS', '').split(';') if dsn.strip()],
+        replica_max_lag=float(os.getenv('DB_REPLICA_MAX_LAG_SECONDS', '10')),
+        replica_lag_check_interval=float(os.getenv('DB_REPLICA_LAG_CHECK_SECONDS', '5')),
+        slow_query_ms=float(os.getenv('DB_SLOW_QUERY_MS', '500')),
+        slow_query_explain_sample=float(os.getenv('DB_SLOW_QUERY_EXPLAIN_SAMPLE', '0.1')),
+        slow_query_buffer=int(os.getenv('DB_SLOW_QUERY_BUFFER', '200')),
+        slow_query_explain_timeout_ms=int(os.getenv('DB_SLOW_QUERY_EXPLAIN_TIMEOUT_MS', '10000')),
+        stream_events=STREAM_ENABLED.lower() in ('1', 'true', 'yes'),
     )
     
-    # Test the connection on startup
-    if db_manager.test_connection():
-        logger.info("✅ Database manager initialized successfully")
-        # Migrate existing tables to add missing columns
-        db_manager.migrate_add_error_details()
-        db_manager.migrate_add_event_columns()
-        db_manager.migrate_add_updated_at()
-        db_manager.migrate_message_rankings_table()
-    else:
-        logger.error("❌ Database manager initialization failed - connection test failed")
+    # Bring the schema up to date on startup. Once it is current this is a
+    # single query (see utils/migrations.py); set DB_MIGRATE_ON_STARTUP=false
+    # to leave migrations to `python migrate.py` at deploy time instead.
+    # Steps that build indexes on the live message tables are never run
+    # here - startup skips them (and logs it) until migrate.py applies them.
+    # A database that's unreachable at boot must not stop the app (webhooks
+    # can still be spooled); the next boot or `migrate.py` catches up.
+    if os.getenv('DB_MIGRATE_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes'):
+        try:
+            run_migrations(db_manager, startup=True)
+        except Exception as e:
+            logger.error(f"❌ Startup migrations did not complete: {e}")
+    logger.info("✅ Database manager initialized successfully")
         
 except Exception as e:
     logger.error(f"❌ Failed to initialize database manager: {e}")
@@ -0,0 +1,213 @@
+"""
+db_pool.py — Optional connection pool that still lets Neon scale to zero.
+
+By default DatabaseManager opens a fresh TLS connection (with channel
+binding) for every query so that nothing holds Neon's compute awake. That
+costs a full handshake per statement, and one inbound message with an AI
+reply runs five or more of them.
+
+IdleClosingPool keeps connections warm only while traffic is flowing:
+connections are reused between queries, but once the pool has seen no
+checkout for `idle_timeout` seconds a reaper thread closes every idle
+connection - including the minimum - so Neon can suspend exactly as it did
+before. The next query simply reconnects.
+
+Connections that sat idle longer than `health_check_after` are pinged
+(SELECT 1) before being handed out, and broken ones are replaced.
+
+Pools are fork-aware: a gunicorn worker forked from a parent that already
+had connections must not use (or close) the parent's sockets, so the child
+abandons them and starts with an empty pool.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+# Connections inherited across a fork. Closing them in the child would send
+# a Terminate on the parent's socket, so they're parked here and never used.
+_inherited_connections = []
+
+
+class PoolExhausted(Exception):
+    """Raised when no connection frees up within the checkout timeout."""
+
+
+class IdleClosingPool:
+    """A thread-safe min/max connection pool that empties itself when idle."""
+
+    def __init__(self, connect, minconn=1, maxconn=10, idle_timeout=60,
+                 health_check_after=30, checkout_timeout=30):
+        """
+        Args:
+            connect (callable): Opens a new psycopg2 connection.
+            minconn (int): Connections kept open while traffic is active.
+            maxconn (int): Hard cap on open connections per process.
+            idle_timeout (float): Seconds with no checkout before every
+                connection is closed (lets Neon scale to zero).
+            health_check_after (float): Idle seconds after which a pooled
+                connection is pinged before reuse.
+            checkout_timeout (float): Max wait for a free connection.
+        """
+        self.connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.checkout_timeout = checkout_timeout
+        self._reset_state()
+
+    def _reset_state(self):
+        self._lock = threading.Condition(threading.Lock())
+        self._idle = []          # [(conn, last_used_monotonic)]
+        self._in_use = 0
+        self._last_checkout = time.monotonic()
+        self._pid = os.getpid()
+        self._reaper_started = False
+        self.connects = 0
+        self.reuses = 0
+        self.idle_closes = 0
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            _inherited_connections.extend(conn for conn, _ in self._idle)
+            logger.info("Connection pool re-initialised after fork")
+            self._reset_state()
+
+    def _healthy(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if idle_for < self.health_check_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Check out a connection, reusing a warm one when possible."""
+        self._check_fork()
+        self._ensure_reaper()
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._lock:
+            while not self._idle and self._in_use >= self.maxconn:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhausted(f"No database connection free after {self.checkout_timeout}s")
+                self._lock.wait(remaining)
+            self._last_checkout = time.monotonic()
+            self._in_use += 1
+            candidate = self._idle.pop() if self._idle else None
+
+        try:
+            # Pop warm connections until one passes its health check.
+            while candidate is not None:
+                conn, last_used = candidate
+                if self._healthy(conn, time.monotonic() - last_used):
+                    self.reuses += 1
+                    return conn
+                self._close(conn)
+                with self._lock:
+                    candidate = self._idle.pop() if self._idle else None
+            conn = self.connect()
+            self.connects += 1
+            return conn
+        except Exception:
+            with self._lock:
+                self._in_use -= 1
+                self._lock.notify()
+            raise
+
+    def putconn(self, conn, discard=False):
+        """Return a connection; broken or discarded ones are closed instead."""
+        if self._pid != os.getpid():
+            # Checked out before a fork - not ours to reuse or close.
+            return
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        with self._lock:
+            self._in_use -= 1
+            if discard or conn.closed or len(self._idle) >= self.maxconn:
+                to_close = conn
+            else:
+                self._idle.append((conn, time.monotonic()))
+                to_close = None
+            self._lock.notify()
+        if to_close is not None:
+            self._close(to_close)
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_idle(self, keep=0):
+        """Close idle connections beyond `keep`. Returns how many were closed."""
+        with self._lock:
+            to_close = self._idle[keep:] if keep else list(self._idle)
+            self._idle = self._idle[:keep] if keep else []
+        for conn, _ in to_close:
+            self._close(conn)
+        return len(to_close)
+
+    def _reaper_loop(self):
+        pid = self._pid
+        interval = max(1.0, min(self.idle_timeout / 4, 15))
+        while pid == os.getpid() and pid == self._pid:
+            time.sleep(interval)
+            idle_for = time.monotonic() - self._last_checkout
+            if idle_for >= self.idle_timeout:
+                closed = self.close_idle()
+                if closed:
+                    self.idle_closes += closed
+                    logger.info(f"Closed {closed} idle database connection(s) after {idle_for:.0f}s without traffic")
+            else:
+                # While active, keep at most minconn spare connections warm
+                # once they've gone unused for a while.
+                with self._lock:
+                    stale = [
+                        i for i, (_, used) in enumerate(self._idle)
+                        if time.monotonic() - used >= self.idle_timeout
+                    ]
+                    excess = max(0, len(self._idle) - self.minconn)
+                    doomed = [self._idle[i] for i in stale[:excess]]
+                    self._idle = [entry for entry in self._idle if entry not in doomed]
+                for conn, _ in doomed:
+                    self._close(conn)
+
+    def _ensure_reaper(self):
+        if self._reaper_started:
+            return
+        with self._lock:
+            if self._reaper_started:
+                return
+            threading.Thread(target=self._reaper_loop, name="db-pool-reaper", daemon=True).start()
+            self._reaper_started = True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "min": self.minconn,
+                "max": self.maxconn,
+                "connects": self.connects,
+                "reuses": self.reuses,
+                "idle_closes": self.idle_closes,
+                "seconds_since_checkout": round(time.monotonic() - self._last_checkout, 1),
+            }
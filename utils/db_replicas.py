@@ -0,0 +1,164 @@
+"""
+db_replicas.py — Read-replica selection with a staleness bound.
+
+Dashboard polling, the PHP bulk poller, exports, event stats and the digest
+only read, and they read a lot. Giving DatabaseManager one or more replica
+DSNs (DB_REPLICA_DSNS) lets those calls opt in with `use_replica=True` so
+they stop competing with webhook ingest on the primary. Writes, and reads
+that must see the caller's own just-committed write (the thread fetch right
+after /api/respond, anything in the webhook path), stay on the primary.
+
+ReplicaSet hands out replica connections round-robin, and skips a replica
+that is:
+
+  * unreachable, or failed a query with a transient error - for
+    `retry_after` seconds
+  * lagging by more than `max_lag` seconds - measured on a fresh
+    connection at most every `lag_check_interval` seconds, and skipped
+    until the next check
+
+If no replica qualifies, acquire() returns (None, None) and the caller
+falls back to the primary, so a missing or stale replica costs freshness
+nothing and availability nothing. Replica failures never count against
+the primary's circuit breaker.
+"""
+
+import logging
+import threading
+import time
+
+import psycopg2
+from psycopg2.extensions import parse_dsn
+
+from utils.metrics import DB_CONNECT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Seconds of replay lag; 0 on a primary, and on a replica that has
+# replayed everything it has received (an idle primary writes nothing, so
+# pg_last_xact_replay_timestamp() alone would report ever-growing lag).
+LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class Replica:
+    """One replica DSN plus its health as last observed."""
+
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.lag = None
+        self.lag_checked_at = 0.0
+        self.unusable_until = 0.0
+        self.reason = None
+        self.queries = 0
+        self.failures = 0
+
+    @property
+    def name(self):
+        """host:port/dbname, for logs and stats (never the password)."""
+        try:
+            params = parse_dsn(self.dsn)
+        except psycopg2.ProgrammingError:
+            return "<invalid dsn>"
+        return f"{params.get('host', 'localhost')}:{params.get('port', '5432')}/{params.get('dbname', '')}"
+
+
+class ReplicaSet:
+    """Round-robin over healthy, fresh-enough replicas."""
+
+    def __init__(self, dsns, connect_timeout=5, max_lag=10, lag_check_interval=5, retry_after=30):
+        """
+        Args:
+            dsns (list): libpq connection strings or URIs, one per replica.
+            connect_timeout (int): libpq connect timeout per replica (seconds).
+            max_lag (float): Replay lag beyond which a replica is skipped.
+            lag_check_interval (float): Seconds between lag measurements.
+            retry_after (float): Seconds to skip a replica after a failure.
+        """
+        self.replicas = [Replica(dsn) for dsn in dsns]
+        self.connect_timeout = connect_timeout
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._next = 0
+        self.fallbacks = 0
+
+    def _candidates(self):
+        now = time.monotonic()
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+        ordered = self.replicas[start:] + self.replicas[:start]
+        return [r for r in ordered if r.unusable_until <= now]
+
+    def acquire(self):
+        """
+        A connection to a usable replica, as (conn, replica) - or
+        (None, None) if there is none and the caller should use the primary.
+        """
+        for replica in self._candidates():
+            try:
+                with DB_CONNECT_SECONDS.time(target='replica'):
+                    conn = psycopg2.connect(replica.dsn, connect_timeout=self.connect_timeout)
+            except psycopg2.Error as e:
+                self.mark_failed(replica, e)
+                continue
+            if time.monotonic() - replica.lag_checked_at >= self.lag_check_interval:
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute(LAG_QUERY)
+                        replica.lag = float(cursor.fetchone()[0])
+                    conn.rollback()
+                except psycopg2.Error as e:
+                    conn.close()
+                    self.mark_failed(replica, e)
+                    continue
+                replica.lag_checked_at = time.monotonic()
+                if replica.lag > self.max_lag:
+                    conn.close()
+                    replica.unusable_until = replica.lag_checked_at + self.lag_check_interval
+                    replica.reason = f"lag {replica.lag:.1f}s > {self.max_lag}s"
+                    logger.warning(f"Replica {replica.name} skipped: {replica.reason}")
+                    continue
+            replica.reason = None
+            replica.queries += 1
+            return conn, replica
+        with self._lock:
+            self.fallbacks += 1
+        return None, None
+
+    def mark_failed(self, replica, error):
+        """Skip `replica` for `retry_after` seconds after a connection or transient query failure."""
+        replica.failures += 1
+        replica.unusable_until = time.monotonic() + self.retry_after
+        replica.reason = f"{type(error).__name__}: {str(error).strip()[:200]}"
+        logger.warning(f"Replica {replica.name} unavailable for {self.retry_after}s: {replica.reason}")
+
+    @staticmethod
+    def release(conn):
+        """Replica connections are per call, like the primary's default mode."""
+        conn.close()
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "max_lag_seconds": self.max_lag,
+            "fallbacks_to_primary": self.fallbacks,
+            "replicas": [
+                {
+                    "dsn": r.name,
+                    "usable": r.unusable_until <= now,
+                    "lag_seconds": None if r.lag is None else round(r.lag, 2),
+                    "reason": r.reason,
+                    "queries": r.queries,
+                    "failures": r.failures,
+                }
+                for r in self.replicas
+            ],
+        }
@@ -0,0 +1,176 @@
+"""
+db_resilience.py — Retry policy and circuit breaker for database calls.
+
+Which failures are worth retrying is decided from the psycopg2 error class
+and SQLSTATE, not from the message text:
+
+  * connection-level errors with no SQLSTATE (can't connect, server closed
+    the connection, SSL drop) and SQLSTATE class 08 (connection exception)
+  * serialization failures and deadlocks (40001, 40P01)
+  * the server going away or not yet accepting connections (57P01-57P03)
+  * too many connections (53300)
+
+Everything else - syntax errors, constraint violations, statement timeouts
+- fails immediately. Retries back off exponentially with full jitter and
+stop at a per-call deadline, so a dead database costs a request a bounded
+few seconds rather than stacking one retry loop inside another.
+
+CircuitBreaker is shared by every call in the process. Only failures that
+say the database can't be reached count toward opening it
+(is_connection_failure(): the connection-level errors, class 08 and the
+57P0x/53300 refusals above). A serialization failure or deadlock is still
+retried, but it comes from a server that answered, so it counts as a
+success. After `failure_threshold` consecutive connection failures the
+breaker opens and calls fail
+immediately with DatabaseUnavailable (a psycopg2.OperationalError, so the
+webhook spool and existing error handling treat it like any other outage)
+instead of piling more connection attempts onto a database that is down.
+After `reset_timeout` one trial call is let through; its outcome closes or
+re-opens the breaker. State and counters are exposed via stats().
+"""
+
+import random
+import threading
+import time
+
+import psycopg2
+
+TRANSIENT_SQLSTATES = {
+    '40001',  # serialization_failure
+    '40P01',  # deadlock_detected
+    '53300',  # too_many_connections
+    '57P01',  # admin_shutdown
+    '57P02',  # crash_shutdown
+    '57P03',  # cannot_connect_now
+}
+
+
+# The server is going away or refusing new connections.
+UNAVAILABLE_SQLSTATES = {'53300', '57P01', '57P02', '57P03'}
+
+
+class DatabaseUnavailable(psycopg2.OperationalError):
+    """Raised without touching the network while the circuit breaker is open."""
+
+
+def is_transient(error):
+    """True if `error` is worth retrying on a fresh connection."""
+    if isinstance(error, DatabaseUnavailable):
+        return False
+    code = getattr(error, 'pgcode', None)
+    if code:
+        return code.startswith('08') or code in TRANSIENT_SQLSTATES
+    return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+
+def is_connection_failure(error):
+    """True if `error` means the database couldn't be reached - what the circuit breaker counts."""
+    if isinstance(error, DatabaseUnavailable):
+        return False
+    code = getattr(error, 'pgcode', None)
+    if code:
+        return code.startswith('08') or code in UNAVAILABLE_SQLSTATES
+    return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, bounded by attempts and a deadline."""
+
+    def __init__(self, max_attempts=4, base_delay=0.2, max_delay=2.0, deadline=10.0):
+        """
+        Args:
+            max_attempts (int): Total tries per call, including the first.
+            base_delay (float): Backoff ceiling after the first failure (seconds).
+            max_delay (float): Cap on any single backoff.
+            deadline (float): Total seconds one call may spend, retries included.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def backoff(self, attempt):
+        """Seconds to sleep after failed attempt number `attempt` (1-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+class CircuitBreaker:
+    """Process-wide closed / open / half_open breaker for the database."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        """
+        Args:
+            failure_threshold (int): Consecutive connection failures that
+                open the breaker. 0 disables it.
+            reset_timeout (float): Seconds to stay open before a trial call.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self.rejected = 0
+        self.opens = 0
+
+    def before_call(self):
+        """Raise DatabaseUnavailable if calls are being shed right now."""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self.rejected += 1
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+        raise DatabaseUnavailable(f"Database circuit breaker is open; next trial in {retry_in:.0f}s")
+
+    def record_success(self):
+        """The database answered (even with an error, deadlocks included)."""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        """A connection failure - the database may be unreachable."""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or (
+                self._state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self.opens += 1
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout_seconds": self.reset_timeout,
+                "open_for_seconds": round(time.monotonic() - self._opened_at, 1) if self._opened_at else None,
+                "opens": self.opens,
+                "rejected": self.rejected,
+            }
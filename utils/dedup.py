@@ -0,0 +1,77 @@
+"""
+dedup.py — In-memory cache of recently processed webhook events.
+
+Meta redelivers a webhook whenever we're slow to answer. Without a cache,
+every redelivered inbound message still pays for the event_id lookup, a
+possible media download and an INSERT that ON CONFLICT then throws away.
+
+RecentlySeen is a bounded LRU with a TTL, keyed by message id (inbound
+messages) or (message id, status) (status callbacks). process_whatsapp_message
+checks it before any DB work and only records keys after the batch has
+committed, so a delivery that failed to persist is never mistaken for a
+duplicate when Meta retries it. The cache is per process; the database's
+ON CONFLICT (id) remains the cross-process backstop.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class RecentlySeen:
+    """Thread-safe LRU set with per-entry expiry and hit/miss counters."""
+
+    def __init__(self, capacity=10000, ttl_seconds=3600):
+        """
+        Args:
+            capacity (int): Maximum keys kept; the least recently seen is
+                evicted first. 0 disables the cache.
+            ttl_seconds (float): Keys older than this count as unseen.
+        """
+        self.capacity = capacity
+        self.ttl = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def contains(self, key):
+        """True (a hit) if `key` was recorded within the TTL."""
+        if self.capacity <= 0:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            seen_at = self._entries.get(key)
+            if seen_at is not None and now - seen_at <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True
+            if seen_at is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False
+
+    def add(self, *keys):
+        """Record `keys` as processed now, evicting the oldest beyond capacity."""
+        if self.capacity <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                self._entries[key] = now
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,81 @@
+"""
+event_cache.py — Write-through cache of the latest outbound event_id per contact.
+
+Every inbound text/image is tagged with the event_id of the most recent
+outbound message to that wa_id (see get_last_outbound_event_id). Looking
+that up costs an ORDER BY timestamp DESC query per inbound message, even
+though the answer only changes when we *send* something with an event_id.
+
+LastOutboundEventCache keeps that answer per (table, wa_id). It's written
+through by DatabaseManager.insert_message whenever an outbound row with an
+event_id is actually inserted (/api/log-outbound, /api/respond), and warmed
+lazily from the DB on a miss. Entries expire after a TTL because the cache
+is per process: another gunicorn worker's writes become visible within
+that bound. A "no event yet" answer is only kept for a few seconds - just
+enough to absorb a burst from one number - since the first outbound to a
+new contact is usually logged by another worker and the guest's reply
+must not miss it.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LastOutboundEventCache:
+    """Bounded LRU of (table, wa_id) -> latest outbound event_id (or None)."""
+
+    def __init__(self, capacity=5000, ttl_seconds=300, negative_ttl_seconds=5):
+        """
+        Args:
+            capacity (int): Maximum contacts kept; least recently used evicted
+                first. 0 disables the cache.
+            ttl_seconds (float): Age after which an entry is re-read from the DB.
+            negative_ttl_seconds (float): The same for a "no outbound event
+                yet" (None) entry.
+        """
+        self.capacity = capacity
+        self.ttl = ttl_seconds
+        self.negative_ttl = negative_ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, table_name, wa_id):
+        """Returns (found, event_id). found=False means the caller must query."""
+        if self.capacity <= 0:
+            return False, None
+        key = (table_name, wa_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            ttl = self.negative_ttl if entry is not None and entry[0] is None else self.ttl
+            if entry is not None and now - entry[1] <= ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[0]
+            self.misses += 1
+            return False, None
+
+    def set(self, table_name, wa_id, event_id):
+        """Record `event_id` (None for "no outbound event yet") as current."""
+        if self.capacity <= 0:
+            return
+        key = (table_name, wa_id)
+        with self._lock:
+            self._entries[key] = (event_id, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "ttl_seconds": self.ttl,
+                "negative_ttl_seconds": self.negative_ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
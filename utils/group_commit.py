@@ -0,0 +1,182 @@
+"""
+group_commit.py — Group commit for single-row message writes.
+
+Every inbound message, AI reply, /api/respond send and /api/log-outbound
+call used to run its own single-row INSERT in its own transaction. During a
+broadcast-plus-replies burst that is dozens of concurrent commits, each
+paying a round trip and a WAL flush of its own.
+
+With a GroupCommitWriter attached (DB_GROUP_COMMIT_MS > 0), insert_message()
+and update_message_status() calls made outside a session hand their row to
+a background flusher and wait on a Future. Every `flush_ms` (or as soon as
+`max_rows` are waiting) the flusher writes everything gathered so far in ONE
+transaction via write_webhook_batch(): one multi-row INSERT per table, then
+one set-based UPDATE per table for status changes. A caller's future
+resolves only once that transaction has committed, so "returned" still means
+"durable" - same semantics, far fewer commits.
+
+If a group fails with a non-transient error (one bad row, say), each of its
+writes is retried on its own so only the offending caller sees the error.
+Transient errors have already been retried inside the transaction by the
+DatabaseManager's retry policy and are handed to every caller.
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import psycopg2
+
+from utils.db_resilience import is_transient
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingGroup:
+    """One flush window's writes, each with the future its caller waits on."""
+
+    def __init__(self):
+        self.writes = []  # (kind, table_name, row, future)
+
+
+class GroupCommitWriter:
+    """Gathers concurrent message inserts / status updates into one commit."""
+
+    INSERT = 'insert'
+    STATUS = 'status'
+
+    def __init__(self, db_manager, flush_ms=5, max_rows=500):
+        """
+        Args:
+            db_manager: DatabaseManager the groups are written through.
+            flush_ms (int): How long to gather writes before committing.
+            max_rows (int): Flush early once this many writes are waiting.
+        """
+        self.db_manager = db_manager
+        self.window = flush_ms / 1000.0
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._current = _PendingGroup()
+        self._started_pid = None
+        self._counters = {
+            "writes": 0,
+            "groups": 0,
+            "largest_group": 0,
+            "fallback_groups": 0,
+            "failed_writes": 0,
+            "db_seconds": 0.0,
+        }
+
+    def insert(self, table_name, message_data):
+        """Queue one message INSERT; returns a Future resolved on commit."""
+        return self._submit(self.INSERT, table_name, message_data)
+
+    def update_status(self, table_name, update):
+        """Queue one status update ({id, status, read, error_details}); returns a Future."""
+        return self._submit(self.STATUS, table_name, update)
+
+    def _submit(self, kind, table_name, row):
+        self.ensure_started()
+        future = Future()
+        with self._lock:
+            self._current.writes.append((kind, table_name, row, future))
+            self._counters["writes"] += 1
+            full = len(self._current.writes) >= self.max_rows
+        if full:
+            self._flush_now()
+        else:
+            self._wakeup.set()
+        return future
+
+    def _swap(self):
+        with self._lock:
+            pending = self._current
+            self._current = _PendingGroup()
+        return pending
+
+    def _flush_now(self):
+        pending = self._swap()
+        if pending.writes:
+            self._flush(pending.writes)
+
+    def _write(self, writes):
+        """One transaction for `writes`: inserts first, so a status for a row in the same group applies."""
+        messages_by_table, statuses_by_table = {}, {}
+        for kind, table_name, row, _ in writes:
+            target = messages_by_table if kind == self.INSERT else statuses_by_table
+            target.setdefault(table_name, []).append(row)
+        self.db_manager.write_webhook_batch(messages_by_table, statuses_by_table, label='group_commit')
+
+    def _flush(self, writes):
+        started = time.monotonic()
+        fallback = False
+        try:
+            self._write(writes)
+            for *_, future in writes:
+                future.set_result(None)
+        except psycopg2.Error as e:
+            if len(writes) > 1 and not is_transient(e):
+                fallback = True
+                logger.warning(f"Group of {len(writes)} write(s) failed ({e}); retrying them one by one")
+                self._write_individually(writes)
+            else:
+                self._fail(writes, e)
+        except Exception as e:
+            self._fail(writes, e)
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._counters["groups"] += 1
+                self._counters["fallback_groups"] += int(fallback)
+                self._counters["largest_group"] = max(self._counters["largest_group"], len(writes))
+                self._counters["db_seconds"] += elapsed
+        logger.debug(f"Group-committed {len(writes)} write(s) in {elapsed * 1000:.1f}ms")
+
+    def _write_individually(self, writes):
+        for write in writes:
+            try:
+                self._write([write])
+                write[3].set_result(None)
+            except Exception as e:
+                self._fail([write], e)
+
+    def _fail(self, writes, error):
+        logger.error(f"❌ Group commit failed for {len(writes)} write(s): {error}")
+        with self._lock:
+            self._counters["failed_writes"] += len(writes)
+        for *_, future in writes:
+            future.set_exception(error)
+
+    def _flusher_loop(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # Let the window fill up, then commit whatever arrived.
+            time.sleep(self.window)
+            try:
+                self._flush_now()
+            except Exception as e:
+                logger.error(f"❌ Group commit writer error: {e}")
+
+    def ensure_started(self):
+        """Start the flusher thread for this process (again after a fork)."""
+        pid = os.getpid()
+        if self._started_pid == pid:
+            return
+        with self._lock:
+            if self._started_pid == pid:
+                return
+            threading.Thread(target=self._flusher_loop, name="group-commit", daemon=True).start()
+            self._started_pid = pid
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["waiting"] = len(self._current.writes)
+        stats["db_seconds"] = round(stats["db_seconds"], 4)
+        stats["avg_group_size"] = round(stats["writes"] / stats["groups"], 2) if stats["groups"] else None
+        stats["flush_ms"] = int(self.window * 1000)
+        return stats
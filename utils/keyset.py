@@ -0,0 +1,47 @@
+"""
+keyset.py — Opaque cursors for keyset-paginated endpoints.
+
+A keyset page ends at a row's sort key - (last_message_timestamp, wa_id)
+for the chat list, (timestamp, id) for a thread - and the next page is the
+rows strictly past it, an index range scan however deep the client pages,
+where OFFSET would re-read every row it skips. Clients get the key as an
+opaque token rather than its parts, so the sort key can change without
+changing the API and timestamps keep their full precision (jsonify would
+round them to the second).
+"""
+
+import base64
+import json
+from datetime import datetime
+
+
+def encode_cursor(*values):
+    """Opaque URL-safe token for a sort key; datetimes are kept as ISO strings."""
+    key = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, *types):
+    """
+    The sort key of an encode_cursor() token.
+
+    Args:
+        token (str): The token.
+        types: One of datetime or str per key part; a part may also be None.
+
+    Returns:
+        tuple: The key parts, converted.
+
+    Raises:
+        ValueError: if the token is malformed or has the wrong parts.
+    """
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if not isinstance(raw, list) or len(raw) != len(types):
+            raise ValueError(f"expected {len(types)} parts")
+        return tuple(
+            None if value is None else datetime.fromisoformat(value) if kind is datetime else kind(value)
+            for value, kind in zip(raw, types)
+        )
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"invalid cursor: {e}") from e
@@ -0,0 +1,201 @@
+"""
+metrics.py — In-process counters and latency histograms in Prometheus text format.
+
+A deliberately small stand-in for prometheus_client (not a dependency of
+this app): Counter and Histogram objects registered in REGISTRY, rendered by
+render() for the /metrics route. The components that already keep their
+own counters (webhook queue, spool, status applier, dedup cache, event
+cache, pool, circuit breaker, group commit, replicas) are folded in as
+gauges via stats_gauges() at scrape time rather than duplicated here.
+
+What gets recorded:
+
+    db_connect_seconds{target}                 connection acquire time, primary/replica
+    db_statement_seconds{statement,phase}      execute and fetch time per labelled statement
+    db_statement_rows_total{statement}         rows fetched
+    db_call_seconds{statement}                 whole call including retries
+    db_retries_total{statement}                transient-error retries
+    webhook_processing_seconds{outcome}        one webhook delivery, end to end
+    graph_api_request_seconds{operation,outcome}
+
+Statement labels are stable names (chats_list, thread, insert_message,
+status_update, ...) passed by callers - never SQL text - so cardinality
+stays bounded. Metrics are per process: under gunicorn each worker keeps
+and serves its own, as with the other stats endpoints.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; spans a pooled-connection hit to a Neon cold start.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count per label set."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_labels_text(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram per label set."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the `with` block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _labels_text(self.labelnames, key, [('le', _number(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _labels_text(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_number(round(series[-2], 6))}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Registry:
+    """The metrics rendered by /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return lines
+
+
+REGISTRY = Registry()
+
+DB_CONNECT_SECONDS = REGISTRY.histogram(
+    "db_connect_seconds", "Time to obtain a database connection.", ["target"])
+DB_STATEMENT_SECONDS = REGISTRY.histogram(
+    "db_statement_seconds", "Statement execute / fetch time.", ["statement", "phase"])
+DB_STATEMENT_ROWS = REGISTRY.counter(
+    "db_statement_rows_total", "Rows fetched by statement.", ["statement"])
+DB_CALL_SECONDS = REGISTRY.histogram(
+    "db_call_seconds", "Whole database call (one transaction) including retries.", ["statement"])
+DB_RETRIES = REGISTRY.counter(
+    "db_retries_total", "Retries after transient database errors.", ["statement"])
+WEBHOOK_SECONDS = REGISTRY.histogram(
+    "webhook_processing_seconds", "Processing time of one webhook delivery.", ["outcome"])
+GRAPH_API_SECONDS = REGISTRY.histogram(
+    "graph_api_request_seconds", "WhatsApp Graph API request time.", ["operation", "outcome"])
+
+
+def stats_gauges(component, stats):
+    """
+    Prometheus gauge lines for the numeric fields of a component's stats()
+    dict (one level of nesting is flattened; strings and lists are skipped).
+    """
+    lines = []
+
+    def add(key, value):
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            name = f"{component}_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_number(value)}")
+
+    for key, value in (stats or {}).items():
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                add(f"{key}_{sub_key}", sub_value)
+        else:
+            add(key, value)
+    return lines
+
+
+def labelled_gauge(name, samples, labelname):
+    """Gauge lines for {label value: number} samples, e.g. breaker state one-hot."""
+    lines = [f"# TYPE {name} gauge"]
+    for label, value in samples.items():
+        if value is not None:
+            lines.append(f'{name}{{{labelname}="{_escape(label)}"}} {_number(value)}')
+    return lines
+
+
+def render(extra_lines=()):
+    """The full /metrics body."""
+    return "\n".join(REGISTRY.render() + list(extra_lines)) + "\n"
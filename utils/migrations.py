@@ -0,0 +1,559 @@
+"""
+migrations.py — Versioned schema migrations for the message database.
+
+Every boot used to re-probe information_schema and re-issue ~30 idempotent
+ALTER / CREATE INDEX statements (plus an UPDATE ... WHERE updated_at IS NULL
+scan of every message table), each on its own connection, in every gunicorn
+worker.
+
+Instead, each applied step is recorded in schema_migrations and MIGRATIONS
+is an ordered registry of (version, name, apply) steps. run_migrations()
+reads the applied versions with a single query; only when something is
+pending does it take a transaction-scoped advisory lock (safe through
+Neon's PgBouncer pooler), re-check, and apply each pending step in its own
+transaction together with its schema_migrations row - so concurrent workers
+never apply a step twice and a failed step leaves no partial record.
+
+Steps use IF NOT EXISTS throughout, so an existing deployment created by the
+old per-boot code adopts the registry without changes. New schema changes go
+at the end of MIGRATIONS with the next version number; never renumber or
+edit a step that has shipped. Once a business has been cut over to the
+partitioned `messages` table its old name is a view, so later steps must
+alter `messages` rather than loop over MESSAGE_TABLES.
+
+A plain CREATE INDEX on a live message table blocks every insert and status
+update on it for the whole build. Steps in CONCURRENT_STEPS build their
+indexes with CREATE INDEX CONCURRENTLY instead, which can't run in a
+transaction: they get the DatabaseManager rather than a session, run each
+statement on its own autocommit connection, and are recorded afterwards.
+An interrupted concurrent build leaves an INVALID index that IF NOT EXISTS
+would then skip forever, so _create_index_concurrently() drops and rebuilds
+one. These steps only run from migrate.py and the other CLI tools - a
+gunicorn worker could be killed mid-build, and several would race - so
+startup migrations skip them, apply the steps after them, and log that
+migrate.py is needed. A concurrent step may therefore only add indexes:
+no later step can rely on it. Pending steps are worked out from the set of
+recorded versions rather than the highest one, so a skipped step is
+picked up whenever migrate.py runs.
+"""
+
+import logging
+import zlib
+from datetime import date
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_TABLES = ['eventio_messages', 'package_with_sense_messages', 'mwsmile_messages', 'ignitiohub_messages']
+
+# Tenant key of each per-business table in the consolidated, partitioned
+# `messages` table (see utils/partitioning.py).
+TENANTS = {table: table[:-len('_messages')] for table in MESSAGE_TABLES}
+
+# Monthly partitions kept ready ahead of the current month.
+PARTITION_MONTHS_AHEAD = 2
+
+# pg_advisory_xact_lock key shared by every process migrating this database.
+MIGRATION_LOCK_KEY = zlib.crc32(b"schema_migrations")
+
+
+def _create_message_tables(session, schema):
+    for table in MESSAGE_TABLES:
+        session.execute(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.{table} (
+                id VARCHAR(255) PRIMARY KEY,
+                wa_id VARCHAR(255),
+                name VARCHAR(255),
+                type VARCHAR(50),
+                body TEXT,
+                timestamp TIMESTAMPTZ,
+                direction VARCHAR(50),
+                status VARCHAR(50),
+                read BOOLEAN,
+                image_url TEXT,
+                image_id VARCHAR(255),
+                error_details TEXT,
+                event_id INTEGER,
+                template_name VARCHAR(255)
+            )
+        """)
+
+
+def _add_error_details(session, schema):
+    for table in MESSAGE_TABLES:
+        session.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN IF NOT EXISTS error_details TEXT")
+
+
+def _add_event_columns(session, schema):
+    for table in MESSAGE_TABLES:
+        session.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN IF NOT EXISTS event_id INTEGER")
+        session.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN IF NOT EXISTS template_name VARCHAR(255)")
+        # Index so per-event queries stay fast even as rows grow
+        session.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_event_id ON {schema}.{table}(event_id)")
+
+
+def _add_updated_at(session, schema):
+    # Backfilled from timestamp once; update_message_status() bumps it on
+    # every status change so pollers can watch it for status-only changes.
+    for table in MESSAGE_TABLES:
+        session.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ")
+        session.execute(f"UPDATE {schema}.{table} SET updated_at = timestamp WHERE updated_at IS NULL")
+        session.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_updated_at ON {schema}.{table}(updated_at)")
+
+
+def _create_message_rankings(session, schema):
+    session.execute(f"""
+        CREATE TABLE IF NOT EXISTS {schema}.message_rankings (
+            message_id VARCHAR(255) PRIMARY KEY,
+            wa_id VARCHAR(255),
+            category VARCHAR(50),
+            score INTEGER,
+            reason TEXT,
+            ranked_at TIMESTAMPTZ DEFAULT NOW()
+        )
+    """)
+    for column, ddl in [
+        ('wa_id', 'VARCHAR(255)'),
+        ('category', 'VARCHAR(50)'),
+        ('score', 'INTEGER'),
+        ('reason', 'TEXT'),
+        ('ranked_at', 'TIMESTAMPTZ DEFAULT NOW()'),
+    ]:
+        session.execute(f"ALTER TABLE {schema}.message_rankings ADD COLUMN IF NOT EXISTS {column} {ddl}")
+
+
+def _create_digest_log(session, schema):
+    session.execute(f"""
+        CREATE TABLE IF NOT EXISTS {schema}.digest_log (
+            run_date DATE PRIMARY KEY,
+            sent_at TIMESTAMPTZ DEFAULT NOW()
+        )
+    """)
+
+
+def _create_index_concurrently(db_manager, schema, name, definition):
+    """
+    CREATE INDEX CONCURRENTLY `name` `definition` (e.g. "ON schema.table(col)"),
+    first dropping an INVALID index of that name left by an interrupted build.
+    """
+    rows = db_manager.execute_query("""
+        SELECT i.indisvalid FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = %s
+    """, (schema, name), fetch=True, label='migration')
+    if rows and rows[0]['indisvalid']:
+        return
+    if rows:
+        logger.warning(f"Index {schema}.{name} is invalid (interrupted build); rebuilding it")
+        db_manager.execute_autocommit(f"DROP INDEX CONCURRENTLY IF EXISTS {schema}.{name}", label='migration')
+    db_manager.execute_autocommit(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}", label='migration')
+
+
+def _create_partitioned_index_concurrently(db_manager, schema, table, suffix, columns):
+    """
+    The concurrent equivalent of CREATE INDEX idx_<table>_<suffix> ON <table>
+    `columns` for a partitioned table, which CONCURRENTLY doesn't support:
+    each leaf partition gets idx_<leaf>_<suffix> built concurrently, each
+    partitioned table an ON ONLY index (instant), and the leaves' indexes
+    are attached up the tree - the top one turns valid once all are.
+    Partitions created later get the index from their parent.
+    """
+    tree = db_manager.execute_query("""
+        SELECT c.relname, p.relname AS parent, t.isleaf
+        FROM pg_partition_tree(%s::regclass) t
+        JOIN pg_class c ON c.oid = t.relid
+        LEFT JOIN pg_class p ON p.oid = t.parentrelid
+        ORDER BY t.level DESC
+    """, (f"{schema}.{table}",), fetch=True, label='migration')
+    for node in tree:
+        name = f"idx_{node['relname']}_{suffix}"
+        if node['isleaf']:
+            _create_index_concurrently(db_manager, schema, name, f"ON {schema}.{node['relname']}{columns}")
+        else:
+            db_manager.execute_autocommit(
+                f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {schema}.{node['relname']}{columns}", label='migration'
+            )
+            for child in tree:
+                if child['parent'] == node['relname']:
+                    db_manager.execute_autocommit(
+                        f"ALTER INDEX {schema}.{name} ATTACH PARTITION {schema}.idx_{child['relname']}_{suffix}",
+                        label='migration',
+                    )
+
+
+def _add_hot_path_indexes(db_manager, schema):
+    # Matches the queries the app runs on every poll / webhook (verified by
+    # check_query_plans.py):
+    #   (wa_id, timestamp)            /api/chats/<wa_id>, get_conversation_context,
+    #                                 AI reply history, DISTINCT ON (wa_id) in /api/chats
+    #   partial unread (wa_id)        unread counts and /api/mark-read
+    #   partial outbound (wa_id, ts)  get_last_outbound_event_id
+    #   (event_id, wa_id, timestamp)  event-scoped threads, conversations and stats;
+    #                                 its event_id prefix replaces idx_<table>_event_id
+    for table in MESSAGE_TABLES:
+        _create_index_concurrently(db_manager, schema, f"idx_{table}_wa_id_timestamp",
+                                   f"ON {schema}.{table}(wa_id, timestamp)")
+        _create_index_concurrently(db_manager, schema, f"idx_{table}_unread",
+                                   f"ON {schema}.{table}(wa_id) WHERE direction = 'inbound' AND read = FALSE")
+        _create_index_concurrently(db_manager, schema, f"idx_{table}_last_outbound_event",
+                                   f"ON {schema}.{table}(wa_id, timestamp) "
+                                   f"WHERE direction = 'outbound' AND event_id IS NOT NULL")
+        _create_index_concurrently(db_manager, schema, f"idx_{table}_event_wa_id_timestamp",
+                                   f"ON {schema}.{table}(event_id, wa_id, timestamp)")
+        db_manager.execute_autocommit(f"DROP INDEX CONCURRENTLY IF EXISTS {schema}.idx_{table}_event_id",
+                                      label='migration')
+
+
+def month_start(day, offset=0):
+    """First day of the month `offset` months after the one containing `day`."""
+    index = day.year * 12 + day.month - 1 + offset
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def create_month_partitions(session, schema, first_month, last_month):
+    """
+    Create the monthly sub-partitions of every tenant's messages partition
+    from `first_month` through `last_month` (inclusive). Idempotent.
+    """
+    month = month_start(first_month)
+    while month <= last_month:
+        upper = month_start(month, 1)
+        for tenant in TENANTS.values():
+            session.execute(f"""
+                CREATE TABLE IF NOT EXISTS {schema}.messages_{tenant}_{month:%Y%m}
+                PARTITION OF {schema}.messages_{tenant}
+                FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')
+            """)
+        month = upper
+
+
+def _create_partitioned_messages(session, schema):
+    # One table for every business: LIST by tenant, then RANGE by month.
+    # Unique constraints on a partitioned table must include the partition
+    # keys, so id uniqueness per tenant is enforced by message_ids instead.
+    # The per-business tables stay in use until partition_messages.py
+    # cuts each one over to a view of this table.
+    session.execute(f"""
+        CREATE TABLE IF NOT EXISTS {schema}.messages (
+            tenant VARCHAR(50) NOT NULL,
+            id VARCHAR(255) NOT NULL,
+            wa_id VARCHAR(255),
+            name VARCHAR(255),
+            type VARCHAR(50),
+            body TEXT,
+            timestamp TIMESTAMPTZ,
+            direction VARCHAR(50),
+            status VARCHAR(50),
+            read BOOLEAN,
+            image_url TEXT,
+            image_id VARCHAR(255),
+            error_details TEXT,
+            event_id INTEGER,
+            template_name VARCHAR(255),
+            updated_at TIMESTAMPTZ
+        ) PARTITION BY LIST (tenant)
+    """)
+    session.execute(f"""
+        CREATE TABLE IF NOT EXISTS {schema}.message_ids (
+            tenant VARCHAR(50) NOT NULL,
+            id VARCHAR(255) NOT NULL,
+            PRIMARY KEY (tenant, id)
+        )
+    """)
+    for tenant in TENANTS.values():
+        session.execute(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.messages_{tenant}
+            PARTITION OF {schema}.messages FOR VALUES IN ('{tenant}')
+            PARTITION BY RANGE (timestamp)
+        """)
+        # Catches NULL timestamps and anything outside the monthly partitions.
+        session.execute(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.messages_{tenant}_default
+            PARTITION OF {schema}.messages_{tenant} DEFAULT
+        """)
+    today = date.today()
+    create_month_partitions(session, schema, today, month_start(today, PARTITION_MONTHS_AHEAD))
+    # Same access paths as migration 7, created once on the parent.
+    session.execute(f"CREATE INDEX IF NOT EXISTS idx_messages_id ON {schema}.messages(id)")
+    session.execute(f"CREATE INDEX IF NOT EXISTS idx_messages_wa_id_timestamp ON {schema}.messages(wa_id, timestamp)")
+    session.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_messages_unread ON {schema}.messages(wa_id)
+        WHERE direction = 'inbound' AND read = FALSE
+    """)
+    session.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_messages_last_outbound_event ON {schema}.messages(wa_id, timestamp)
+        WHERE direction = 'outbound' AND event_id IS NOT NULL
+    """)
+    session.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_messages_event_wa_id_timestamp ON {schema}.messages(event_id, wa_id, timestamp)"
+    )
+    session.execute(f"CREATE INDEX IF NOT EXISTS idx_messages_updated_at ON {schema}.messages(updated_at)")
+
+
+def _create_conversation_summaries(session, schema):
+    # One row per (business, contact) for /api/chats, kept current by the
+    # write paths (see utils/conversation_summaries.py) and backfilled here.
+    session.execute(f"""
+        CREATE TABLE IF NOT EXISTS {schema}.conversation_summaries (
+            tenant VARCHAR(50) NOT NULL,
+            wa_id VARCHAR(255) NOT NULL,
+            name VARCHAR(255),
+            last_message_id VARCHAR(255),
+            last_body TEXT,
+            last_message_timestamp TIMESTAMPTZ,
+            last_direction VARCHAR(50),
+            last_status VARCHAR(50),
+            unread_count INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (tenant, wa_id)
+        )
+    """)
+    session.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_conversation_summaries_recent
+        ON {schema}.conversation_summaries(tenant, last_message_timestamp DESC NULLS LAST)
+    """)
+    for table, tenant in TENANTS.items():
+        session.execute(f"""
+            INSERT INTO {schema}.conversation_summaries
+                (tenant, wa_id, name, last_message_id, last_body, last_message_timestamp,
+                 last_direction, last_status, unread_count, updated_at)
+            SELECT %s, l.wa_id, l.name, l.id, l.body, l.timestamp, l.direction, l.status,
+                   COALESCE(u.unread_count, 0), NOW()
+            FROM (
+                SELECT DISTINCT ON (wa_id) wa_id, name, id, body, timestamp, direction, status
+                FROM {schema}.{table}
+                WHERE wa_id IS NOT NULL
+                ORDER BY wa_id, timestamp DESC
+            ) l
+            LEFT JOIN (
+                SELECT wa_id, COUNT(*) AS unread_count
+                FROM {schema}.{table}
+                WHERE direction = 'inbound' AND read = FALSE
+                GROUP BY wa_id
+            ) u ON u.wa_id = l.wa_id
+            ON CONFLICT (tenant, wa_id) DO NOTHING
+        """, (tenant,))
+
+
+def _add_summary_changes_index(session, schema):
+    # /api/chats?since= reads the summaries changed after a cursor.
+    session.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_conversation_summaries_changes
+        ON {schema}.conversation_summaries(tenant, updated_at)
+    """)
+
+
+def _add_summary_keyset_and_search_indexes(session, schema):
+    # /api/chats pages by keyset on (RECENCY_KEY, wa_id) - read backwards -
+    # which supersedes the timestamp-only index, and its ?q= search is a
+    # substring match on the name or phone number, which only trigram
+    # indexes can serve.
+    session.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_conversation_summaries_keyset
+        ON {schema}.conversation_summaries(tenant, (COALESCE(last_message_timestamp, '-infinity'::timestamptz)), wa_id)
+    """)
+    session.execute(f"DROP INDEX IF EXISTS {schema}.idx_conversation_summaries_recent")
+    session.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    session.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_conversation_summaries_name_trgm
+        ON {schema}.conversation_summaries USING gin (name gin_trgm_ops)
+    """)
+    session.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_conversation_summaries_wa_id_trgm
+        ON {schema}.conversation_summaries USING gin (wa_id gin_trgm_ops)
+    """)
+
+
+def _add_timestamp_indexes(db_manager, schema):
+    # Whole-business reads in timestamp order - /messages/<phone_id> streams
+    # newest first, /api/export a date range - would otherwise sort the whole
+    # table before the first row. Businesses already cut over are views of
+    # `messages` by now, so only the real tables get their own index.
+    for table in MESSAGE_TABLES:
+        rows = db_manager.execute_query("""
+            SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = %s AND c.relname = %s
+        """, (schema, table), fetch=True, label='migration')
+        if rows and rows[0]['relkind'] == 'r':
+            _create_index_concurrently(db_manager, schema, f"idx_{table}_timestamp", f"ON {schema}.{table}(timestamp)")
+    _create_partitioned_index_concurrently(db_manager, schema, 'messages', 'timestamp', '(timestamp)')
+
+
+def _create_stream_events(session, schema):
+    # Append-only log of chat changes pushed to the dashboards by
+    # /api/stream (see utils/stream_events.py); pruned after a retention
+    # window, so it stays small.
+    session.execute(f"""
+        CREATE TABLE IF NOT EXISTS {schema}.stream_events (
+            id BIGSERIAL PRIMARY KEY,
+            tenant VARCHAR(50) NOT NULL,
+            type VARCHAR(50) NOT NULL,
+            wa_id VARCHAR(255),
+            payload JSONB NOT NULL DEFAULT '{{}}'::jsonb,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+        )
+    """)
+    session.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_stream_events_created_at
+        ON {schema}.stream_events(created_at)
+    """)
+
+
+# Ordered registry: (version, name, apply(session, schema)).
+MIGRATIONS = [
+    (1, 'create_message_tables', _create_message_tables),
+    (2, 'add_error_details', _add_error_details),
+    (3, 'add_event_columns', _add_event_columns),
+    (4, 'add_updated_at', _add_updated_at),
+    (5, 'create_message_rankings', _create_message_rankings),
+    (6, 'create_digest_log', _create_digest_log),
+    (7, 'add_hot_path_indexes', _add_hot_path_indexes),
+    (8, 'create_partitioned_messages', _create_partitioned_messages),
+    (9, 'create_conversation_summaries', _create_conversation_summaries),
+    (10, 'add_summary_changes_index', _add_summary_changes_index),
+    (11, 'add_summary_keyset_and_search_indexes', _add_summary_keyset_and_search_indexes),
+    (12, 'add_timestamp_indexes', _add_timestamp_indexes),
+    (13, 'create_stream_events', _create_stream_events),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Steps that take (db_manager, schema) and build their indexes concurrently,
+# outside a transaction; never applied at worker startup.
+CONCURRENT_STEPS = {7, 12}
+
+
+def applied_versions(db_manager, schema='public'):
+    """
+    The set of applied migration versions, in one query. Empty if the
+    schema_migrations table doesn't exist yet (a fresh or pre-registry
+    database).
+    """
+    try:
+        rows = db_manager.execute_query(f"SELECT version FROM {schema}.schema_migrations", fetch=True)
+        return {row['version'] for row in rows}
+    except psycopg2.Error as e:
+        if getattr(e, 'pgcode', None) == '42P01':  # undefined_table
+            return set()
+        raise
+
+
+def require_schema(db_manager, schema='public'):
+    """
+    Raise RuntimeError unless every migration outside CONCURRENT_STEPS is
+    applied. The app's write paths need their tables (every message write
+    refreshes conversation_summaries, for one); the concurrent steps only
+    add indexes, so they may lag until migrate.py runs.
+    """
+    done = applied_versions(db_manager, schema)
+    missing = [f"{version} ({name})" for version, name, _ in MIGRATIONS
+               if version not in done and version not in CONCURRENT_STEPS]
+    if missing:
+        raise RuntimeError(f"Schema is missing migration(s) {', '.join(missing)}; run `python migrate.py`")
+
+
+def applied_migrations(db_manager, schema='public'):
+    """[{version, name, applied_at}] for every applied migration, oldest first."""
+    if not applied_versions(db_manager, schema):
+        return []
+    return db_manager.execute_query(
+        f"SELECT version, name, applied_at FROM {schema}.schema_migrations ORDER BY version",
+        fetch=True
+    )
+
+
+def _lock_and_check(session, schema, version):
+    """Take the migration lock; True if `version` is already recorded."""
+    session.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+    session.execute(f"""
+        CREATE TABLE IF NOT EXISTS {schema}.schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """)
+    return bool(session.execute(f"SELECT 1 FROM {schema}.schema_migrations WHERE version = %s", (version,)))
+
+
+def _record(session, schema, version, name):
+    session.execute(
+        f"INSERT INTO {schema}.schema_migrations (version, name) VALUES (%s, %s)",
+        (version, name)
+    )
+
+
+def _apply(session, schema, version, name, step):
+    """Apply one step under the migration lock. Returns False if another process beat us to it."""
+    if _lock_and_check(session, schema, version):
+        return False
+    step(session, schema)
+    _record(session, schema, version, name)
+    return True
+
+
+def _apply_concurrent(db_manager, schema, version, name, step):
+    """
+    Apply one CONCURRENT_STEPS step: its statements autocommit, so only the
+    schema_migrations row is written under the migration lock.
+    """
+    if db_manager.run_in_session(lambda s: _lock_and_check(s, schema, version), label='migration'):
+        return False
+    step(db_manager, schema)
+
+    def record(session):
+        # Another process may have applied it meanwhile; its build was a no-op.
+        if not _lock_and_check(session, schema, version):
+            _record(session, schema, version, name)
+
+    db_manager.run_in_session(record, label='migration')
+    return True
+
+
+def run_migrations(db_manager, schema='public', startup=False):
+    """
+    Apply every pending migration in order.
+
+    A warm boot (every step applied) costs a single query. Raises on the
+    first failing step; steps before it stay applied.
+
+    Args:
+        db_manager: DatabaseManager to migrate through.
+        schema (str): Schema holding the tables.
+        startup (bool): Running at worker startup: skip pending
+            CONCURRENT_STEPS steps, leaving them to migrate.py, and apply
+            the rest.
+
+    Returns:
+        list: Versions applied by this call (empty if already up to date).
+    """
+    done_before = applied_versions(db_manager, schema)
+    pending = [migration for migration in MIGRATIONS if migration[0] not in done_before]
+    if not pending:
+        logger.info(f"✅ Schema up to date (version {LATEST_VERSION})")
+        return []
+
+    applied, deferred = [], []
+    for step_version, name, step in pending:
+        if step_version in CONCURRENT_STEPS and startup:
+            deferred.append(f"{step_version} ({name})")
+            continue
+        try:
+            if step_version in CONCURRENT_STEPS:
+                done = _apply_concurrent(db_manager, schema, step_version, name, step)
+            else:
+                done = db_manager.run_in_session(lambda s: _apply(s, schema, step_version, name, step),
+                                                 label='migration')
+            if done:
+                applied.append(step_version)
+                logger.info(f"✅ Migration {step_version} ({name}) applied")
+        except Exception as e:
+            logger.error(f"❌ Migration {step_version} ({name}) failed: {e}")
+            raise
+    if deferred:
+        logger.error(
+            f"❌ Migration(s) {', '.join(deferred)} build indexes on live tables and are not run at "
+            f"startup; run `python migrate.py` to apply them"
+        )
+    return applied
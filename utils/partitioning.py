@@ -0,0 +1,296 @@
+"""
+partitioning.py — Online move of the per-business message tables into the
+single partitioned `messages` table (created by migration 8).
+
+`messages` is LIST-partitioned by tenant and each tenant RANGE-partitioned by
+month on timestamp, so a per-business, recent-window query only touches one
+or two small partitions however much history piles up, cross-business
+reports are one query, and an old month can be detached in one cheap
+statement instead of DELETEd row by row.
+
+Moving a business over happens while the app keeps running:
+
+    prepare   install a trigger on the old table that mirrors every new
+              INSERT/UPDATE into `messages` from now on
+    backfill  copy existing rows across in keyset batches (id order), each
+              batch its own short transaction, reporting progress
+    cutover   in one transaction: block writes to the old table, copy any
+              rows still missing, re-sync any that changed mid-backfill,
+              check the row counts match, rename the old table to
+              <name>_legacy and create a view under the old name
+
+After cutover every get_table_name() caller keeps working against the view
+(reads and UPDATEs pass straight through to `messages`, with the tenant
+filter pruning the other businesses). INSERTs can't use ON CONFLICT (id) on
+a partitioned table, so DatabaseManager routes them to `messages` with the
+message_ids registry providing the per-tenant id uniqueness instead. A
+process that cached the table as plain within the last
+PARTITIONED_VIEWS_TTL seconds gets an error on its next INSERT. It then
+refreshes the cache and retries that INSERT once, routed through
+`messages` (DatabaseManager._with_fresh_routing()).
+
+All of this is driven by partition_messages.py.
+"""
+
+import logging
+import re
+from datetime import date
+
+from utils.db_manager import MESSAGE_INSERT_COLUMNS
+from utils.migrations import (
+    PARTITION_MONTHS_AHEAD,
+    TENANTS,
+    create_month_partitions,
+    month_start,
+)
+
+logger = logging.getLogger(__name__)
+
+COPY_COLUMNS = MESSAGE_INSERT_COLUMNS + ('updated_at',)
+MIRROR_TRIGGER = 'mirror_to_messages'
+
+
+def ensure_month_partitions(db_manager, months_ahead=PARTITION_MONTHS_AHEAD, since=None, schema='public'):
+    """
+    Make sure every tenant has monthly partitions from `since` (default:
+    this month) through `months_ahead` months from now. Idempotent - run
+    daily by the scheduler in run.py so inserts never land in the default
+    partition.
+    """
+    today = date.today()
+    first = since or today
+    last = month_start(today, months_ahead)
+    db_manager.run_in_session(lambda s: create_month_partitions(s, schema, first, last), label='ensure_partitions')
+    logger.info(f"✅ Message partitions ready {month_start(first):%Y-%m} .. {last:%Y-%m}")
+
+
+def _relkind(session, schema, name):
+    rows = session.execute("""
+        SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = %s
+    """, (schema, name))
+    return rows[0]['relkind'] if rows else None
+
+
+def _copy_missing_sql(schema, table, source_where):
+    """
+    INSERT of every row of `table` matching `source_where` whose id isn't
+    in message_ids yet - registering the id and copying the row in one
+    statement, so a row is never copied twice.
+    """
+    cols = ", ".join(COPY_COLUMNS)
+    batch_cols = ", ".join(f"b.{c}" for c in COPY_COLUMNS)
+    return f"""
+        WITH batch AS (
+            SELECT {cols} FROM {schema}.{table} l {source_where}
+        ), new_ids AS (
+            INSERT INTO {schema}.message_ids (tenant, id)
+            SELECT %(tenant)s, id FROM batch
+            ON CONFLICT DO NOTHING
+            RETURNING id
+        ), copied AS (
+            INSERT INTO {schema}.messages (tenant, {cols})
+            SELECT %(tenant)s, {batch_cols} FROM batch b JOIN new_ids n ON n.id = b.id
+            RETURNING 1
+        )
+        SELECT (SELECT MAX(id) FROM batch) AS last_id,
+               (SELECT COUNT(*) FROM batch) AS scanned,
+               (SELECT COUNT(*) FROM copied) AS copied
+    """
+
+
+def install_mirror(db_manager, table, schema='public'):
+    """Start mirroring new writes on `table` into `messages` (the prepare step)."""
+    tenant = TENANTS[table]
+    cols = ", ".join(COPY_COLUMNS)
+    new_cols = ", ".join(f"NEW.{c}" for c in COPY_COLUMNS)
+    assignments = ", ".join(f"{c} = NEW.{c}" for c in COPY_COLUMNS if c != 'id')
+
+    def work(session):
+        if _relkind(session, schema, table) != 'r':
+            return False
+        session.execute(f"""
+            CREATE OR REPLACE FUNCTION {schema}.{MIRROR_TRIGGER}() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    INSERT INTO {schema}.message_ids (tenant, id) VALUES (TG_ARGV[0], NEW.id)
+                    ON CONFLICT DO NOTHING;
+                    IF FOUND THEN
+                        INSERT INTO {schema}.messages (tenant, {cols}) VALUES (TG_ARGV[0], {new_cols});
+                    END IF;
+                ELSE
+                    UPDATE {schema}.messages SET {assignments}
+                    WHERE tenant = TG_ARGV[0] AND id = NEW.id;
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        session.execute(f"DROP TRIGGER IF EXISTS {MIRROR_TRIGGER} ON {schema}.{table}")
+        session.execute(f"""
+            CREATE TRIGGER {MIRROR_TRIGGER}
+            AFTER INSERT OR UPDATE ON {schema}.{table}
+            FOR EACH ROW EXECUTE FUNCTION {schema}.{MIRROR_TRIGGER}('{tenant}')
+        """)
+        return True
+
+    installed = db_manager.run_in_session(work)
+    if installed:
+        logger.info(f"✅ Mirroring {schema}.{table} writes into {schema}.messages (tenant {tenant})")
+    return installed
+
+
+def backfill(db_manager, table, batch_size=5000, schema='public', progress=None):
+    """
+    Copy `table`'s existing rows into `messages` in id order, one short
+    transaction per batch. Safe to stop and re-run: ids already in
+    message_ids are skipped.
+
+    Args:
+        progress (callable): Optional progress(scanned_total, copied_total, total).
+
+    Returns:
+        dict: {scanned, copied}
+    """
+    tenant = TENANTS[table]
+    bounds = db_manager.execute_query(
+        f"SELECT COUNT(*) AS total, MIN(timestamp) AS oldest FROM {schema}.{table}", fetch=True
+    )[0]
+    if bounds['oldest'] is not None:
+        ensure_month_partitions(db_manager, since=bounds['oldest'].date(), schema=schema)
+
+    query = _copy_missing_sql(schema, table, "WHERE l.id > %(after)s ORDER BY l.id LIMIT %(limit)s")
+    after, scanned_total, copied_total = '', 0, 0
+    while True:
+        row = db_manager.execute_query(
+            query, {'tenant': tenant, 'after': after, 'limit': batch_size}, fetch=True
+        )[0]
+        if not row['scanned']:
+            break
+        after = row['last_id']
+        scanned_total += row['scanned']
+        copied_total += row['copied']
+        if progress is not None:
+            progress(scanned_total, copied_total, bounds['total'])
+    logger.info(f"✅ Backfilled {schema}.{table}: {copied_total} copied, {scanned_total} scanned")
+    return {'scanned': scanned_total, 'copied': copied_total}
+
+
+def cutover(db_manager, table, schema='public'):
+    """
+    Atomically replace `table` with a view over `messages`. Reads carry on
+    throughout, but writes to the old table are blocked for the whole
+    transaction, and that includes the re-sync, which compares every row
+    of the old table with its copy in `messages` (a full-table join). On a
+    large table, run this at a quiet time.
+
+    Returns:
+        dict or None: {copied, resynced, rows}, or None if already cut over.
+    """
+    tenant = TENANTS[table]
+    cols = ", ".join(COPY_COLUMNS)
+    data_cols = [c for c in COPY_COLUMNS if c != 'id']
+
+    def work(session):
+        if _relkind(session, schema, table) != 'r':
+            return None
+        session.execute(f"LOCK TABLE {schema}.{table} IN SHARE ROW EXCLUSIVE MODE")
+        copied = session.execute(
+            _copy_missing_sql(schema, table, f"""
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {schema}.message_ids r WHERE r.tenant = %(tenant)s AND r.id = l.id
+                )
+            """),
+            {'tenant': tenant}
+        )[0]['copied']
+        # Rows whose mirrored UPDATE raced a backfill batch.
+        session.execute(f"""
+            UPDATE {schema}.messages m
+            SET {", ".join(f"{c} = l.{c}" for c in data_cols)}
+            FROM {schema}.{table} l
+            WHERE m.tenant = %(tenant)s AND m.id = l.id
+              AND ROW({", ".join(f"m.{c}" for c in data_cols)})
+                  IS DISTINCT FROM ROW({", ".join(f"l.{c}" for c in data_cols)})
+        """, {'tenant': tenant})
+        resynced = session.cursor.rowcount
+        counts = session.execute(f"""
+            SELECT (SELECT COUNT(*) FROM {schema}.{table}) AS legacy_rows,
+                   (SELECT COUNT(*) FROM {schema}.messages WHERE tenant = %(tenant)s) AS partitioned_rows
+        """, {'tenant': tenant})[0]
+        if counts['legacy_rows'] != counts['partitioned_rows']:
+            raise RuntimeError(
+                f"Row count mismatch for {table}: {counts['legacy_rows']} in the old table, "
+                f"{counts['partitioned_rows']} in messages - nothing was changed"
+            )
+        session.execute(f"DROP TRIGGER IF EXISTS {MIRROR_TRIGGER} ON {schema}.{table}")
+        session.execute(f"ALTER TABLE {schema}.{table} RENAME TO {table}_legacy")
+        session.execute(f"""
+            CREATE VIEW {schema}.{table} AS
+            SELECT {cols} FROM {schema}.messages WHERE tenant = '{tenant}'
+        """)
+        return {'copied': copied, 'resynced': resynced, 'rows': counts['partitioned_rows']}
+
+    result = db_manager.run_in_session(work)
+    if result is not None:
+        logger.info(f"✅ {schema}.{table} is now a view over {schema}.messages ({result})")
+    return result
+
+
+def detach_months(db_manager, before, schema='public'):
+    """
+    Detach every monthly partition that ends on or before `before` (a date;
+    its month is the first one kept). Detached partitions become ordinary
+    tables named messages_<tenant>_<YYYYMM>, ready to archive or drop.
+    Their ids stay in message_ids, so an old message can't be re-inserted.
+
+    Returns:
+        list: Names of the detached partitions.
+    """
+    cutoff = month_start(before)
+
+    def work(session):
+        detached = []
+        for tenant in TENANTS.values():
+            rows = session.execute("""
+                SELECT c.relname FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                JOIN pg_class p ON p.oid = i.inhparent
+                JOIN pg_namespace n ON n.oid = p.relnamespace
+                WHERE n.nspname = %s AND p.relname = %s
+            """, (schema, f"messages_{tenant}"))
+            for row in rows:
+                match = re.fullmatch(rf"messages_{tenant}_(\d{{4}})(\d{{2}})", row['relname'])
+                if match and date(int(match.group(1)), int(match.group(2)), 1) < cutoff:
+                    session.execute(
+                        f"ALTER TABLE {schema}.messages_{tenant} DETACH PARTITION {schema}.{row['relname']}"
+                    )
+                    detached.append(row['relname'])
+        return sorted(detached)
+
+    detached = db_manager.run_in_session(work)
+    logger.info(f"✅ Detached {len(detached)} partition(s) before {cutoff:%Y-%m}")
+    return detached
+
+
+def status(db_manager, schema='public'):
+    """Per business: storage ('table' or 'view'), mirror trigger and row counts."""
+    report = []
+    for table, tenant in TENANTS.items():
+        row = db_manager.execute_query("""
+            SELECT c.relkind,
+                   EXISTS (SELECT 1 FROM pg_trigger t WHERE t.tgrelid = c.oid AND t.tgname = %s) AS mirrored
+            FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = %s AND c.relname = %s
+        """, (MIRROR_TRIGGER, schema, table), fetch=True)
+        partitioned = db_manager.execute_query(
+            f"SELECT COUNT(*) AS n FROM {schema}.messages WHERE tenant = %s", (tenant,), fetch=True
+        )[0]['n']
+        kind = row[0]['relkind'] if row else None
+        report.append({
+            'table': table,
+            'tenant': tenant,
+            'storage': {'r': 'table', 'v': 'view'}.get(kind, 'missing'),
+            'mirrored': bool(row and row[0]['mirrored']),
+            'partitioned_rows': partitioned,
+        })
+    return report
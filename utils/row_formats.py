@@ -0,0 +1,129 @@
+"""
+row_formats.py — Compact row representations for large result sets.
+
+By default every row comes back as a RealDictRow, a dict carrying its own
+copy of the column-name keys - ~15 keys per message row. For bulk reads
+(/api/messages polls of up to 5000 rows, /messages/<phone_id>, exports)
+that is most of the memory and allocation cost, so DatabaseManager's
+execute_query() and iter_query() accept a row_format:
+
+    'dict'    RealDictRow per row (default; what every existing caller expects)
+    'tuple'   plain tuples in a TupleRows list whose .columns is the header
+    'record'  namedtuple records (psycopg2's NamedTupleCursor; slotted, with
+              attribute access and one cached class per column set)
+
+The writers below serialize any of the three directly, so an endpoint can
+switch format without changing its output. benchmark_row_formats.py
+measures the difference.
+"""
+
+import csv
+import io
+
+from psycopg2.extras import NamedTupleCursor, RealDictCursor
+
+# row_format -> cursor_factory (None = psycopg2's default tuple cursor)
+ROW_FORMATS = {
+    'dict': RealDictCursor,
+    'tuple': None,
+    'record': NamedTupleCursor,
+}
+
+
+class TupleRows(list):
+    """A list of plain row tuples plus the column header they share."""
+
+    def __init__(self, rows=(), columns=()):
+        super().__init__(rows)
+        self.columns = tuple(columns)
+
+
+def cursor_factory(row_format):
+    """The psycopg2 cursor_factory for `row_format` (raises ValueError if unknown)."""
+    try:
+        return ROW_FORMATS[row_format]
+    except KeyError:
+        raise ValueError(f"Unknown row_format {row_format!r}; expected one of {sorted(ROW_FORMATS)}")
+
+
+def wrap_rows(rows, row_format, description):
+    """Attach the header to tuple results; other formats pass through."""
+    if row_format == 'tuple' and rows is not None:
+        return TupleRows(rows, (col[0] for col in description))
+    return rows
+
+
+def columns_of(rows):
+    """Column names of a non-empty chunk in any row format."""
+    if isinstance(rows, TupleRows):
+        return rows.columns
+    first = rows[0]
+    if hasattr(first, '_fields'):
+        return first._fields
+    return tuple(first.keys())
+
+
+def as_mappings(rows):
+    """Yield each row as a mapping (for JSON objects), whatever its format."""
+    if isinstance(rows, TupleRows):
+        columns = rows.columns
+        for row in rows:
+            yield dict(zip(columns, row))
+    elif rows and hasattr(rows[0], '_asdict'):
+        for row in rows:
+            yield row._asdict()
+    else:
+        yield from rows
+
+
+def iter_json_array(chunks, dumps):
+    """
+    Serialize chunks of rows (any format) as one JSON array of objects,
+    yielded piece by piece. `dumps` encodes one row mapping (pass Flask's
+    json.dumps so dates render exactly as jsonify would).
+    """
+    separator = "["
+    for chunk in chunks:
+        for row in as_mappings(chunk):
+            yield separator + dumps(row)
+            separator = ","
+    yield "[]" if separator == "[" else "]"
+
+
+def iter_ndjson(chunks, dumps):
+    """
+    Serialize chunks of rows (any format) as newline-delimited JSON - one
+    object per line, one text block per chunk. `dumps` encodes one row
+    mapping, as for iter_json_array().
+    """
+    for chunk in chunks:
+        if chunk:
+            yield "".join(dumps(row) + "\n" for row in as_mappings(chunk))
+
+
+def iter_csv(chunks, columns):
+    """
+    Serialize chunks of rows (any format) as CSV with a `columns` header,
+    one text block per chunk. Tuple and record rows whose columns already
+    match are written as-is, without building a per-row list.
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(columns)
+    columns = tuple(columns)
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if isinstance(chunk[0], tuple):
+            chunk_columns = tuple(columns_of(chunk))
+            if chunk_columns == columns:
+                writer.writerows(chunk)
+            else:
+                index = [chunk_columns.index(c) for c in columns]
+                writer.writerows([row[i] for i in index] for row in chunk)
+        else:
+            writer.writerows([row.get(c) for c in columns] for row in chunk)
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate(0)
+    yield output.getvalue()
@@ -0,0 +1,248 @@
+"""
+slow_queries.py — Slow-statement log with sampled EXPLAIN capture.
+
+The /metrics histograms say *that* a statement label got slow; they can't
+say which query text, which parameters or which plan did it. Every
+statement run through a DatabaseSession (and every iter_query() stream
+open) that takes longer than the threshold (DB_SLOW_QUERY_MS) is:
+
+  * logged with its normalized SQL (literals replaced by ?, whitespace
+    collapsed), its parameters redacted to type and length, its duration,
+    its metrics label and the Flask route (or thread) that ran it
+  * kept in a bounded in-memory ring buffer, served by /api/slow-queries
+
+A sample of them (DB_SLOW_QUERY_EXPLAIN_SAMPLE, and at most once per
+statement text every `explain_interval` seconds) is handed to a background
+thread that re-plans the statement on a separate, short-lived connection
+and attaches the plan to the buffered entry. The caller never waits for it.
+
+Re-running a statement must never change data, so only plain reads
+(SELECT / WITH without INSERT, UPDATE, DELETE or MERGE) get
+EXPLAIN (ANALYZE, BUFFERS); writes get a plain EXPLAIN, which plans without
+executing. Either way the EXPLAIN runs in a READ ONLY transaction with a
+statement_timeout and is rolled back. String literals in captured plans
+are redacted like the SQL.
+
+The buffer is per process, like the other stats endpoints.
+"""
+
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from flask import has_request_context, request
+
+logger = logging.getLogger(__name__)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+_EXPLAINABLE = re.compile(r"^\s*\(?\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+_READ_ONLY = re.compile(r"^\s*\(?\s*(SELECT|WITH)\b", re.IGNORECASE)
+_WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+
+MAX_SQL_LENGTH = 2000
+
+
+def normalize_sql(query):
+    """`query` with literals replaced by ? and whitespace collapsed."""
+    text = _STRING_LITERAL.sub("'?'", query)
+    text = _NUMBER_LITERAL.sub("?", text)
+    text = _WHITESPACE.sub(" ", text).strip()
+    return text if len(text) <= MAX_SQL_LENGTH else text[:MAX_SQL_LENGTH] + "..."
+
+
+def _redact(value):
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, (str, bytes, list, tuple)):
+        return f"<{type(value).__name__}:{len(value)}>"
+    return f"<{type(value).__name__}>"
+
+
+def redact_params(params):
+    """Parameter types and lengths only - never values (phone numbers, message bodies)."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: _redact(value) for key, value in params.items()}
+    return [_redact(value) for value in params]
+
+
+def caller_route():
+    """The Flask route being served (its rule, so no ids), else the thread name."""
+    if has_request_context():
+        rule = request.url_rule.rule if request.url_rule is not None else request.path
+        return f"{request.method} {rule}"
+    return f"thread:{threading.current_thread().name}"
+
+
+class SlowQueryLog:
+    """Ring buffer of slow statements, with plans captured in the background."""
+
+    def __init__(self, connect, threshold_ms=500, explain_sample=0.1, capacity=200,
+                 explain_timeout_ms=10000, explain_interval=300, available=None):
+        """
+        Args:
+            connect (callable): Opens a new connection for EXPLAIN (never a
+                pooled one - the plan capture must not take a caller's slot).
+            threshold_ms (float): Statements slower than this are recorded.
+            explain_sample (float): Fraction of recorded statements to
+                EXPLAIN (0 disables plan capture).
+            capacity (int): Entries kept; the oldest are dropped first.
+            explain_timeout_ms (int): statement_timeout for each EXPLAIN.
+            explain_interval (float): Minimum seconds between two EXPLAINs
+                of the same normalized statement.
+            available (callable): Optional; EXPLAIN is skipped while it
+                returns False (e.g. the circuit breaker is open).
+        """
+        self.connect = connect
+        self.threshold = threshold_ms / 1000.0
+        self.explain_sample = explain_sample
+        self.explain_timeout_ms = int(explain_timeout_ms)
+        self.explain_interval = explain_interval
+        self.available = available
+        self._entries = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._explain_queue = queue.Queue(maxsize=16)
+        self._last_explained = {}
+        self._next_id = 1
+        self._started_pid = None
+        self._counters = {
+            "recorded": 0,
+            "explained": 0,
+            "explain_failed": 0,
+            "explains_dropped": 0,
+        }
+
+    def observe(self, query, params, seconds, label, rows=None):
+        """Record the statement if it took longer than the threshold."""
+        if seconds < self.threshold:
+            return
+        try:
+            self._record(query, params, seconds, label, rows)
+        except Exception as e:
+            # Diagnostics must never fail the caller's query.
+            logger.error(f"❌ Could not record slow query {label}: {e}")
+
+    def _record(self, query, params, seconds, label, rows):
+        sql = normalize_sql(query)
+        entry = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "label": label,
+            "route": caller_route(),
+            "duration_ms": round(seconds * 1000, 1),
+            "rows": rows,
+            "sql": sql,
+            "params": redact_params(params),
+            "plan": None,
+            "plan_status": "not_sampled",
+        }
+        with self._lock:
+            entry["id"] = self._next_id
+            self._next_id += 1
+            self._entries.append(entry)
+            self._counters["recorded"] += 1
+            sampled = self._should_explain(sql, query)
+        logger.warning(
+            f"Slow query {label} took {entry['duration_ms']:.0f}ms ({entry['route']}): {sql} "
+            f"params={entry['params']}"
+        )
+        if sampled:
+            self._enqueue_explain(entry, query, params)
+
+    def _should_explain(self, sql, query):
+        """Called with the lock held."""
+        if self.explain_sample <= 0 or not _EXPLAINABLE.match(query):
+            return False
+        if random.random() >= self.explain_sample:
+            return False
+        now = time.monotonic()
+        if now - self._last_explained.get(sql, float('-inf')) < self.explain_interval:
+            return False
+        if len(self._last_explained) > 1000:
+            self._last_explained.clear()
+        self._last_explained[sql] = now
+        return True
+
+    def _enqueue_explain(self, entry, query, params):
+        if self.available is not None and not self.available():
+            return
+        self.ensure_started()
+        with self._lock:
+            entry["plan_status"] = "pending"
+        try:
+            self._explain_queue.put_nowait((entry, query, params))
+        except queue.Full:
+            with self._lock:
+                entry["plan_status"] = "dropped"
+                self._counters["explains_dropped"] += 1
+
+    def _explain(self, query, params):
+        analyze = bool(_READ_ONLY.match(query)) and not _WRITES.search(query)
+        options = "ANALYZE, BUFFERS" if analyze else "COSTS"
+        conn = self.connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SET TRANSACTION READ ONLY")
+                cursor.execute(f"SET LOCAL statement_timeout = {self.explain_timeout_ms}")
+                cursor.execute(f"EXPLAIN ({options}) {query}", params)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+            return _STRING_LITERAL.sub("'?'", plan), analyze
+        finally:
+            try:
+                conn.rollback()
+            finally:
+                conn.close()
+
+    def _explain_loop(self):
+        while True:
+            entry, query, params = self._explain_queue.get()
+            try:
+                plan, analyzed = self._explain(query, params)
+                with self._lock:
+                    entry["plan"] = plan
+                    entry["plan_status"] = "analyzed" if analyzed else "planned"
+                    self._counters["explained"] += 1
+            except Exception as e:
+                with self._lock:
+                    entry["plan_status"] = "failed"
+                    entry["plan"] = f"{type(e).__name__}: {str(e).strip()[:500]}"
+                    self._counters["explain_failed"] += 1
+                logger.warning(f"EXPLAIN of slow query {entry['label']} failed: {e}")
+
+    def ensure_started(self):
+        """Start the EXPLAIN thread for this process (again after a fork)."""
+        pid = os.getpid()
+        if self._started_pid == pid:
+            return
+        with self._lock:
+            if self._started_pid == pid:
+                return
+            threading.Thread(target=self._explain_loop, name="slow-query-explain", daemon=True).start()
+            self._started_pid = pid
+
+    def entries(self, limit=None, label=None):
+        """Buffered entries, newest first, optionally for one statement label."""
+        with self._lock:
+            entries = [dict(e) for e in reversed(self._entries) if label is None or e["label"] == label]
+        return entries[:limit] if limit else entries
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["buffered"] = len(self._entries)
+        stats["threshold_ms"] = round(self.threshold * 1000, 1)
+        stats["explain_sample"] = self.explain_sample
+        stats["explain_queue"] = self._explain_queue.qsize()
+        return stats
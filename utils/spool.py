@@ -0,0 +1,240 @@
+"""
+spool.py — Local spool-and-replay for webhooks Postgres couldn't accept.
+
+When Neon is waking up or briefly unreachable, DatabaseManager gives up
+after its retries and the webhook batch can't be written. Rather than
+returning 500 and relying on Meta's redelivery schedule, the raw payload is
+appended to a local SQLite journal and the webhook is acknowledged.
+
+A single replayer thread drains the journal strictly in arrival order once
+the database accepts writes again: it replays the oldest entry, deletes it
+only after it commits, and stops (backing off) at the first failure so a
+later payload can never overtake an earlier one. Replay goes through the
+normal process_whatsapp_message path, whose INSERT ... ON CONFLICT (id)
+DO NOTHING makes it idempotent on message id - replaying an entry twice
+(e.g. a crash between commit and delete) writes nothing new and sends no
+second AI reply.
+
+Spool size, the age of the oldest entry and the lag of the last replay are
+kept for monitoring (see stats()).
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookSpool:
+    """An append-only, ordered journal of webhook payloads awaiting the database."""
+
+    def __init__(self, path, replay, max_attempts=50, idle_interval=5, max_backoff=60, lease_seconds=120):
+        """
+        Args:
+            path (str): SQLite file to journal payloads in (created if missing).
+            replay (callable): Called with a payload; a falsy return value or
+                an exception means the database still isn't accepting it.
+            max_attempts (int): Replays of one entry before it is parked in
+                dead_entries so it can't block the rest of the spool forever.
+            idle_interval (float): Sleep between checks when the spool is empty.
+            max_backoff (float): Upper bound on the wait after a failed replay.
+            lease_seconds (float): How long the replayer lease outlives its
+                holder - must exceed the slowest single replay.
+        """
+        self.path = path
+        self.replay = replay
+        self.max_attempts = max_attempts
+        self.idle_interval = idle_interval
+        self.max_backoff = max_backoff
+        self.lease_seconds = lease_seconds
+        self._wakeup = threading.Event()
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+        self._replayed_total = 0
+        self._last_replay_lag = None
+        self._last_replay_at = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    payload TEXT NOT NULL,
+                    spooled_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS replayer_lease (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    owner TEXT NOT NULL,
+                    lease_until REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS dead_entries (
+                    seq INTEGER PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    spooled_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    last_error TEXT,
+                    died_at REAL NOT NULL
+                )
+            """)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def append(self, payload, error=None):
+        """Durably journal `payload` for later replay. Returns its sequence number."""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "INSERT INTO entries (payload, spooled_at, last_error) VALUES (?, ?, ?)",
+                (json.dumps(payload, default=str), time.time(), error)
+            )
+            seq = cursor.lastrowid
+        finally:
+            conn.close()
+        logger.warning(f"⚠️ Database unavailable, webhook spooled locally as #{seq}: {error}")
+        self.ensure_started()
+        return seq
+
+    def _acquire_lease(self, conn):
+        """
+        Take (or renew) the cross-process replayer lease. Only the holder
+        drains the spool, so gunicorn workers sharing one spool file can't
+        replay entries out of order. The write lock is held only for this
+        short claim, never while a replay talks to Postgres, so append()
+        on the webhook path is never stuck behind a slow replay.
+        """
+        now = time.time()
+        me = f"{os.getpid()}:{threading.get_ident()}"
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT owner, lease_until FROM replayer_lease WHERE id = 1").fetchone()
+            if row and row[0] != me and row[1] > now:
+                conn.execute("COMMIT")
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO replayer_lease (id, owner, lease_until) VALUES (1, ?, ?)",
+                (me, now + self.lease_seconds)
+            )
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _replay_head(self, conn):
+        """
+        Replay the oldest entry. Returns True if it was replayed (or parked),
+        False if the spool is empty, another process holds the replayer
+        lease, or the database is still refusing the entry.
+        """
+        row = conn.execute(
+            "SELECT seq, payload, spooled_at, attempts FROM entries ORDER BY seq LIMIT 1"
+        ).fetchone()
+        if row is None or not self._acquire_lease(conn):
+            return False
+        seq, payload, spooled_at, attempts = row
+
+        try:
+            ok = bool(self.replay(json.loads(payload)))
+            error = None if ok else "replay returned no result"
+        except Exception as e:
+            ok, error = False, str(e)
+
+        if ok:
+            conn.execute("DELETE FROM entries WHERE seq = ?", (seq,))
+            now = time.time()
+            self._replayed_total += 1
+            self._last_replay_lag = now - spooled_at
+            self._last_replay_at = now
+            logger.info(f"✅ Replayed spooled webhook #{seq} (lag {self._last_replay_lag:.1f}s)")
+            return True
+
+        attempts += 1
+        if attempts >= self.max_attempts:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("""
+                INSERT OR REPLACE INTO dead_entries (seq, payload, spooled_at, attempts, last_error, died_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (seq, payload, spooled_at, attempts, error, time.time()))
+            conn.execute("DELETE FROM entries WHERE seq = ?", (seq,))
+            conn.execute("COMMIT")
+            logger.error(f"❌ Spooled webhook #{seq} parked after {attempts} failed replays: {error}")
+            return True
+
+        conn.execute("UPDATE entries SET attempts = ?, last_error = ? WHERE seq = ?", (attempts, error, seq))
+        logger.warning(f"Replay of spooled webhook #{seq} failed (attempt {attempts}), will retry: {error}")
+        return False
+
+    def _replayer_loop(self):
+        conn = self._connect()
+        backoff = 1
+        while True:
+            try:
+                if self._replay_head(conn):
+                    backoff = 1
+                    continue
+                if self.size() == 0:
+                    self._wakeup.wait(self.idle_interval)
+                    self._wakeup.clear()
+                else:
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+            except Exception as e:
+                logger.error(f"❌ Webhook spool replayer error: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def ensure_started(self):
+        """Start the replayer thread for this process (again after a fork)."""
+        pid = os.getpid()
+        if self._started_pid == pid:
+            return
+        with self._start_lock:
+            if self._started_pid == pid:
+                return
+            threading.Thread(target=self._replayer_loop, name="webhook-spool-replayer", daemon=True).start()
+            self._started_pid = pid
+            logger.info(f"Webhook spool replayer started on {self.path}")
+
+    def size(self):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        finally:
+            conn.close()
+
+    def stats(self):
+        """Spool size, oldest entry age (current replay lag) and last replay lag."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            size, oldest = conn.execute("SELECT COUNT(*), MIN(spooled_at) FROM entries").fetchone()
+            dead = conn.execute("SELECT COUNT(*) FROM dead_entries").fetchone()[0]
+        finally:
+            conn.close()
+        return {
+            "size": size,
+            "dead": dead,
+            "oldest_age_seconds": round(now - oldest, 3) if oldest else 0,
+            "last_replay_lag_seconds": round(self._last_replay_lag, 3) if self._last_replay_lag is not None else None,
+            "last_replay_at": self._last_replay_at,
+            "replayed_total": self._replayed_total,
+        }
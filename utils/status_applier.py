@@ -0,0 +1,148 @@
+"""
+status_applier.py — Coalesced, order-protected delivery status writes.
+
+During a card broadcast Meta sends a sent, delivered and read callback for
+every recipient, in bursts and not always in order. Applied one by one that
+is three UPDATEs (and three connections) per message.
+
+StatusApplier buffers status events for a short window, keeps only the
+furthest-along status per message id, and writes each table's buffer with a
+single UPDATE ... FROM (VALUES ...) whose WHERE clause only allows forward
+transitions (sent < delivered < read, failed terminal - see STATUS_RANK in
+db_manager). Callers block until the flush containing their events has
+committed, so an acknowledged webhook still means a durable write.
+
+Counters (events in, rows written, statements, DB time) are kept so the
+saving is visible - see stats().
+"""
+
+import logging
+import os
+import threading
+import time
+
+from utils.db_manager import merge_status_update
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingFlush:
+    """One flush window's buffer plus the callers waiting on it."""
+
+    def __init__(self):
+        self.updates_by_table = {}
+        self.event_count = 0
+        self.done = threading.Event()
+        self.error = None
+
+
+class StatusApplier:
+    """Buffers status updates for `window_ms` and applies them set-based."""
+
+    def __init__(self, db_manager, window_ms=100, max_batch=1000):
+        """
+        Args:
+            db_manager: DatabaseManager used for the flush transaction.
+            window_ms (int): How long to gather events before flushing.
+            max_batch (int): Flush early once this many events are buffered.
+        """
+        self.db_manager = db_manager
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._current = _PendingFlush()
+        self._started_pid = None
+        self._counters = {
+            "events_received": 0,
+            "rows_submitted": 0,
+            "statements": 0,
+            "flushes": 0,
+            "db_seconds": 0.0,
+        }
+
+    def apply(self, statuses_by_table):
+        """
+        Queue `statuses_by_table` ({table_name: [update, ...]}) for the next
+        flush and wait for it to commit. Re-raises the flush's database
+        error, if any, so callers can spool/retry exactly as before.
+        """
+        if not statuses_by_table:
+            return
+        self.ensure_started()
+        with self._lock:
+            pending = self._current
+            for table, updates in statuses_by_table.items():
+                table_updates = pending.updates_by_table.setdefault(table, {})
+                for u in updates:
+                    table_updates[u['id']] = merge_status_update(table_updates.get(u['id']), u)
+                    pending.event_count += 1
+                    self._counters["events_received"] += 1
+            full = pending.event_count >= self.max_batch
+        self._wakeup.set()
+        if full:
+            self._flush_now()
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+
+    def _swap(self):
+        with self._lock:
+            pending = self._current
+            self._current = _PendingFlush()
+        return pending
+
+    def _flush_now(self):
+        pending = self._swap()
+        if pending.event_count:
+            self._flush(pending)
+
+    def _flush(self, pending):
+        statuses_by_table = {table: list(updates.values()) for table, updates in pending.updates_by_table.items()}
+        statements = [updates for updates in statuses_by_table.values() if updates]
+        started = time.monotonic()
+        try:
+            # Through write_webhook_batch so the chat-list summaries of the
+            # affected conversations are refreshed in the same transaction.
+            self.db_manager.write_webhook_batch({}, statuses_by_table, label='status_applier')
+        except Exception as e:
+            logger.error(f"❌ Status flush failed ({pending.event_count} event(s)): {e}")
+            pending.error = e
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._counters["flushes"] += 1
+                self._counters["statements"] += len(statements)
+                self._counters["rows_submitted"] += sum(len(u) for u in pending.updates_by_table.values())
+                self._counters["db_seconds"] += elapsed
+            pending.done.set()
+        logger.debug(f"Applied {pending.event_count} status event(s) in {len(statements)} statement(s), {elapsed * 1000:.1f}ms")
+
+    def _flusher_loop(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # Let the window fill up, then flush whatever arrived.
+            time.sleep(self.window)
+            try:
+                self._flush_now()
+            except Exception as e:
+                logger.error(f"❌ Status applier error: {e}")
+
+    def ensure_started(self):
+        """Start the flusher thread for this process (again after a fork)."""
+        pid = os.getpid()
+        if self._started_pid == pid:
+            return
+        with self._lock:
+            if self._started_pid == pid:
+                return
+            threading.Thread(target=self._flusher_loop, name="status-applier", daemon=True).start()
+            self._started_pid = pid
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["db_seconds"] = round(stats["db_seconds"], 4)
+        stats["window_ms"] = int(self.window * 1000)
+        return stats
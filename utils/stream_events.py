@@ -0,0 +1,361 @@
+"""
+stream_events.py — Server-Sent Events push channel for the chat dashboards.
+
+Every open dashboard used to poll /api/chats and the open thread every 5-8
+seconds whether or not anything had changed, and a new message still took
+up to a poll interval to show. /api/stream now pushes what changed instead:
+
+  * message.created      {wa_id, id, direction}
+  * message.status       {wa_id, id, status}
+  * conversation.read    {wa_id}
+
+Clients react by running the incremental reads they already have (the
+/api/chats change cursor, the thread's after= poll), so an event is a hint
+to sync, not a copy of the data, and delivering one twice is harmless.
+
+The webhook path, /api/respond and the mark-read paths can run in any
+gunicorn worker (or a queue worker thread) while the stream is held open
+by another, so events go through Postgres rather than process memory: the
+write paths append them to stream_events (migration 13) in the same
+transaction as the change itself (build_insert_stream_events()), so an
+event is visible exactly when its data is. Each process then runs one
+StreamHub thread that polls stream_events every STREAM_POLL_MS while it
+has subscribers - one query per process, not per tab - and fans new events
+out to its subscribers' in-memory buffers.
+
+created_at is stamped with clock_timestamp(), the last statement before
+commit, but a transaction can still commit after a later one, so the hub
+looks EVENT_OVERLAP_SECONDS further back each poll and drops ids it has
+already published. The SSE id is the event's id: a reconnecting
+EventSource sends it back as Last-Event-ID and backlog() replays the
+tenant's events from that event's created_at (less the same overlap). If
+the event has been pruned, or the backlog or a subscriber's buffer
+overflows, the client gets a `sync` event and re-reads its lists in full.
+
+The stream is opt-in (STREAM_ENABLED in config.py, since each open stream
+holds a worker thread). While it is off, writes record no events and
+nothing is pruned. stream_events is only a short-lived log:
+prune_stream_events() (scheduled in run.py) deletes events older than the
+retention window. Bulk imports
+don't emit events; dashboards pick those up on their next full sync.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from utils.migrations import TENANTS
+
+logger = logging.getLogger(__name__)
+
+# How far before the newest event seen the hub (and a resume) look again.
+EVENT_OVERLAP_SECONDS = 5
+
+# Events one poll or one resume reads at most.
+EVENT_BATCH_LIMIT = 1000
+
+
+def stream_target(table_name):
+    """(stream_events table, tenant) for a message table such as 'public.eventio_messages'."""
+    schema, _, name = table_name.rpartition('.')
+    return f"{schema or 'public'}.stream_events", TENANTS[name]
+
+
+def created_event(message):
+    """The message.created event of a newly inserted message."""
+    return 'message.created', message['wa_id'], {'id': message['id'], 'direction': message['direction']}
+
+
+def status_event(row):
+    """The message.status event of a row returned by a status UPDATE."""
+    return 'message.status', row['wa_id'], {'id': row['id'], 'status': row['status']}
+
+
+def read_event(wa_id):
+    """The conversation.read event of a conversation marked read."""
+    return 'conversation.read', wa_id, {}
+
+
+def build_insert_stream_events(events_by_table):
+    """
+    Statements appending events to stream_events, to run in the transaction
+    that made the change.
+
+    Args:
+        events_by_table (dict): {table_name: [(type, wa_id, payload), ...]}
+            where payload is a JSON-serializable dict.
+
+    Returns:
+        list: (query, params) pairs - empty if there is nothing to record.
+    """
+    statements = []
+    for table, events in sorted(events_by_table.items()):
+        events = [event for event in events if event[1]]
+        if not events:
+            continue
+        target, tenant = stream_target(table)
+        params = []
+        for event_type, wa_id, payload in events:
+            params.extend([tenant, event_type, str(wa_id), json.dumps(payload, default=str)])
+        values_sql = ", ".join(["(%s, %s, %s, %s::jsonb, clock_timestamp())"] * len(events))
+        statements.append((
+            f"INSERT INTO {target} (tenant, type, wa_id, payload, created_at) VALUES {values_sql}",
+            tuple(params),
+        ))
+    return statements
+
+
+def prune_stream_events(db_manager, retention_seconds=3600, schema='public'):
+    """Delete events older than `retention_seconds`. Returns the number deleted."""
+    def work(session):
+        session.execute(f"""
+            DELETE FROM {schema}.stream_events
+            WHERE created_at < NOW() - make_interval(secs => %s)
+        """, (retention_seconds,))
+        return session.cursor.rowcount
+
+    deleted = db_manager.run_in_session(work, label='stream_prune')
+    logger.info(f"✅ Pruned {deleted} stream event(s)")
+    return deleted
+
+
+def format_sse(event_type, data, event_id=None):
+    """One SSE frame."""
+    frame = f"id: {event_id}\n" if event_id is not None else ""
+    return frame + f"event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def event_frame(event):
+    """The SSE frame of a stream_events row."""
+    payload = event['payload'] or {}
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    return format_sse(event['type'], {'wa_id': event['wa_id'], **payload}, event['id'])
+
+
+class Subscription:
+    """One open stream's buffer of events, filled by the hub's thread."""
+
+    def __init__(self, tenant, capacity=1000):
+        self.tenant = tenant
+        self.capacity = capacity
+        self._events = deque()
+        self._overflowed = False
+        self._ready = threading.Condition()
+
+    def push(self, event):
+        """Buffer `event`; a full buffer is dropped and the reader told to resync."""
+        with self._ready:
+            if len(self._events) >= self.capacity:
+                self._events.clear()
+                self._overflowed = True
+            self._events.append(event)
+            self._ready.notify()
+
+    def resync(self):
+        """Drop the buffer and tell the reader to resync."""
+        with self._ready:
+            self._events.clear()
+            self._overflowed = True
+            self._ready.notify()
+
+    def take(self, timeout):
+        """
+        Wait up to `timeout` seconds for events.
+
+        Returns:
+            tuple: (overflowed, events) - overflowed is True if events were
+            dropped since the last take().
+        """
+        with self._ready:
+            if not self._events and not self._overflowed:
+                self._ready.wait(timeout)
+            events, overflowed = list(self._events), self._overflowed
+            self._events.clear()
+            self._overflowed = False
+        return overflowed, events
+
+
+class StreamHub:
+    """Per-process fan-out of stream_events to open /api/stream connections."""
+
+    def __init__(self, db_manager, poll_interval=1.0, subscriber_capacity=1000, schema='public'):
+        """
+        Args:
+            db_manager: DatabaseManager to poll through.
+            poll_interval (float): Seconds between polls while anyone is
+                subscribed.
+            subscriber_capacity (int): Events buffered per subscriber before
+                it is told to resync.
+            schema (str): Schema of the stream_events table.
+        """
+        self.db_manager = db_manager
+        self.poll_interval = poll_interval
+        self.subscriber_capacity = subscriber_capacity
+        self.table = f"{schema}.stream_events"
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._watermark = None
+        self._seen = {}
+        self._started_pid = None
+        self._counters = {
+            "polls": 0,
+            "poll_errors": 0,
+            "published": 0,
+            "delivered": 0,
+        }
+
+    def subscribe(self, tenant):
+        """A new Subscription to `tenant`'s events; unsubscribe() it when done."""
+        self.ensure_started()
+        subscription = Subscription(tenant, self.subscriber_capacity)
+        with self._lock:
+            self._subscribers.add(subscription)
+        self._wake.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def backlog(self, tenant, last_event_id):
+        """
+        `tenant`'s events from `last_event_id` on (looking
+        EVENT_OVERLAP_SECONDS further back), oldest first - or None if they
+        can't all be replayed and the client must resync.
+        """
+        def work(session):
+            rows = session.execute(f"SELECT created_at FROM {self.table} WHERE id = %s", (last_event_id,))
+            if not rows:
+                return None
+            events = session.execute(f"""
+                SELECT id, type, wa_id, payload FROM {self.table}
+                WHERE tenant = %s AND id <> %s
+                  AND created_at > %s - INTERVAL '{EVENT_OVERLAP_SECONDS} seconds'
+                ORDER BY created_at, id
+                LIMIT %s
+            """, (tenant, last_event_id, rows[0]['created_at'], EVENT_BATCH_LIMIT + 1))
+            return None if len(events) > EVENT_BATCH_LIMIT else events
+
+        return self.db_manager.run_in_session(work, label='stream_backlog')
+
+    def _poll(self, tenants):
+        """Publish the events committed since the last poll."""
+        if self._watermark is None:
+            rows = self.db_manager.execute_query("SELECT clock_timestamp() AS now", fetch=True, label='stream_poll')
+            self._watermark = rows[0]['now']
+            self._seen = {}
+            return
+        events = self.db_manager.execute_query(f"""
+            SELECT id, tenant, type, wa_id, payload, created_at FROM {self.table}
+            WHERE tenant = ANY(%s) AND created_at > %s - INTERVAL '{EVENT_OVERLAP_SECONDS} seconds'
+            ORDER BY created_at, id
+            LIMIT %s
+        """, (sorted(tenants), self._watermark, EVENT_BATCH_LIMIT), fetch=True, label='stream_poll')
+        if len(events) >= EVENT_BATCH_LIMIT:
+            # More than a poll can carry: everyone resyncs and the hub
+            # starts again from "now".
+            logger.warning(f"Stream events backed up past {EVENT_BATCH_LIMIT}; resyncing subscribers")
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for subscription in subscribers:
+                subscription.resync()
+            self._watermark = None
+            return
+        fresh = [event for event in events if event['id'] not in self._seen]
+        for event in events:
+            self._seen[event['id']] = event['created_at']
+            if event['created_at'] > self._watermark:
+                self._watermark = event['created_at']
+        horizon = self._watermark.timestamp() - EVENT_OVERLAP_SECONDS
+        self._seen = {event_id: at for event_id, at in self._seen.items() if at.timestamp() > horizon}
+        if fresh:
+            self._publish(fresh)
+
+    def _publish(self, events):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self._counters["published"] += len(events)
+        delivered = 0
+        for event in events:
+            for subscription in subscribers:
+                if subscription.tenant == event['tenant']:
+                    subscription.push(event)
+                    delivered += 1
+        with self._lock:
+            self._counters["delivered"] += delivered
+
+    def _poll_loop(self):
+        while True:
+            with self._lock:
+                tenants = {subscription.tenant for subscription in self._subscribers}
+            if not tenants:
+                # Nobody to push to: stop polling, and start again from
+                # "now" - a new subscriber catches up through backlog().
+                self._watermark = None
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            started = time.monotonic()
+            try:
+                self._poll(tenants)
+                with self._lock:
+                    self._counters["polls"] += 1
+            except Exception as e:
+                with self._lock:
+                    self._counters["poll_errors"] += 1
+                logger.warning(f"Stream event poll failed: {e}")
+            time.sleep(max(0.0, self.poll_interval - (time.monotonic() - started)))
+
+    def ensure_started(self):
+        """Start the poll thread for this process (again after a fork)."""
+        pid = os.getpid()
+        if self._started_pid == pid:
+            return
+        with self._lock:
+            if self._started_pid == pid:
+                return
+            threading.Thread(target=self._poll_loop, name="stream-hub", daemon=True).start()
+            self._started_pid = pid
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["subscribers"] = len(self._subscribers)
+        stats["poll_interval_ms"] = round(self.poll_interval * 1000)
+        return stats
+
+
+def iter_stream(hub, subscription, backlog, heartbeat_seconds=15, max_seconds=300, retry_ms=3000):
+    """
+    SSE frames for one connection: the backlog (or a `sync` if it couldn't
+    be replayed), then live events, with a comment every
+    `heartbeat_seconds` so proxies keep the connection open. The stream
+    ends after `max_seconds` - the browser reconnects with Last-Event-ID -
+    so a connection never holds its worker indefinitely.
+    """
+    try:
+        yield f"retry: {retry_ms}\n\n"
+        if backlog is None:
+            yield format_sse('sync', {})
+        else:
+            for event in backlog:
+                yield event_frame(event)
+        deadline = time.monotonic() + max_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            overflowed, events = subscription.take(min(heartbeat_seconds, remaining))
+            if overflowed:
+                yield format_sse('sync', {})
+            if not events and not overflowed:
+                yield ": keepalive\n\n"
+            for event in events:
+                yield event_frame(event)
+    finally:
+        hub.unsubscribe(subscription)
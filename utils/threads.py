@@ -0,0 +1,103 @@
+"""
+threads.py — Keyset pages of one conversation's messages.
+
+/api/chats/<wa_id> used to SELECT a contact's entire history on every
+open of the chat and again on every poll of an open chat. A thread is now
+read in pages keyed on (timestamp, id) (see utils/keyset.py), always
+returned oldest first for rendering:
+
+  * no cursor: the newest `limit` messages
+  * before=<cursor>: the `limit` messages just older than the cursor, for
+    scroll-up history
+  * after=<cursor>: up to `limit` messages newer than the cursor - a poll,
+    which costs O(new messages) however long the thread is
+
+Each is a range scan of idx_<table>_wa_id_timestamp; id only breaks ties
+between messages with the same timestamp. Messages without a timestamp
+have no place in the timeline and are left out.
+
+A poll also needs the status changes (sent -> delivered -> read) of
+messages the client already shows. thread_updates_query() returns those
+among the newest `window` messages up to the client's cursor whose
+updated_at is past the client's watermark - bounded by the window, not the
+history; ticks on older messages catch up when the chat is reopened.
+updated_at is NOW() of the updating transaction, which can commit after a
+later one, so it looks UPDATE_OVERLAP_SECONDS further back; clients replace
+messages by id, so the overlap only ever re-sends rows.
+"""
+
+from datetime import datetime
+
+from utils.keyset import decode_cursor, encode_cursor
+
+# How far before a client's watermark thread_updates_query() looks again.
+UPDATE_OVERLAP_SECONDS = 5
+
+
+def encode_message_cursor(message):
+    """Opaque cursor at `message`, a row of a thread page."""
+    return encode_cursor(message['timestamp'], message['id'])
+
+
+def decode_message_cursor(token):
+    """
+    (timestamp, id) from an encode_message_cursor() token.
+
+    Raises:
+        ValueError: if the token is malformed.
+    """
+    timestamp, message_id = decode_cursor(token, datetime, str)
+    if timestamp is None:
+        raise ValueError("invalid cursor: no timestamp")
+    return timestamp, message_id
+
+
+def thread_page_query(table_name, wa_id, limit, before=None, after=None):
+    """
+    (query, params) for one page of a conversation, oldest first.
+
+    Args:
+        table_name (str): The business's message table.
+        wa_id (str): The contact.
+        limit (int): Page size.
+        before (tuple): Optional (timestamp, id); the page just older than it.
+        after (tuple): Optional (timestamp, id); the messages newer than it,
+            oldest first (the rest follow in the next poll).
+    """
+    if after is not None:
+        return f"""
+            SELECT * FROM {table_name}
+            WHERE wa_id = %s AND (timestamp, id) > (%s, %s)
+            ORDER BY timestamp ASC, id ASC
+            LIMIT %s
+        """, (wa_id, *after, limit)
+    keyset, keyset_params = "", ()
+    if before is not None:
+        keyset, keyset_params = " AND (timestamp, id) < (%s, %s)", tuple(before)
+    return f"""
+        SELECT * FROM (
+            SELECT * FROM {table_name}
+            WHERE wa_id = %s AND timestamp IS NOT NULL{keyset}
+            ORDER BY timestamp DESC, id DESC
+            LIMIT %s
+        ) page
+        ORDER BY timestamp ASC, id ASC
+    """, (wa_id, *keyset_params, limit)
+
+
+def thread_updates_query(table_name, wa_id, upto, updated_since, window):
+    """
+    (query, params) for the messages among the newest `window` up to and
+    including `upto` (timestamp, id) that were updated after
+    `updated_since`, oldest first.
+    """
+    return f"""
+        SELECT * FROM (
+            SELECT * FROM {table_name}
+            WHERE wa_id = %s AND (timestamp, id) <= (%s, %s)
+            ORDER BY timestamp DESC, id DESC
+            LIMIT %s
+        ) recent
+        WHERE updated_at > %s - INTERVAL '{UPDATE_OVERLAP_SECONDS} seconds'
+        ORDER BY timestamp ASC, id ASC
+    """, (wa_id, *upto, window, updated_since)
@@ -0,0 +1,215 @@
+"""
+webhook_queue.py — Durable local queue for acknowledging webhooks immediately.
+
+In "queue" ingest mode (WEBHOOK_INGEST_MODE=queue) the /webhook route only
+appends the raw payload to a SQLite file and returns 200, so a Neon cold
+start or a slow Graph API call can no longer push us past Meta's timeout
+and trigger a redelivery. A small pool of background worker threads then
+runs the normal process_whatsapp_message logic against each payload.
+
+Jobs are leased, not popped: a worker claims a job by stamping leased_until,
+and only deletes it once the handler succeeds. If the process crashes (or
+gunicorn recycles the worker) mid-job the lease simply expires and another
+worker picks it up again, so nothing acknowledged to Meta is ever lost.
+Jobs that keep failing are retried with backoff and, after max_attempts,
+moved to a dead_jobs table for manual inspection instead of looping forever.
+
+SQLite's own file locking makes it safe for several gunicorn workers to
+share one queue file.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookQueue:
+    """A crash-safe, file-backed FIFO of webhook payloads with a worker pool."""
+
+    def __init__(self, path, handler, workers=2, lease_seconds=300, max_attempts=8, poll_interval=0.5):
+        """
+        Args:
+            path (str): SQLite file to store jobs in (created if missing).
+            handler (callable): Called with the decoded payload; a falsy
+                return value or an exception means "retry later".
+            workers (int): Number of background worker threads per process.
+            lease_seconds (int): How long a claimed job stays invisible to
+                other workers before it is considered abandoned.
+            max_attempts (int): Attempts before a job is dead-lettered.
+            poll_interval (float): Idle sleep between claims when empty.
+        """
+        self.path = path
+        self.handler = handler
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    payload TEXT NOT NULL,
+                    enqueued_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL,
+                    last_error TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_available_at ON jobs(available_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS dead_jobs (
+                    id INTEGER PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    enqueued_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    last_error TEXT,
+                    died_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        # isolation_level=None -> we issue BEGIN IMMEDIATE ourselves so the
+        # claim's SELECT + UPDATE can't race another process's claim.
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def enqueue(self, payload):
+        """Durably append `payload` (a JSON-serialisable dict). Returns the job id."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "INSERT INTO jobs (payload, enqueued_at, available_at) VALUES (?, ?, ?)",
+                (json.dumps(payload), now, now)
+            )
+            job_id = cursor.lastrowid
+        finally:
+            conn.close()
+        self.ensure_started()
+        self._wakeup.set()
+        return job_id
+
+    def _claim(self, conn):
+        """Lease the oldest available job. Returns (id, payload, attempts) or None."""
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, payload, attempts FROM jobs WHERE available_at <= ? ORDER BY id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET attempts = attempts + 1, available_at = ? WHERE id = ?",
+                (now + self.lease_seconds, row[0])
+            )
+            conn.execute("COMMIT")
+            return row[0], row[1], row[2] + 1
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _ack(self, conn, job_id):
+        conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def _retry_later(self, conn, job_id, attempts, error):
+        if attempts >= self.max_attempts:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("""
+                INSERT OR REPLACE INTO dead_jobs (id, payload, enqueued_at, attempts, last_error, died_at)
+                SELECT id, payload, enqueued_at, attempts, ?, ? FROM jobs WHERE id = ?
+            """, (error, time.time(), job_id))
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            conn.execute("COMMIT")
+            logger.error(f"❌ Webhook job {job_id} dead-lettered after {attempts} attempts: {error}")
+            return
+        # Exponential backoff capped at 5 minutes: 2s, 4s, 8s, ...
+        delay = min(2 ** attempts, 300)
+        conn.execute(
+            "UPDATE jobs SET available_at = ?, last_error = ? WHERE id = ?",
+            (time.time() + delay, error, job_id)
+        )
+        logger.warning(f"Webhook job {job_id} failed (attempt {attempts}/{self.max_attempts}), retrying in {delay}s: {error}")
+
+    def _worker_loop(self):
+        conn = self._connect()
+        while True:
+            try:
+                job = self._claim(conn)
+                if job is None:
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+                    continue
+
+                job_id, payload, attempts = job
+                try:
+                    result = self.handler(json.loads(payload))
+                    error = None if result else "handler returned no result"
+                except Exception as e:
+                    error = str(e)
+
+                if error is None:
+                    self._ack(conn, job_id)
+                else:
+                    self._retry_later(conn, job_id, attempts, error)
+            except Exception as e:
+                logger.error(f"❌ Webhook queue worker error: {e}")
+                time.sleep(self.poll_interval)
+
+    def ensure_started(self):
+        """
+        Start the worker threads for this process if not already running.
+        Tracks the pid so a gunicorn worker forked from a parent that had
+        already started the pool gets its own threads (threads don't
+        survive fork).
+        """
+        pid = os.getpid()
+        if self._started_pid == pid:
+            return
+        with self._start_lock:
+            if self._started_pid == pid:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f"webhook-queue-{i}", daemon=True)
+                thread.start()
+            self._started_pid = pid
+            logger.info(f"Webhook queue started: {self.workers} worker(s) on {self.path}")
+
+    def stats(self):
+        """Queue depth for monitoring: pending, in-flight (leased), dead-lettered, oldest age."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            pending, inflight, oldest = conn.execute("""
+                SELECT
+                    COALESCE(SUM(CASE WHEN available_at <= ? THEN 1 ELSE 0 END), 0),
+                    COALESCE(SUM(CASE WHEN available_at > ? THEN 1 ELSE 0 END), 0),
+                    MIN(enqueued_at)
+                FROM jobs
+            """, (now, now)).fetchone()
+            dead = conn.execute("SELECT COUNT(*) FROM dead_jobs").fetchone()[0]
+        finally:
+            conn.close()
+        return {
+            "pending": pending,
+            "in_flight_or_backoff": inflight,
+            "dead": dead,
+            "oldest_age_seconds": round(now - oldest, 3) if oldest else 0,
+            "workers": self.workers,
+        }
@@ -1,6 +1,8 @@
 import logging
 import os
+import psycopg2
 import requests
+import time
 from datetime import datetime
 from config import (
     EVENTIO_ACCESS_TOKEN, ACCOUNT1_PHONE_ID_EVENTIO,
@@ -8,6 +10,9 @@ from config import (
     ACCOUNT2_ACCESS_TOKEN, ACCOUNT2_PHONE_ID, VERSION
 )
 from utils.ai_responder import get_ai_response
+from utils.db_manager import merge_status_update
+from utils.db_resilience import DatabaseUnavailable, is_transient
+from utils.metrics import GRAPH_API_SECONDS
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s: %(message)s')
@@ -29,6 +34,9 @@ PHONE_ID_TO_TOKEN = {
     ACCOUNT2_PHONE_ID: ACCOUNT2_ACCESS_TOKEN
 }
 
+# Conversation history depth fed to the AI auto-reply
+AI_HISTORY_LIMIT = 20
+
 def get_table_name(phone_id):
     """
     Get the appropriate table name for a given phone ID.
@@ -61,7 +69,7 @@ def get_token_for_phone_id(phone_id):
         logger.debug(f"Selected token for phone_id {phone_id}: {token[:20]}...")
     return token
 
-def get_last_outbound_event_id(db_manager, table_name, wa_id):
+def get_last_outbound_event_id(db_manager, table_name, wa_id, session=None):
     """
     Look up the event_id of the most recent outbound message sent to this
     wa_id in this table. Used to auto-link an inbound reply to whichever
@@ -73,22 +81,34 @@ def get_last_outbound_event_id(db_manager, table_name, wa_id):
     Returns None if this wa_id has never received an outbound message with
     an event_id attached (e.g. an unsolicited message from an unknown
     number) - inbound.event_id stays NULL in that case, same as before.
+
+    Answers come from db_manager.outbound_event_cache when possible (kept
+    current by insert_message); the query only runs on a cache miss.
+
+    With a session, the lookup runs in the caller's transaction and errors
+    propagate (the transaction is aborted anyway); without one, errors are
+    logged and None is returned.
     """
-    try:
-        rows = db_manager.execute_query(
-            f"""
-            SELECT event_id FROM {table_name}
-            WHERE wa_id = %s AND direction = 'outbound' AND event_id IS NOT NULL
-            ORDER BY timestamp DESC
-            LIMIT 1
-            """,
-            (wa_id,),
-            fetch=True
-        )
-        return rows[0]['event_id'] if rows else None
-    except Exception as e:
-        logger.error(f"Error looking up last outbound event_id for {wa_id}: {e}")
-        return None
+    found, event_id = db_manager.outbound_event_cache.get(table_name, wa_id)
+    if found:
+        return event_id
+    query = f"""
+        SELECT event_id FROM {table_name}
+        WHERE wa_id = %s AND direction = 'outbound' AND event_id IS NOT NULL
+        ORDER BY timestamp DESC
+        LIMIT 1
+    """
+    if session is not None:
+        rows = session.execute(query, (wa_id,), label='last_outbound_event')
+    else:
+        try:
+            rows = db_manager.execute_query(query, (wa_id,), fetch=True, label='last_outbound_event')
+        except Exception as e:
+            logger.error(f"Error looking up last outbound event_id for {wa_id}: {e}")
+            return None
+    event_id = rows[0]['event_id'] if rows else None
+    db_manager.outbound_event_cache.set(table_name, wa_id, event_id)
+    return event_id
 
 def save_message(db_manager, message_data, phone_id):
     """
@@ -151,6 +171,21 @@ def get_image_message_input(recipient, image_url, caption=""):
         payload["image"]["caption"] = caption
     return payload
 
+def graph_api_request(operation, method, url, **kwargs):
+    """
+    Make one Graph API HTTP call via `method` (requests.get / requests.post),
+    recording its latency under `operation` with outcome 'ok', 'http_<status>'
+    or 'error' (no response: timeout, connection failure).
+    """
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        response = method(url, **kwargs)
+        outcome = 'ok' if response.ok else f"http_{response.status_code}"
+        return response
+    finally:
+        GRAPH_API_SECONDS.observe(time.perf_counter() - started, operation=operation, outcome=outcome)
+
 def send_message(data, phone_id):
     """
     Send a message via the WhatsApp API.
@@ -187,7 +222,7 @@ def send_message(data, phone_id):
         }
         
         logger.info("Making POST request to WhatsApp API...")
-        response = requests.post(url, headers=headers, json=data, timeout=30)
+        response = graph_api_request('send_message', requests.post, url, headers=headers, json=data, timeout=30)
         
         # Log response details
         logger.info(f"Response Status Code: {response.status_code}")
@@ -257,7 +292,7 @@ def download_whatsapp_image(image_id, phone_id):
     try:
         url = f"https://graph.facebook.com/{VERSION}/{image_id}"
         headers = {"Authorization": f"Bearer {get_token_for_phone_id(phone_id)}"}
-        response = requests.get(url, headers=headers)
+        response = graph_api_request('media_lookup', requests.get, url, headers=headers)
         response.raise_for_status()
         media_data = response.json()
         media_url = media_data.get('url')
@@ -266,7 +301,7 @@ def download_whatsapp_image(image_id, phone_id):
             logger.error("No media URL in response")
             return None
         
-        image_response = requests.get(media_url, headers=headers)
+        image_response = graph_api_request('media_download', requests.get, media_url, headers=headers)
         image_response.raise_for_status()
         
         uploads_dir = "static/uploads"
@@ -286,6 +321,42 @@ def download_whatsapp_image(image_id, phone_id):
         logger.error(f"Error downloading image {image_id}: {e}")
         return None
 
+def build_image_message(db_manager, message_data, contact_info, phone_id):
+    """
+    Build the inbound row for an image message (downloading the media
+    first) without saving it, so callers can batch the insert. event_id is
+    left None for the caller to resolve with get_last_outbound_event_id.
+
+    Args:
+        db_manager: DatabaseManager instance.
+        message_data (dict): Image message data from webhook.
+        contact_info (dict): Contact information.
+        phone_id (str): Phone number ID.
+
+    Returns:
+        dict: Message info ready for insert_message / write_webhook_batch.
+    """
+    image_id = message_data.get('image', {}).get('id')
+    mime_type = message_data.get('image', {}).get('mime_type')
+
+    image_url = download_whatsapp_image(image_id, phone_id)
+
+    return {
+        "id": message_data["id"],
+        "wa_id": contact_info["wa_id"],
+        "name": contact_info["name"],
+        "type": "image",
+        "body": f"📷 Image ({mime_type})" if mime_type else "📷 Image",
+        "timestamp": datetime.fromtimestamp(int(message_data["timestamp"])),
+        "direction": "inbound",
+        "status": "delivered",
+        "read": False,
+        "image_url": image_url,
+        "image_id": image_id,
+        "event_id": None,
+        "template_name": None,
+    }
+
 def process_image_message(db_manager, message_data, contact_info, phone_id):
     """
     Process incoming image message.
@@ -300,28 +371,10 @@ def process_image_message(db_manager, message_data, contact_info, phone_id):
         dict or None: Message info if successful, None if failed.
     """
     try:
-        image_id = message_data.get('image', {}).get('id')
-        mime_type = message_data.get('image', {}).get('mime_type')
-
-        image_url = download_whatsapp_image(image_id, phone_id)
-        table_name = get_table_name(phone_id)
-
-        message_info = {
-            "id": message_data["id"],
-            "wa_id": contact_info["wa_id"],
-            "name": contact_info["name"],
-            "type": "image",
-            "body": f"📷 Image ({mime_type})" if mime_type else "📷 Image",
-            "timestamp": datetime.fromtimestamp(int(message_data["timestamp"])),
-            "direction": "inbound",
-            "status": "delivered",
-            "read": False,
-            "image_url": image_url,
-            "image_id": image_id,
-            "event_id": get_last_outbound_event_id(db_manager, table_name, contact_info["wa_id"]),
-            "template_name": None,
-        }
-        
+        message_info = build_image_message(db_manager, message_data, contact_info, phone_id)
+        message_info["event_id"] = get_last_outbound_event_id(
+            db_manager, get_table_name(phone_id), contact_info["wa_id"]
+        )
         save_message(db_manager, message_info, phone_id)
         logger.info(f"Image message processed and saved: {message_info['id']}")
         return message_info
@@ -329,6 +382,26 @@ def process_image_message(db_manager, message_data, contact_info, phone_id):
         logger.error(f"Error processing image message: {e}")
         return None
 
+def iter_webhook_changes(body, default_phone_id=None):
+    """
+    Yield (phone_id, value) for every change in every entry of a webhook
+    payload. Meta batches several events into one delivery, and each change
+    carries its own metadata.phone_number_id, so changes are routed
+    individually rather than by whatever the first change says.
+
+    Args:
+        body (dict): Webhook payload.
+        default_phone_id (str): Used for a change with no metadata.
+
+    Yields:
+        tuple: (phone_id, change value dict).
+    """
+    for entry in body.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+            phone_id = (value.get("metadata") or {}).get("phone_number_id") or default_phone_id
+            yield phone_id, value
+
 def is_valid_whatsapp_message(body):
     """
     Validate the structure of a WhatsApp webhook payload.
@@ -337,170 +410,265 @@ def is_valid_whatsapp_message(body):
         body (dict): Webhook payload.
     
     Returns:
-        bool: True if valid, False otherwise.
+        bool: True if any change carries messages or statuses, False otherwise.
     """
     try:
-        value = body.get("entry", [{}])[0].get("changes", [{}])[0].get("value", {})
-        is_message = "messages" in value and len(value.get("messages", [])) > 0
-        is_status = "statuses" in value and len(value.get("statuses", [])) > 0
-        return (
-            body.get("object") == "whatsapp_business_account" and
-            (is_message or is_status)
+        if body.get("object") != "whatsapp_business_account":
+            return False
+        return any(
+            value.get("messages") or value.get("statuses")
+            for _, value in iter_webhook_changes(body)
         )
-    except (TypeError, IndexError):
+    except (TypeError, AttributeError):
         return False
 
-def process_whatsapp_message(db_manager, body, phone_id):
+def parse_status_update(status):
+    """
+    Turn one entry of a change's `statuses` array into the dict
+    update_message_statuses expects (id, status, read, error_details).
+    """
+    message_id = status.get('id')
+    new_status = status.get('status')
+    error_details = None
+
+    if new_status == 'failed':
+        errors = status.get('errors', [])
+        if errors:
+            e = errors[0]
+            error_details = (
+                f"Code: {e.get('code')} | "
+                f"Title: {e.get('title')} | "
+                f"Message: {e.get('message')} | "
+                f"Error Data: {e.get('error_data', {})}"
+            )
+            logger.error(f"❌ Meta delivery FAILED for {message_id} | {error_details}")
+        else:
+            error_details = "Meta returned failed status with no error details"
+            logger.error(f"❌ Meta delivery FAILED for {message_id} — no error details in payload")
+
+    return {
+        "id": message_id,
+        "status": new_status,
+        "read": new_status == 'read',
+        "error_details": error_details,
+    }
+
+def send_ai_reply(db_manager, message_data, phone_id, history=None):
+    """
+    Generate and send the AI auto-reply for an inbound text message that
+    has already been saved, then save the reply. Never raises - a failed
+    reply must not undo the inbound message.
+
+    `history` is the conversation context (most recent first) if the caller
+    already read it alongside the inbound insert; otherwise it is fetched.
     """
-    Process an incoming WhatsApp message or status update and save it to the database.
+    wa_id = message_data["wa_id"]
+    name = message_data["name"]
+    table_name = get_table_name(phone_id)
+    try:
+        # Last AI_HISTORY_LIMIT messages for this conversation as context (oldest first)
+        if history is None:
+            history = db_manager.get_conversation_context(table_name, wa_id, limit=AI_HISTORY_LIMIT)
+        history = list(reversed(history)) if history else []
+
+        # Pass guest name from webhook — no need to ask the user
+        ai_reply = get_ai_response(message_data["body"], history, guest_name=name)
+
+        if ai_reply:
+            payload = get_text_message_input(wa_id, ai_reply)
+            ai_result = send_message(payload, phone_id)
+
+            if ai_result and ai_result.get("messages"):
+                reply_id = ai_result["messages"][0].get("id")
+                reply_data = {
+                    "id": reply_id,
+                    "wa_id": wa_id,
+                    "name": name,
+                    "type": "text",
+                    "body": ai_reply,
+                    "timestamp": datetime.now(),
+                    "direction": "outbound",
+                    "status": "sent",
+                    "read": True,
+                    "image_url": None,
+                    "image_id": None,
+                    "event_id": None,
+                    "template_name": None,
+                }
+                save_message(db_manager, reply_data, phone_id)
+                logger.info(f"✅ AI reply sent and saved for {wa_id}")
+            else:
+                logger.error(f"❌ AI reply failed to send for {wa_id}")
+    except Exception as ai_err:
+        logger.error(f"❌ AI auto-reply error (inbound message still saved): {ai_err}")
+
+def process_whatsapp_message(db_manager, body, phone_id=None, spool=None, status_applier=None, dedup=None):
+    """
+    Process every message and status update in a WhatsApp webhook payload
+    and save them to the database as one batch.
+
+    All entries and changes are walked, each change is routed to the table
+    for its own metadata.phone_number_id, and the whole delivery is written
+    in one transaction (multi-row INSERT per table for messages, one
+    set-based UPDATE per table for statuses). AI auto-replies run after the
+    batch commits, and only for messages this call actually inserted.
+
+    If a dedup cache is given, messages and status callbacks it has already
+    seen (Meta redeliveries) are dropped before any DB work is done.
+    If a status applier is given, status updates go through it instead so
+    they coalesce with other deliveries' callbacks in one UPDATE per table.
+    If the database is unreachable (a transient error, or the circuit
+    breaker is open) and a spool is given, the raw payload is journalled
+    there for ordered replay instead of failing; any other database error
+    fails the delivery.
     
     Args:
         db_manager: DatabaseManager instance.
         body (dict): Webhook payload.
-        phone_id (str): Phone number ID to determine the table.
+        phone_id (str): Fallback phone number ID for changes with no metadata.
+        spool (WebhookSpool): Optional local spool for undeliverable batches.
+        status_applier (StatusApplier): Optional coalescing status writer.
+        dedup (RecentlySeen): Optional cache of recently processed events.
     
     Returns:
-        dict or None: Message info if successful, None if failed.
+        dict or None: Summary of saved ids if successful, None if failed.
     """
     try:
         if not is_valid_whatsapp_message(body):
             logger.error("Invalid WhatsApp webhook payload")
             return None
-        
-        change = body["entry"][0]["changes"][0]["value"]
-        table_name = get_table_name(phone_id)
-        
-        if "messages" in change:
-            messages = change.get("messages", [])
-            contacts = change.get("contacts", [])
-            
-            if not messages or not contacts:
-                logger.warning("No messages or contacts found in webhook payload")
-                return None
-            
-            message = messages[0]
-            contact = contacts[0]
-            
-            wa_id = message["from"]
-            name = contact.get("profile", {}).get("name", "Unknown Contact")
-            
-            contact_info = {
-                "wa_id": wa_id,
-                "name": name
-            }
-            
-            message_type = message.get('type')
-            
-            if message_type == "text":
-                message_body = message["text"]["body"]
-                message_data = {
-                    "id": message["id"],
-                    "wa_id": wa_id,
-                    "name": name,
-                    "type": "text",
-                    "body": message_body,
-                    "timestamp": datetime.fromtimestamp(int(message["timestamp"])),
-                    "direction": "inbound",
-                    "status": "delivered",
-                    "read": False,
-                    "image_url": None,
-                    "image_id": None,
-                    "event_id": get_last_outbound_event_id(db_manager, table_name, wa_id),
-                    "template_name": None,
-                }
-                save_message(db_manager, message_data, phone_id)
-                logger.info(f"Processed incoming text message from {wa_id}: {message_body}")
-
-                # ── AI auto-reply ──────────────────────────────────────────
-                try:
-                    # Fetch last 20 messages for this conversation as context (oldest first)
-                    history = db_manager.execute_query(
-                        f"""
-                        SELECT direction, body FROM {table_name}
-                        WHERE wa_id = %s
-                        ORDER BY timestamp DESC
-                        LIMIT 20
-                        """,
-                        (wa_id,),
-                        fetch=True
-                    )
-                    history = list(reversed(history)) if history else []
-
-                    # Pass guest name from webhook — no need to ask the user
-                    ai_reply = get_ai_response(message_body, history, guest_name=name)
-
-                    if ai_reply:
-                        payload = get_text_message_input(wa_id, ai_reply)
-                        ai_result = send_message(payload, phone_id)
-
-                        if ai_result and ai_result.get("messages"):
-                            reply_id = ai_result["messages"][0].get("id")
-                            reply_data = {
-                                "id": reply_id,
-                                "wa_id": wa_id,
-                                "name": name,
-                                "type": "text",
-                                "body": ai_reply,
-                                "timestamp": datetime.now(),
-                                "direction": "outbound",
-                                "status": "sent",
-                                "read": True,
-                                "image_url": None,
-                                "image_id": None,
-                                "event_id": None,
-                                "template_name": None,
-                            }
-                            save_message(db_manager, reply_data, phone_id)
-                            logger.info(f"✅ AI reply sent and saved for {wa_id}")
-                        else:
-                            logger.error(f"❌ AI reply failed to send for {wa_id}")
-                except Exception as ai_err:
-                    logger.error(f"❌ AI auto-reply error (inbound message still saved): {ai_err}")
-                # ── end AI auto-reply ──────────────────────────────────────
-
-                return {"status": "success", "message_id": message["id"]}
-            
-            elif message_type == "image":
-                return process_image_message(db_manager, message, contact_info, phone_id)
-            
-            else:
-                logger.debug(f"Ignoring unsupported message type: {message_type} from {wa_id}")
-                return {"status": "ignored", "message_type": message_type}
-        
-        elif "statuses" in change:
-            status = change["statuses"][0]
-            message_id = status.get('id')
-            new_status = status.get('status')
-            error_details = None
-
-            if new_status == 'failed':
-                errors = status.get('errors', [])
-                if errors:
-                    e = errors[0]
-                    error_details = (
-                        f"Code: {e.get('code')} | "
-                        f"Title: {e.get('title')} | "
-                        f"Message: {e.get('message')} | "
-                        f"Error Data: {e.get('error_data', {})}"
-                    )
-                    logger.error(f"❌ Meta delivery FAILED for {message_id} | {error_details}")
+
+        messages_by_table = {}
+        statuses_by_table = {}
+        text_messages = []  # (phone_id, message_data) for the AI auto-reply pass
+        ignored = 0
+        duplicates = 0
+
+        for change_phone_id, change in iter_webhook_changes(body, phone_id):
+            table_name = get_table_name(change_phone_id)
+            messages = change.get("messages") or []
+            contacts = change.get("contacts") or []
+
+            if messages and not contacts:
+                logger.warning("No contacts found for messages in webhook change, skipping it")
+                messages = []
+
+            names = {c.get("wa_id"): c.get("profile", {}).get("name", "Unknown Contact") for c in contacts}
+            default_name = contacts[0].get("profile", {}).get("name", "Unknown Contact") if contacts else None
+
+            for message in messages:
+                if dedup is not None and dedup.contains((table_name, message["id"])):
+                    duplicates += 1
+                    continue
+                wa_id = message["from"]
+                name = names.get(wa_id, default_name)
+                message_type = message.get('type')
+
+                if message_type == "text":
+                    message_data = {
+                        "id": message["id"],
+                        "wa_id": wa_id,
+                        "name": name,
+                        "type": "text",
+                        "body": message["text"]["body"],
+                        "timestamp": datetime.fromtimestamp(int(message["timestamp"])),
+                        "direction": "inbound",
+                        "status": "delivered",
+                        "read": False,
+                        "image_url": None,
+                        "image_id": None,
+                        "event_id": None,  # resolved in the write transaction below
+                        "template_name": None,
+                    }
+                    text_messages.append((change_phone_id, message_data))
+                elif message_type == "image":
+                    contact_info = {"wa_id": wa_id, "name": name}
+                    message_data = build_image_message(db_manager, message, contact_info, change_phone_id)
                 else:
-                    error_details = "Meta returned failed status with no error details"
-                    logger.error(f"❌ Meta delivery FAILED for {message_id} — no error details in payload")
-
-            db_manager.update_message_status(
-                table_name,
-                message_id,
-                new_status,
-                new_status == 'read',
-                error_details
+                    logger.debug(f"Ignoring unsupported message type: {message_type} from {wa_id}")
+                    ignored += 1
+                    continue
+
+                messages_by_table.setdefault(table_name, []).append(message_data)
+
+            # Several callbacks for one message can share a delivery (and
+            # arrive out of order); keep only the furthest-along one.
+            for status in change.get("statuses") or []:
+                if dedup is not None and dedup.contains((table_name, status.get("id"), status.get("status"))):
+                    duplicates += 1
+                    continue
+                update = parse_status_update(status)
+                table_updates = statuses_by_table.setdefault(table_name, {})
+                table_updates[update["id"]] = merge_status_update(table_updates.get(update["id"]), update)
+
+        statuses_by_table = {table: list(updates.values()) for table, updates in statuses_by_table.items()}
+
+        def write_batch(session):
+            # One connection for the whole delivery: event_id lookups (cache
+            # misses only), the batch write, and the AI reply history reads.
+            for table, rows in messages_by_table.items():
+                for row in rows:
+                    row["event_id"] = get_last_outbound_event_id(db_manager, table, row["wa_id"], session=session)
+            inserted = db_manager.write_webhook_batch(
+                messages_by_table, statuses_by_table if status_applier is None else {}, session=session
             )
-            logger.info(f"Updated message status. ID: {message_id}, Status: {new_status}")
-            return {"status": "success", "message_id": message_id}
-        
+            histories = {}
+            for change_phone_id, message_data in text_messages:
+                if message_data["id"] in inserted:
+                    histories[message_data["id"]] = db_manager.get_conversation_context(
+                        get_table_name(change_phone_id), message_data["wa_id"],
+                        limit=AI_HISTORY_LIMIT, session=session
+                    )
+            return inserted, histories
+
+        inserted_ids = set()
+        histories = {}
+        if messages_by_table or statuses_by_table:
+            try:
+                if messages_by_table or status_applier is None:
+                    inserted_ids, histories = db_manager.run_in_session(write_batch, label='webhook_ingest')
+                if status_applier is not None:
+                    status_applier.apply(statuses_by_table)
+            except psycopg2.Error as e:
+                # Only an outage is worth spooling: the replayer retries the
+                # head entry until it succeeds, so a payload the database
+                # rejects outright (bad data, schema mismatch) would hold
+                # back every webhook spooled after it.
+                if spool is None or not (is_transient(e) or isinstance(e, DatabaseUnavailable)):
+                    raise
+                seq = spool.append(body, error=str(e))
+                return {"status": "spooled", "spool_seq": seq}
+
+            # Only remember events once they're durably stored, so a delivery
+            # that failed isn't mistaken for a duplicate when Meta retries it.
+            if dedup is not None:
+                dedup.add(
+                    *[(table, m["id"]) for table, rows in messages_by_table.items() for m in rows],
+                    *[(table, u["id"], u["status"]) for table, updates in statuses_by_table.items() for u in updates],
+                )
+
+        for change_phone_id, message_data in text_messages:
+            if message_data["id"] not in inserted_ids:
+                logger.info(f"Skipping AI reply for already-stored message {message_data['id']}")
+                continue
+            logger.info(f"Processed incoming text message from {message_data['wa_id']}: {message_data['body']}")
+            send_ai_reply(db_manager, message_data, change_phone_id, history=histories.get(message_data["id"]))
+
+        message_ids = [m["id"] for rows in messages_by_table.values() for m in rows]
+        status_ids = [u["id"] for updates in statuses_by_table.values() for u in updates]
+        if not message_ids and not status_ids:
+            if duplicates:
+                logger.info(f"Dropped redelivered webhook ({duplicates} already-processed event(s))")
+                return {"status": "duplicate", "duplicates": duplicates, "ignored": ignored}
+            return {"status": "ignored", "ignored": ignored}
+        return {
+            "status": "success", "message_ids": message_ids, "status_ids": status_ids,
+            "ignored": ignored, "duplicates": duplicates,
+        }
+
     except (KeyError, IndexError, TypeError) as e:
         logger.error(f"Error processing WhatsApp message: Invalid payload structure - {e}")
         return None
     except Exception as e:
         logger.error(f"Unexpected error processing WhatsApp message: {e}")
-        return None
\ No newline at end of file
+        return None
@@ -1,21 +1,42 @@
-from flask import Blueprint, request, render_template, jsonify, Response
+from flask import Blueprint, request, render_template, jsonify, Response, json, stream_with_context
 from utils.whatsapp_utils import (
     process_whatsapp_message, send_message, send_image_message, 
-    download_whatsapp_image, get_table_name, get_text_message_input
+    download_whatsapp_image, get_table_name, get_text_message_input,
+    iter_webhook_changes
 )
 from utils.db_manager import db_manager
+from utils.row_formats import iter_csv, iter_json_array, iter_ndjson
+from utils.conversation_summaries import (
+    chat_changes_query, chat_cursor_query, chat_list_query, decode_page_cursor, encode_page_cursor,
+)
+from utils.threads import (
+    decode_message_cursor, encode_message_cursor, thread_page_query, thread_updates_query,
+)
+from utils.stream_events import StreamHub, iter_stream, read_event, stream_target
+from utils import metrics
 from utils.digest import run_daily_digest
+from utils.webhook_queue import WebhookQueue
+from utils.spool import WebhookSpool
+from utils.status_applier import StatusApplier
+from utils.dedup import RecentlySeen
+from decorators.security import ops_secret_required
 from config import (
     VERIFY_TOKEN, ACCOUNT1_PHONE_ID_EVENTIO, ACCOUNT1_PHONE_ID_PACKAGE,
-    ACCOUNT1_PHONE_ID_MWSMILE, ACCOUNT2_PHONE_ID
+    ACCOUNT1_PHONE_ID_MWSMILE, ACCOUNT2_PHONE_ID,
+    WEBHOOK_INGEST_MODE, WEBHOOK_QUEUE_PATH, WEBHOOK_QUEUE_WORKERS,
+    WEBHOOK_QUEUE_LEASE_SECONDS, WEBHOOK_QUEUE_MAX_ATTEMPTS,
+    WEBHOOK_SPOOL_ENABLED, WEBHOOK_SPOOL_PATH, STATUS_COALESCE_WINDOW_MS,
+    WEBHOOK_DEDUP_CAPACITY, WEBHOOK_DEDUP_TTL_SECONDS,
+    STREAM_POLL_MS, STREAM_HEARTBEAT_SECONDS, STREAM_MAX_SECONDS
 )
-from datetime import datetime
-import csv
-import io
+from datetime import datetime, timezone
 import logging
 import base64
+import hashlib
 import hmac
 import os
+import time
+import zlib
 from werkzeug.utils import secure_filename
 
 bp = Blueprint('whatsapp', __name__)
@@ -30,10 +51,80 @@ EXPORT_TABLES = {
     'ignitiohub': ('Ignitio Hub', 'public.ignitiohub_messages'),
 }
 
+# Most chats /api/chats returns in one response.
+CHAT_LIST_LIMIT = 500
+
+# Messages per /api/chats/<wa_id> page by default, and at most.
+THREAD_PAGE_SIZE = 50
+THREAD_PAGE_LIMIT = 500
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
 
+# Recently processed message ids / status tuples, so Meta's redeliveries are
+# dropped before any DB work (and can't trigger a second AI reply).
+webhook_dedup = RecentlySeen(
+    capacity=int(WEBHOOK_DEDUP_CAPACITY),
+    ttl_seconds=int(WEBHOOK_DEDUP_TTL_SECONDS),
+)
+
+# Status callbacks from concurrent deliveries are coalesced for a short
+# window and applied with one UPDATE per table (forward transitions only).
+status_applier = None
+if int(STATUS_COALESCE_WINDOW_MS) > 0:
+    status_applier = StatusApplier(db_manager, window_ms=int(STATUS_COALESCE_WINDOW_MS))
+
+# Open /api/stream connections in this process share one poller of
+# stream_events (see utils/stream_events.py). The stream is opt-in (see
+# STREAM_ENABLED in config.py); with it off the dashboards poll instead and
+# no events are recorded.
+stream_enabled = db_manager.stream_events
+stream_hub = StreamHub(db_manager, poll_interval=int(STREAM_POLL_MS) / 1000.0)
+
+# Batches Postgres can't accept (Neon waking up, brief outage) are journalled
+# locally and replayed in order once it's back, instead of 500ing to Meta.
+webhook_spool = None
+
+
+def ingest_webhook(body, use_spool=True):
+    """Run process_whatsapp_message with this process's ingest components."""
+    started = time.perf_counter()
+    result = None
+    try:
+        result = process_whatsapp_message(
+            db_manager, body,
+            spool=webhook_spool if use_spool else None,
+            status_applier=status_applier,
+            dedup=webhook_dedup,
+        )
+        return result
+    finally:
+        outcome = 'failed' if result is None else result.get('status', 'ok')
+        metrics.WEBHOOK_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+
+
+if WEBHOOK_SPOOL_ENABLED.lower() in ('1', 'true', 'yes'):
+    webhook_spool = WebhookSpool(
+        WEBHOOK_SPOOL_PATH,
+        # A replay that fails again must stay in the spool, not re-spool.
+        replay=lambda body: ingest_webhook(body, use_spool=False),
+    )
+    webhook_spool.ensure_started()
+
+# In "queue" ingest mode the webhook only persists the raw payload and acks
+# Meta immediately; background workers run process_whatsapp_message on it.
+webhook_queue = None
+if WEBHOOK_INGEST_MODE == 'queue':
+    webhook_queue = WebhookQueue(
+        WEBHOOK_QUEUE_PATH,
+        handler=ingest_webhook,
+        workers=int(WEBHOOK_QUEUE_WORKERS),
+        lease_seconds=int(WEBHOOK_QUEUE_LEASE_SECONDS),
+        max_attempts=int(WEBHOOK_QUEUE_MAX_ATTEMPTS),
+    )
+    webhook_queue.ensure_started()
+
 @bp.route('/webhook', methods=['GET', 'POST'])
 def webhook():
     """Webhook for both Meta Business Accounts (Eventio/Package and Ignitio)."""
@@ -51,40 +142,173 @@ def webhook():
             logger.error("No data received in webhook")
             return jsonify({'status': 'error', 'message': 'No data received'}), 400
 
-        phone_number_id = data.get('entry', [{}])[0].get('changes', [{}])[0].get('value', {}).get('metadata', {}).get('phone_number_id')
-        if not phone_number_id:
+        # Each change is routed by its own metadata.phone_number_id inside
+        # process_whatsapp_message; here we only reject payloads with none.
+        phone_number_ids = {phone_id for phone_id, _ in iter_webhook_changes(data) if phone_id}
+        if not phone_number_ids:
             logger.error("No phone_number_id in webhook data")
             return jsonify({'status': 'error', 'message': 'Invalid webhook data'}), 400
 
-        logger.debug(f"Processing webhook for phone_number_id: {phone_number_id}")
-        result = process_whatsapp_message(db_manager, data, phone_number_id)
+        if webhook_queue is not None:
+            job_id = webhook_queue.enqueue(data)
+            logger.debug(f"Queued webhook job {job_id} for phone_number_id(s): {', '.join(sorted(phone_number_ids))}")
+            return jsonify({'status': 'queued', 'job_id': job_id}), 200
+
+        logger.debug(f"Processing webhook for phone_number_id(s): {', '.join(sorted(phone_number_ids))}")
+        result = ingest_webhook(data)
         if result:
             return jsonify(result), 200
         return jsonify({'status': 'error', 'message': 'Failed to process message'}), 500
 
+@bp.route('/api/webhook-queue', methods=['GET'])
+@ops_secret_required
+def webhook_queue_stats():
+    """Queue depth for the background webhook workers (queue ingest mode only)."""
+    if webhook_queue is None:
+        return jsonify({'status': 'success', 'mode': WEBHOOK_INGEST_MODE, 'queue': None})
+    return jsonify({'status': 'success', 'mode': WEBHOOK_INGEST_MODE, 'queue': webhook_queue.stats()})
+
+@bp.route('/api/webhook-spool', methods=['GET'])
+@ops_secret_required
+def webhook_spool_stats():
+    """Spool size and replay lag for webhooks waiting on the database."""
+    if webhook_spool is None:
+        return jsonify({'status': 'success', 'enabled': False, 'spool': None})
+    return jsonify({'status': 'success', 'enabled': True, 'spool': webhook_spool.stats()})
+
+@bp.route('/api/status-applier', methods=['GET'])
+@ops_secret_required
+def status_applier_stats():
+    """Write counts and DB time for coalesced status updates."""
+    if status_applier is None:
+        return jsonify({'status': 'success', 'enabled': False, 'stats': None})
+    return jsonify({'status': 'success', 'enabled': True, 'stats': status_applier.stats()})
+
+@bp.route('/api/group-commit', methods=['GET'])
+@ops_secret_required
+def group_commit_stats():
+    """Group sizes and DB time for group-committed message writes."""
+    if db_manager.group_commit is None:
+        return jsonify({'status': 'success', 'enabled': False, 'stats': None})
+    return jsonify({'status': 'success', 'enabled': True, 'stats': db_manager.group_commit.stats()})
+
+@bp.route('/api/stream-hub', methods=['GET'])
+@ops_secret_required
+def stream_hub_stats():
+    """Open /api/stream connections and event poll counters for this worker."""
+    return jsonify({'status': 'success', 'stats': stream_hub.stats()})
+
+@bp.route('/api/webhook-dedup', methods=['GET'])
+@ops_secret_required
+def webhook_dedup_stats():
+    """Hit/miss counters for the redelivery dedup cache."""
+    return jsonify({'status': 'success', 'stats': webhook_dedup.stats()})
+
+@bp.route('/api/db-health', methods=['GET'])
+@ops_secret_required
+def db_health():
+    """
+    Database circuit breaker state ('closed' is healthy, 'open' is shedding
+    load) and, if configured, read replica lag and availability.
+    """
+    stats = db_manager.breaker.stats()
+    replicas = db_manager.replicas.stats() if db_manager.replicas is not None else None
+    return jsonify({'status': 'success', 'healthy': stats['state'] == 'closed', 'breaker': stats,
+                    'replicas': replicas})
+
+@bp.route('/api/db-pool', methods=['GET'])
+@ops_secret_required
+def db_pool_stats():
+    """Connection pool usage (pooled mode only)."""
+    if db_manager.pool is None:
+        return jsonify({'status': 'success', 'enabled': False, 'stats': None})
+    return jsonify({'status': 'success', 'enabled': True, 'stats': db_manager.pool.stats()})
+
+@bp.route('/api/slow-queries', methods=['GET'])
+@ops_secret_required
+def slow_queries():
+    """
+    Recent statements over the slow-query threshold, newest first, with the
+    EXPLAIN plan when one was sampled. ?label= narrows to one statement
+    label, ?limit= caps the count (default 50). Requires OPS_SECRET (see
+    decorators/security.py).
+    """
+    if db_manager.slow_queries is None:
+        return jsonify({'status': 'success', 'enabled': False, 'stats': None, 'queries': []})
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'limit must be an integer'}), 400
+    return jsonify({
+        'status': 'success',
+        'enabled': True,
+        'stats': db_manager.slow_queries.stats(),
+        'queries': db_manager.slow_queries.entries(limit=limit, label=request.args.get('label')),
+    })
+
+@bp.route('/metrics', methods=['GET'])
+@ops_secret_required
+def prometheus_metrics():
+    """
+    Prometheus scrape endpoint: per-statement DB latency / rows / retries,
+    connect time, webhook and Graph API latency, plus the ingest and
+    database components' own counters as gauges. Per worker process.
+    Requires OPS_SECRET - give the scrape config it as a bearer token.
+    """
+    extra = []
+    components = {
+        'webhook_queue': webhook_queue,
+        'webhook_spool': webhook_spool,
+        'status_applier': status_applier,
+        'webhook_dedup': webhook_dedup,
+        'outbound_event_cache': db_manager.outbound_event_cache,
+        'db_pool': db_manager.pool,
+        'group_commit': db_manager.group_commit,
+        'slow_queries': db_manager.slow_queries,
+    }
+    for component, obj in components.items():
+        if obj is not None:
+            extra += metrics.stats_gauges(component, obj.stats())
+
+    breaker = db_manager.breaker.stats()
+    extra += metrics.stats_gauges('db_breaker', breaker)
+    extra += metrics.labelled_gauge(
+        'db_breaker_state',
+        {state: int(breaker['state'] == state) for state in ('closed', 'open', 'half_open')},
+        'state',
+    )
+    if db_manager.replicas is not None:
+        replicas = db_manager.replicas.stats()
+        extra += metrics.stats_gauges('db_replicas', replicas)
+        extra += metrics.labelled_gauge(
+            'db_replica_lag_seconds', {r['dsn']: r['lag_seconds'] for r in replicas['replicas']}, 'replica')
+        extra += metrics.labelled_gauge(
+            'db_replica_usable', {r['dsn']: int(r['usable']) for r in replicas['replicas']}, 'replica')
+    return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
 @bp.route('/eventio')
 def eventio():
     """Render Eventio page."""
     logger.debug(f"Rendering eventio page with phone_id: {ACCOUNT1_PHONE_ID_EVENTIO}")
-    return render_template('eventio.html', phone_id=ACCOUNT1_PHONE_ID_EVENTIO)
+    return render_template('eventio.html', phone_id=ACCOUNT1_PHONE_ID_EVENTIO, stream_enabled=stream_enabled)
 
 @bp.route('/')
 def package_with_sense():
     """Render Package with Sense page (now the default root page)."""
     logger.debug(f"Rendering package_with_sense page with phone_id: {ACCOUNT1_PHONE_ID_PACKAGE}")
-    return render_template('index.html', phone_id=ACCOUNT1_PHONE_ID_PACKAGE)
+    return render_template('index.html', phone_id=ACCOUNT1_PHONE_ID_PACKAGE, stream_enabled=stream_enabled)
 
 @bp.route('/mwsmile')
 def mwsmile():
     """Render MWsmile page."""
     logger.debug(f"Rendering mwsmile page with phone_id: {ACCOUNT1_PHONE_ID_MWSMILE}")
-    return render_template('mwsmile.html', phone_id=ACCOUNT1_PHONE_ID_MWSMILE)
+    return render_template('mwsmile.html', phone_id=ACCOUNT1_PHONE_ID_MWSMILE, stream_enabled=stream_enabled)
 
 @bp.route('/ignitiohub')
 def ignitiohub():
     """Render Ignitio Hub page."""
     logger.debug(f"Rendering ignitiohub page with phone_id: {ACCOUNT2_PHONE_ID}")
-    return render_template('ignitiohub.html', phone_id=ACCOUNT2_PHONE_ID)
+    return render_template('ignitiohub.html', phone_id=ACCOUNT2_PHONE_ID, stream_enabled=stream_enabled)
 
 @bp.route('/export')
 def export_page():
@@ -129,91 +353,278 @@ def get_image(image_id, phone_id):
 
 @bp.route('/messages/<phone_id>')
 def get_messages(phone_id):
-    """Retrieve messages for a given phone_id."""
+    """
+    Stream a business's messages, newest first, as newline-delimited JSON
+    (application/x-ndjson, one message object per line).
+
+    Optional filters: ?since= and ?until= (ISO timestamps; since inclusive,
+    until exclusive - pass the oldest timestamp received as ?until= to
+    resume) and ?limit=. Gzipped on the fly when the client accepts it.
+    """
+    try:
+        since = request.args.get('since')
+        since = datetime.fromisoformat(since) if since else None
+        if since is not None and since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        until = request.args.get('until')
+        until = datetime.fromisoformat(until) if until else None
+        if until is not None and until.tzinfo is None:
+            until = until.replace(tzinfo=timezone.utc)
+        limit = request.args.get('limit')
+        limit = int(limit) if limit else None
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be positive")
+    except ValueError:
+        return jsonify({
+            'status': 'error',
+            'message': 'since and until must be ISO timestamps and limit a positive integer',
+        }), 400
+
     try:
         table_name = get_table_name(phone_id)
-        logger.debug(f"Fetching messages from {table_name} for phone_id {phone_id}")
-        messages = db_manager.execute_query(
-            f"SELECT * FROM {table_name} ORDER BY timestamp DESC",
-            fetch=True
+        logger.debug(f"Streaming messages from {table_name} for phone_id {phone_id} since {since} until {until}")
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("timestamp >= %s")
+            params.append(since)
+        if until is not None:
+            conditions.append("timestamp < %s")
+            params.append(until)
+        query = f"SELECT * FROM {table_name}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY timestamp DESC"
+        if limit is not None:
+            query += " LIMIT %s"
+            params.append(limit)
+
+        # Streamed through a server-side cursor (idx_<table>_timestamp lets
+        # it start without sorting the table), one NDJSON block per fetched
+        # chunk, so memory stays flat for any size. The first chunk is
+        # fetched up front so a failing query still gets a proper 500.
+        chunks = db_manager.iter_query(
+            query, tuple(params), row_format='tuple', use_replica=True, label='messages_stream',
         )
-        return jsonify(messages)
+        first = next(chunks, [])
     except Exception as e:
         logger.error(f"Error fetching messages for phone_id {phone_id}: {e}")
         return jsonify({'status': 'error', 'message': 'Failed to fetch messages'}), 500
 
+    body = iter_ndjson(_chain_first(first, chunks), json.dumps)
+    headers = {'Vary': 'Accept-Encoding'}
+    if request.accept_encodings['gzip'] > 0:
+        body = _gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(body), mimetype='application/x-ndjson', headers=headers)
+
+def _chain_first(first, chunks):
+    """Re-attach a chunk pulled early (to surface query errors) to its stream."""
+    if first:
+        yield first
+    yield from chunks
+
+def _gzip_stream(pieces, level=6):
+    """
+    Gzip a stream of text pieces on the fly, flushing after each one so the
+    client receives every chunk as soon as it has been fetched.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for piece in pieces:
+        data = compressor.compress(piece.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
 # NEW API ENDPOINTS FOR THE CHAT INTERFACE
 
 @bp.route('/api/chats', methods=['GET'])
 def get_chats():
-    """Get all chats grouped by wa_id with last message info."""
+    """
+    Most recently active chats with their last message and unread count,
+    read from conversation_summaries (see utils/conversation_summaries.py).
+    ?limit= sets the page size (default and maximum CHAT_LIST_LIMIT) and
+    ?q= narrows the list to names / phone numbers containing it.
+
+    A page ends with an opaque `next` cursor (null on the last page): pass
+    it back as ?after= for the page that follows. Pollers pass the `cursor`
+    of their first page (and of every poll since) as ?since= to get only
+    the chats that changed after it (oldest change first; a few seconds of
+    overlap, so merge by wa_id keeping the newer updated_at). If a full
+    page of them changed, the response is a fresh first page instead, with
+    `full` set: replace the list rather than merging. Responses carry a
+    strong ETag: send it as If-None-Match and an unchanged result is a
+    bodiless 304.
+    """
     try:
         phone_id = request.args.get('phone_id')
         if not phone_id:
             return jsonify({'status': 'error', 'message': 'Phone ID required'}), 400
-        
+        q = request.args.get('q', '').strip() or None
+        try:
+            limit = max(1, min(int(request.args.get('limit', CHAT_LIST_LIMIT)), CHAT_LIST_LIMIT))
+            since = request.args.get('since')
+            since = datetime.fromisoformat(since) if since else None
+            if since is not None and since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            after = request.args.get('after')
+            after = decode_page_cursor(after) if after else None
+        except ValueError:
+            return jsonify({
+                'status': 'error',
+                'message': 'limit must be an integer, since an ISO timestamp and after a page cursor',
+            }), 400
+        if since is not None and after is not None:
+            return jsonify({'status': 'error', 'message': 'since and after cannot be combined'}), 400
+
         table_name = get_table_name(phone_id)
-        logger.debug(f"Fetching chats from {table_name}")
-        
-        # Use subquery to get last message per wa_id
-        query = f"""
-            WITH latest_messages AS (
-                SELECT DISTINCT ON (wa_id)
-                    wa_id,
-                    name,
-                    timestamp as last_message_timestamp,
-                    body as last_body
-                FROM {table_name}
-                ORDER BY wa_id, timestamp DESC
-            ),
-            unread_counts AS (
-                SELECT 
-                    wa_id,
-                    COUNT(*) as unread_count
-                FROM {table_name}
-                WHERE direction = 'inbound' AND read = FALSE
-                GROUP BY wa_id
-            )
-            SELECT 
-                lm.wa_id,
-                lm.name,
-                lm.last_message_timestamp,
-                lm.last_body,
-                COALESCE(uc.unread_count, 0) as unread_count
-            FROM latest_messages lm
-            LEFT JOIN unread_counts uc ON lm.wa_id = uc.wa_id
-            ORDER BY lm.last_message_timestamp DESC
-        """
-        
-        chats = db_manager.execute_query(query, fetch=True)
-        return jsonify({'status': 'success', 'chats': chats})
+        logger.debug(f"Fetching chats from {table_name} since {since} after {after} q={q!r}")
+
+        def work(session):
+            if since is not None:
+                chats = session.execute(*chat_changes_query(table_name, since, limit, q=q))
+                if len(chats) < limit:
+                    return chats, max([since] + [chat['updated_at'] for chat in chats]), None, False
+                # More changed than one response holds (and the overlap could
+                # keep re-sending the same rows): start the client over.
+            chats = session.execute(*chat_list_query(table_name, limit, after=after, q=q))
+            next_page = encode_page_cursor(chats[-1]) if len(chats) == limit else None
+            if after is not None:
+                return chats, None, next_page, False
+            cursor = session.execute(*chat_cursor_query(table_name))[0]['cursor']
+            return chats, cursor, next_page, True
+
+        chats, cursor, next_page, full = db_manager.run_in_session(work, use_replica=True, label='chats_list')
+        response = jsonify({
+            'status': 'success',
+            'chats': chats,
+            'cursor': cursor.isoformat() if cursor else None,
+            'next': next_page,
+            'full': full,
+        })
+        response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
     except Exception as e:
         logger.error(f"Error fetching chats: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @bp.route('/api/chats/<wa_id>', methods=['GET'])
 def get_chat_messages(wa_id):
-    """Get all messages for a specific chat."""
+    """
+    One page of a chat's messages, oldest first (see utils/threads.py).
+    Without a cursor it is the newest ?limit= messages (default
+    THREAD_PAGE_SIZE, at most THREAD_PAGE_LIMIT).
+
+    The response's `before` (null once the start of the thread is reached)
+    goes back as ?before= for the next older page. Its `after` goes back as
+    ?after= to poll for messages newer than those shown; a poll that also
+    passes the latest `updated_at` as ?updated_since= gets `updates` too:
+    shown messages whose status changed since.
+    """
     try:
         phone_id = request.args.get('phone_id')
         if not phone_id:
             return jsonify({'status': 'error', 'message': 'Phone ID required'}), 400
-        
+        try:
+            limit = max(1, min(int(request.args.get('limit', THREAD_PAGE_SIZE)), THREAD_PAGE_LIMIT))
+            before = request.args.get('before')
+            before = decode_message_cursor(before) if before else None
+            after = request.args.get('after')
+            after = decode_message_cursor(after) if after else None
+            updated_since = request.args.get('updated_since')
+            updated_since = datetime.fromisoformat(updated_since) if updated_since else None
+            if updated_since is not None and updated_since.tzinfo is None:
+                updated_since = updated_since.replace(tzinfo=timezone.utc)
+        except ValueError:
+            return jsonify({
+                'status': 'error',
+                'message': 'limit must be an integer, before/after message cursors and updated_since an ISO timestamp',
+            }), 400
+        if before is not None and after is not None:
+            return jsonify({'status': 'error', 'message': 'before and after cannot be combined'}), 400
+
         table_name = get_table_name(phone_id)
-        logger.debug(f"Fetching messages for wa_id {wa_id} from {table_name}")
-        
-        query = f"""
-            SELECT * FROM {table_name}
-            WHERE wa_id = %s
-            ORDER BY timestamp ASC
-        """
-        
-        messages = db_manager.execute_query(query, (wa_id,), fetch=True)
-        return jsonify({'status': 'success', 'messages': messages})
+        logger.debug(f"Fetching messages for wa_id {wa_id} from {table_name} before {before} after {after}")
+
+        def work(session):
+            messages = session.execute(*thread_page_query(table_name, wa_id, limit, before=before, after=after))
+            updates = []
+            if after is not None and updated_since is not None:
+                updates = session.execute(*thread_updates_query(table_name, wa_id, after, updated_since, limit))
+            return messages, updates
+
+        messages, updates = db_manager.run_in_session(work, label='thread')
+        updated_at = max(
+            [row['updated_at'] for row in messages + updates if row.get('updated_at')]
+            + ([updated_since] if updated_since else []),
+            default=None,
+        )
+        response = {
+            'status': 'success',
+            'messages': messages,
+            'before': encode_message_cursor(messages[0]) if after is None and len(messages) == limit else None,
+            'after': None,
+            'updated_at': updated_at.isoformat() if updated_at else None,
+        }
+        if before is None:
+            response['after'] = encode_message_cursor(messages[-1]) if messages else request.args.get('after')
+        if after is not None:
+            response['updates'] = updates
+        return jsonify(response)
     except Exception as e:
         logger.error(f"Error fetching messages for wa_id {wa_id}: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@bp.route('/api/stream', methods=['GET'])
+def event_stream():
+    """
+    Server-Sent Events for one business's dashboard: message.created,
+    message.status and conversation.read as they are written (see
+    utils/stream_events.py), resuming after the Last-Event-ID header (or a
+    last_event_id parameter) when given.
+
+    404 unless STREAM_ENABLED is set: a stream holds its worker thread for
+    up to STREAM_MAX_SECONDS, so it needs threaded workers (see config.py).
+
+    Query params:
+        phone_id (str): The business.
+        last_event_id (int): Optional; as the Last-Event-ID header.
+    """
+    if not stream_enabled:
+        return jsonify({'status': 'error', 'message': 'Event stream is disabled'}), 404
+    phone_id = request.args.get('phone_id')
+    if not phone_id:
+        return jsonify({'status': 'error', 'message': 'phone_id required'}), 400
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'invalid Last-Event-ID'}), 400
+
+    try:
+        _, tenant = stream_target(get_table_name(phone_id))
+        # Subscribe before reading the backlog, so nothing committed in
+        # between is missed (an event in both is just sent twice).
+        subscription = stream_hub.subscribe(tenant)
+        try:
+            backlog = [] if last_event_id is None else stream_hub.backlog(tenant, last_event_id)
+        except Exception:
+            stream_hub.unsubscribe(subscription)
+            raise
+    except Exception as e:
+        logger.error(f"Error opening event stream for phone_id {phone_id}: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+    frames = iter_stream(
+        stream_hub, subscription, backlog,
+        heartbeat_seconds=int(STREAM_HEARTBEAT_SECONDS),
+        max_seconds=int(STREAM_MAX_SECONDS),
+    )
+    return Response(stream_with_context(frames), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
 @bp.route('/api/mark-read', methods=['POST'])
 def mark_read():
     """Mark all messages from a wa_id as read."""
@@ -233,8 +644,14 @@ def mark_read():
             SET read = TRUE
             WHERE wa_id = %s AND direction = 'inbound' AND read = FALSE
         """
-        
-        db_manager.execute_query(query, (wa_id,))
+
+        def work(session):
+            session.execute(query, (wa_id,))
+            if session.cursor.rowcount:
+                db_manager.refresh_conversation_summaries({table_name: [wa_id]}, session=session)
+                db_manager.record_stream_events({table_name: [read_event(wa_id)]}, session=session)
+
+        db_manager.run_in_session(work, label='mark_read')
         return jsonify({'status': 'success'})
     except Exception as e:
         logger.error(f"Error marking messages as read: {e}")
@@ -446,8 +863,16 @@ def get_messages_since():
             query = base_query + " ORDER BY updated_at ASC LIMIT %s"
             params = (limit,)
 
-        messages = db_manager.execute_query(query, params, fetch=True)
-        return jsonify({'status': 'success', 'phone_id': phone_id, 'messages': messages})
+        # Tuples + header rather than a dict per row (up to 5000 per poll);
+        # the body is assembled to match what jsonify() produced before.
+        messages = db_manager.execute_query(
+            query, params, fetch=True, row_format='tuple', use_replica=True, label='messages_since'
+        )
+        body = (
+            '{"messages":' + "".join(iter_json_array([messages], json.dumps))
+            + ',"phone_id":' + json.dumps(phone_id) + ',"status":"success"}\n'
+        )
+        return Response(body, mimetype='application/json')
 
     except Exception as e:
         logger.error(f"Error fetching messages since={since} for phone_id={phone_id}: {e}")
@@ -494,7 +919,7 @@ def get_event_messages(event_id):
             LIMIT %s
         """
 
-        messages = db_manager.execute_query(query, tuple(params), fetch=True)
+        messages = db_manager.execute_query(query, tuple(params), fetch=True, use_replica=True, label='event_messages')
         return jsonify({'status': 'success', 'event_id': event_id, 'messages': messages})
 
     except Exception as e:
@@ -558,7 +983,9 @@ def get_event_conversations(event_id):
             ORDER BY lm.last_ts DESC
         """
 
-        conversations = db_manager.execute_query(query, (event_id, event_id, event_id), fetch=True)
+        conversations = db_manager.execute_query(
+            query, (event_id, event_id, event_id), fetch=True, use_replica=True, label='event_conversations'
+        )
         return jsonify({'status': 'success', 'event_id': event_id, 'conversations': conversations})
 
     except Exception as e:
@@ -580,20 +1007,24 @@ def get_event_guest_thread(event_id, wa_id):
 
         table_name = get_table_name(phone_id)
 
-        messages = db_manager.execute_query(f"""
-            SELECT id, wa_id, name, type, body, timestamp, direction,
-                   status, read, image_url, template_name, error_details
-            FROM {table_name}
-            WHERE event_id = %s AND wa_id = %s
-            ORDER BY timestamp ASC
-        """, (event_id, wa_id), fetch=True)
-
-        # Mark inbound messages as read now that they're being viewed
-        db_manager.execute_query(f"""
-            UPDATE {table_name}
-            SET read = TRUE
-            WHERE event_id = %s AND wa_id = %s AND direction = 'inbound' AND read = FALSE
-        """, (event_id, wa_id))
+        with db_manager.session(label='event_thread') as session:
+            messages = session.execute(f"""
+                SELECT id, wa_id, name, type, body, timestamp, direction,
+                       status, read, image_url, template_name, error_details
+                FROM {table_name}
+                WHERE event_id = %s AND wa_id = %s
+                ORDER BY timestamp ASC
+            """, (event_id, wa_id))
+
+            # Mark inbound messages as read now that they're being viewed
+            session.execute(f"""
+                UPDATE {table_name}
+                SET read = TRUE
+                WHERE event_id = %s AND wa_id = %s AND direction = 'inbound' AND read = FALSE
+            """, (event_id, wa_id))
+            if session.cursor.rowcount:
+                db_manager.refresh_conversation_summaries({table_name: [wa_id]}, session=session)
+                db_manager.record_stream_events({table_name: [read_event(wa_id)]}, session=session)
 
         return jsonify({'status': 'success', 'event_id': event_id, 'wa_id': wa_id, 'messages': messages})
 
@@ -615,32 +1046,33 @@ def get_event_stats(event_id):
 
         table_name = get_table_name(phone_id)
 
-        stats = db_manager.execute_query(f"""
-            SELECT
-                COUNT(*)                                                          AS total_messages,
-                COUNT(*) FILTER (WHERE direction = 'outbound')                    AS sent,
-                COUNT(*) FILTER (WHERE direction = 'outbound' AND status = 'delivered') AS delivered,
-                COUNT(*) FILTER (WHERE direction = 'outbound' AND status = 'read')      AS read_by_guest,
-                COUNT(*) FILTER (WHERE direction = 'outbound' AND status = 'failed')    AS failed,
-                COUNT(*) FILTER (WHERE direction = 'inbound')                     AS replies,
-                COUNT(DISTINCT wa_id) FILTER (WHERE direction = 'outbound')       AS unique_guests_messaged,
-                COUNT(DISTINCT wa_id) FILTER (WHERE direction = 'inbound')        AS unique_guests_replied,
-                MIN(timestamp) FILTER (WHERE direction = 'outbound')              AS first_sent_at,
-                MAX(timestamp) FILTER (WHERE direction = 'outbound')              AS last_sent_at
-            FROM {table_name}
-            WHERE event_id = %s
-        """, (event_id,), fetch=True)
+        with db_manager.session(use_replica=True, label='event_stats') as session:
+            stats = session.execute(f"""
+                SELECT
+                    COUNT(*)                                                          AS total_messages,
+                    COUNT(*) FILTER (WHERE direction = 'outbound')                    AS sent,
+                    COUNT(*) FILTER (WHERE direction = 'outbound' AND status = 'delivered') AS delivered,
+                    COUNT(*) FILTER (WHERE direction = 'outbound' AND status = 'read')      AS read_by_guest,
+                    COUNT(*) FILTER (WHERE direction = 'outbound' AND status = 'failed')    AS failed,
+                    COUNT(*) FILTER (WHERE direction = 'inbound')                     AS replies,
+                    COUNT(DISTINCT wa_id) FILTER (WHERE direction = 'outbound')       AS unique_guests_messaged,
+                    COUNT(DISTINCT wa_id) FILTER (WHERE direction = 'inbound')        AS unique_guests_replied,
+                    MIN(timestamp) FILTER (WHERE direction = 'outbound')              AS first_sent_at,
+                    MAX(timestamp) FILTER (WHERE direction = 'outbound')              AS last_sent_at
+                FROM {table_name}
+                WHERE event_id = %s
+            """, (event_id,))
 
-        # Also get top errors if any failures
-        errors = db_manager.execute_query(f"""
-            SELECT error_details, COUNT(*) AS occurrences
-            FROM {table_name}
-            WHERE event_id = %s AND direction = 'outbound' AND status = 'failed'
-              AND error_details IS NOT NULL
-            GROUP BY error_details
-            ORDER BY occurrences DESC
-            LIMIT 10
-        """, (event_id,), fetch=True)
+            # Also get top errors if any failures
+            errors = session.execute(f"""
+                SELECT error_details, COUNT(*) AS occurrences
+                FROM {table_name}
+                WHERE event_id = %s AND direction = 'outbound' AND status = 'failed'
+                  AND error_details IS NOT NULL
+                GROUP BY error_details
+                ORDER BY occurrences DESC
+                LIMIT 10
+            """, (event_id,))
 
         return jsonify({
             'status': 'success',
@@ -679,7 +1111,7 @@ def link_inbound_to_event(event_id):
             WHERE inbound.event_id IS NULL
               AND inbound.direction = 'inbound'
               AND inbound.wa_id = outbound.wa_id
-        """, (event_id,))
+        """, (event_id,), label='backfill_event_ids')
 
         return jsonify({'status': 'success', 'event_id': event_id, 'message': 'Inbound replies linked'})
 
@@ -738,21 +1170,21 @@ def export_messages():
     query += " ORDER BY timestamp ASC"
 
     try:
-        rows = db_manager.execute_query(query, tuple(params), fetch=True)
+        chunks = db_manager.iter_query(query, tuple(params), row_format='tuple', use_replica=True, label='export')
+        first = next(chunks, [])
     except Exception as e:
         logger.error(f"Export query failed for {table_name}: {e}")
         return jsonify({'status': 'error', 'message': 'Export query failed'}), 500
 
     columns = ['id', 'wa_id', 'name', 'type', 'body', 'timestamp', 'direction', 'status', 'read', 'image_url', 'event_id']
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(columns)
-    for row in rows:
-        writer.writerow([row.get(c) for c in columns])
+
+    # One CSV chunk per fetched batch of rows - memory stays flat for any
+    # date range, and tuple rows are written without per-row lookups.
+    body = iter_csv(_chain_first(first, chunks), columns)
 
     filename = f"{table_key}_{direction}_{start}_to_{end}.csv"
     return Response(
-        output.getvalue(),
+        stream_with_context(body),
         mimetype='text/csv',
         headers={'Content-Disposition': f'attachment; filename="{filename}"'}
     )
\ No newline at end of file